@@ -0,0 +1,204 @@
+import os
+import sys
+import json
+import time
+import tempfile
+import argparse
+import statistics
+from pathlib import Path
+
+# Fast polling and a private component manifest, read by utilities/ when it is imported
+os.environ.setdefault("AOS_POLL_INTERVAL", "0.05")
+os.environ.setdefault("AOS_POLL_MAX_INTERVAL", "0.2")
+BENCHMARK_DIR = tempfile.mkdtemp(prefix="aos-benchmark-")
+os.environ["AOS_COMPONENT_MANIFEST"] = os.path.join(BENCHMARK_DIR, "component-manifest.json")
+
+sys.path.insert(0, os.path.realpath(os.path.join(os.path.dirname(__file__), "..")))
+from Sota.sota import sota_test
+from Fota.fota import fota_test
+from Monitoring.monitoring import monitoring_test
+from Provisioning.provisioning import provision_test
+from utilities.aos import AosCloud
+from utilities.mock_cloud import MockAosCloud
+from utilities.metrics import request_metrics, CallTrace
+from utilities.retry import default_hedger
+from rich.console import Console
+from rich.table import Table
+
+UNIT_ID = "benchmark-unit"
+UNIT_NAME = "benchmark-board"
+UNIT_VERSION = "1.0"
+
+def get_command_line_args():
+    parser = argparse.ArgumentParser(description="Run the test stages end to end against a local AosCloud stand-in")
+    parser.add_argument("--iterations", type = int, default = 3)
+    parser.add_argument("--latency", type = float, default = 0.0,
+                        help = "Seconds added to every response of the stand-in server")
+    parser.add_argument("--jitter", type = float, default = 0.0,
+                        help = "Random seconds added on top of --latency")
+    parser.add_argument("--page-size", type = int, default = 100)
+    parser.add_argument("--error-rate", type = float, default = 0.0,
+                        help = "Probability of a 500 response")
+    parser.add_argument("--transition-delay", type = float, default = 0.5,
+                        help = "Seconds before an upload, approval or deployment completes on the stand-in")
+    parser.add_argument("--server-rate-limit", type = float, default = 0.0,
+                        help = "Requests per second above which the stand-in answers 429 Too Many Requests")
+    parser.add_argument("--slow-rate", type = float, default = 0.0,
+                        help = "Probability of a response delayed by --slow-latency, to simulate tail latency")
+    parser.add_argument("--slow-latency", type = float, default = 2.0)
+    parser.add_argument("--no-etags", action = "store_true",
+                        help = "Do not send ETags or answer conditional GETs with 304 Not Modified")
+    parser.add_argument("--firmware-size", type = int, default = 8,
+                        help = "Size in MB of the generated firmware image")
+    parser.add_argument("--firmware-images", type = int, default = 1,
+                        help = "Number of firmware images, each building its own component, uploaded by the FOTA stage")
+    parser.add_argument("--units", type = int, default = 1,
+                        help = "Number of units registered on the stand-in, the others are background data")
+    parser.add_argument("--json", nargs = "?",
+                        help = "Write the results to a JSON file")
+    parser.add_argument("--verbose", action = "store_true",
+                        help = "Print the requests of each stage per endpoint")
+    parser.add_argument("--budgets", nargs = "?",
+                        help = "JSON file of the maximum number of requests per stage and endpoint, e.g. Benchmark/budgets.json")
+    parser.add_argument("--trace-calls", action = "store_true",
+                        help = "Print the ordered list of requests sent by each stage")
+    return parser.parse_args()
+
+def run_stages(firmware) -> list:
+    """
+        Return type: class 'list' of (stage, function running it)
+    """
+    return [
+        ("Provisioning", lambda: provision_test(unit_ip="127.0.0.1", unit_id=UNIT_ID, unit_name=UNIT_NAME, unit_version=UNIT_VERSION)),
+        ("FOTA", lambda: fota_test(unit_id=UNIT_ID, unit_name=UNIT_NAME, unit_version=UNIT_VERSION, new_firmware=firmware)),
+        ("SOTA", lambda: sota_test(unit_id=UNIT_ID, unit_name=UNIT_NAME, unit_version=UNIT_VERSION)),
+        ("Monitoring", lambda: monitoring_test(unit_id=UNIT_ID))
+    ]
+
+def benchmark(mock, firmware, iterations, budgets=None, trace_calls=False) -> dict:
+    """
+        Run every stage "iterations" times, each pipeline starting with cold client caches.
+        budgets maps a stage to the call budget of CallTrace.check_budget(); a stage exceeding it fails.
+        Return type: class 'dict' mapping each stage to its durations, request counts and results
+    """
+    results = dict()
+    for iteration in range(iterations):
+        AosCloud.Cache.clear()
+        AosCloud.Validators.clear()
+        for resource in AosCloud.Index.endpoints:
+            AosCloud.Index.invalidate(resource)
+        if os.path.exists(AosCloud.ComponentManifest.path):
+            os.remove(AosCloud.ComponentManifest.path)
+        for stage, func in run_stages(firmware):
+            mock.reset_stats()
+            start = time.perf_counter()
+            with CallTrace(stage) as trace:
+                try:
+                    passed = bool(func())
+                except (Exception, SystemExit) as err:
+                    print(f"{stage} FAILED: {err!r}")
+                    passed = False
+            duration = time.perf_counter() - start
+            exceeded = trace.check_budget(budgets[stage]) if budgets and stage in budgets else []
+            if exceeded:
+                print(f"{stage} EXCEEDS ITS CALL BUDGET:")
+                for endpoint, count, maximum in exceeded:
+                    print(f"    {endpoint}: {count} calls, budget {maximum}")
+            if trace_calls or exceeded:
+                print(f"{stage} REQUESTS:\n{trace.format()}")
+            result = results.setdefault(stage, dict(durations=list(), requests=list(), passed=list(), endpoints=dict(), over_budget=list()))
+            result["durations"].append(duration)
+            result["requests"].append(mock.request_count())
+            result["passed"].append(passed)
+            result["over_budget"].append(bool(exceeded))
+            for endpoint, count in mock.requests.items():
+                result["endpoints"].setdefault(endpoint, list()).append(count)
+    return results
+
+def summarize(results: dict) -> dict:
+    summary = dict()
+    for stage, result in results.items():
+        durations = result["durations"]
+        summary[stage] = dict(iterations = len(durations),
+                              mean = statistics.mean(durations),
+                              median = statistics.median(durations),
+                              min = min(durations),
+                              max = max(durations),
+                              requests = statistics.mean(result["requests"]),
+                              passed = all(result["passed"]),
+                              within_budget = not any(result["over_budget"]),
+                              endpoints = {endpoint: statistics.mean(counts) for endpoint, counts in sorted(result["endpoints"].items())})
+    return summary
+
+
+if __name__ == "__main__":
+    args = get_command_line_args()
+    units = [UNIT_ID] + [f"background-unit-{index}" for index in range(1, args.units)]
+    # Several images are named after the component they build on the stand-in
+    images = [f"image-{index}" for index in range(args.firmware_images)] if args.firmware_images > 1 else []
+    mock = MockAosCloud(units = units,
+                        unit_models = [UNIT_NAME],
+                        firmware_components = images or ("rcar-s4-spider-1.0-domd",),
+                        latency = args.latency,
+                        jitter = args.jitter,
+                        page_size = args.page_size,
+                        error_rate = args.error_rate,
+                        transition_delay = args.transition_delay,
+                        etags = not args.no_etags,
+                        rate_limit = args.server_rate_limit,
+                        slow_rate = args.slow_rate,
+                        slow_latency = args.slow_latency,
+                        security_dir = os.path.join(BENCHMARK_DIR, "security")).start()
+    # Point the client and the aos-prov/aos-signer stand-ins to the local server
+    os.environ.update(mock.client_environment())
+    AosCloud.api_url = dict(sp = mock.api_url, oem = mock.api_url)
+    AosCloud.security_dir = Path(mock.security_dir)
+    AosCloud.SessionPool.close()
+    AosCloud.Entities.Unit.monitoring_settle_time = 0
+    bin_dir = os.path.join(BENCHMARK_DIR, "bin")
+    mock.install_tools(bin_dir)
+    os.environ["PATH"] = bin_dir + os.pathsep + os.environ["PATH"]
+
+    if images:
+        firmware = os.path.join(BENCHMARK_DIR, "firmware")
+        os.makedirs(firmware)
+        paths = [os.path.join(firmware, f"{image}.bin") for image in images]
+    else:
+        firmware = os.path.join(BENCHMARK_DIR, "firmware.bin")
+        paths = [firmware]
+    for path in paths:
+        with open(path, "wb") as file:
+            for _ in range(args.firmware_size):
+                file.write(os.urandom(2**20))
+
+    try:
+        budgets = None
+        if args.budgets:
+            with open(args.budgets, "r") as file:
+                budgets = json.load(file)
+        summary = summarize(benchmark(mock, firmware, args.iterations, budgets, args.trace_calls))
+    finally:
+        mock.stop()
+        AosCloud.SessionPool.close()
+
+    table = Table(title=f"AosEdge stage benchmark ({args.iterations} iterations, {args.latency * 1000:.0f}ms latency)")
+    for column in ["Stage", "Mean (s)", "Median (s)", "Min (s)", "Max (s)", "Requests", "Result"]:
+        table.add_column(column)
+    for stage, stats in summary.items():
+        status = "PASS" if stats["passed"] else "FAILED"
+        if not stats["within_budget"]:
+            status += " (over budget)"
+        ok = stats["passed"] and stats["within_budget"]
+        table.add_row(stage, f"{stats['mean']:.3f}", f"{stats['median']:.3f}", f"{stats['min']:.3f}", f"{stats['max']:.3f}",
+                      f"{stats['requests']:.0f}", status, style="bright_green" if ok else "bright_red")
+    console = Console()
+    console.print(table)
+    if args.verbose:
+        for stage, stats in summary.items():
+            console.print(f"{stage}:")
+            for endpoint, count in stats["endpoints"].items():
+                console.print(f"    {count:6.1f}  {endpoint}")
+    if args.json:
+        with open(args.json, "w") as file:
+            json.dump(dict(arguments=vars(args), stages=summary, client=request_metrics.snapshot(), hedged=default_hedger.stats()), file, indent=4)
+    sys.exit(0 if all(stats["passed"] and stats["within_budget"] for stats in summary.values()) else 1)
@@ -0,0 +1,115 @@
+import sys
+import gzip
+import json
+import time
+import random
+import argparse
+import threading
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+
+class TelemetryReceiver():
+    """
+        Local stand-in of the webhook receiving the readings of Sota/src/dummy_sensor.py. Accepts
+        JSON objects or arrays of them, gzipped or not, over kept-alive connections, and counts
+        requests, readings and bytes. A "latency" and an "error_rate" (503 responses) can be
+        injected to see how the sender behaves when the receiver is slow or failing.
+    """
+    def __init__(self, port=0, latency=0.0, error_rate=0.0):
+        self.port = port
+        self.latency = latency
+        self.error_rate = error_rate
+        self.stats = dict(requests=0, readings=0, received_bytes=0, errors=0, connections=0)
+        self._lock = threading.Lock()
+        self._server = None
+        self.started = None
+
+    @property
+    def url(self) -> str:
+        return f"http://127.0.0.1:{self.port}/telemetry"
+
+    def start(self):
+        receiver = self
+
+        class _Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+            disable_nagle_algorithm = True
+
+            def setup(self):
+                super().setup()
+                with receiver._lock:
+                    receiver.stats["connections"] += 1
+
+            def do_POST(self):
+                body = self.rfile.read(int(self.headers.get("Content-Length") or 0))
+                if receiver.latency:
+                    time.sleep(receiver.latency)
+                status = 200
+                if receiver.error_rate and random.random() < receiver.error_rate:
+                    status = 503
+                else:
+                    try:
+                        if self.headers.get("Content-Encoding") == "gzip":
+                            body = gzip.decompress(body)
+                        payload = json.loads(body)
+                    except (OSError, ValueError):
+                        status = 400
+                with receiver._lock:
+                    receiver.stats["requests"] += 1
+                    receiver.stats["received_bytes"] += int(self.headers.get("Content-Length") or 0)
+                    if status == 200:
+                        receiver.stats["readings"] += len(payload) if isinstance(payload, list) else 1
+                    else:
+                        receiver.stats["errors"] += 1
+                self.send_response(status)
+                self.send_header("Content-Length", "0")
+                self.end_headers()
+
+            def log_message(self, format, *args):
+                pass
+
+        self._server = ThreadingHTTPServer(("127.0.0.1", self.port), _Handler)
+        self._server.daemon_threads = True
+        self.port = self._server.server_address[1]
+        threading.Thread(target=self._server.serve_forever, name="telemetry-receiver", daemon=True).start()
+        self.started = time.monotonic()
+        return self
+
+    def stop(self) -> None:
+        if self._server is not None:
+            self._server.shutdown()
+            self._server.server_close()
+            self._server = None
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.stop()
+
+    def snapshot(self) -> dict:
+        with self._lock:
+            stats = dict(self.stats)
+        stats["elapsed"] = time.monotonic() - self.started
+        stats["readings_per_second"] = stats["readings"] / stats["elapsed"] if stats["elapsed"] else 0.0
+        return stats
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Receive and count the readings of the sample sensor service")
+    parser.add_argument("--port", type = int, default = 8080)
+    parser.add_argument("--latency", type = float, default = 0.0,
+                        help = "Seconds added to every response")
+    parser.add_argument("--error-rate", type = float, default = 0.0,
+                        help = "Probability of a 503 response")
+    parser.add_argument("--interval", type = float, default = 5.0,
+                        help = "Seconds between two printed counts")
+    args = parser.parse_args()
+    receiver = TelemetryReceiver(port=args.port, latency=args.latency, error_rate=args.error_rate).start()
+    print(f"Receiving on {receiver.url}", flush=True)
+    try:
+        while True:
+            time.sleep(args.interval)
+            print(json.dumps(receiver.snapshot()), flush=True)
+    except KeyboardInterrupt:
+        receiver.stop()
+        sys.exit(0)
@@ -0,0 +1,70 @@
+import os
+import sys
+import json
+import time
+import argparse
+import statistics
+import subprocess
+
+ROOT_DIR = os.path.realpath(os.path.join(os.path.dirname(__file__), ".."))
+
+# Commands timed from process start to exit, run from the repository root
+COMMANDS = {
+    "main.py --help": [sys.executable, "main.py", "--help"],
+    "import main": [sys.executable, "-c", "import main"],
+    "import utilities.aos": [sys.executable, "-c", "import utilities.aos"]
+}
+
+def get_command_line_args():
+    parser = argparse.ArgumentParser(description="Measure the cold-start time of the CLI")
+    parser.add_argument("--runs", type = int, default = 20)
+    parser.add_argument("--importtime", action = "store_true",
+                        help = "Print the slowest imports of main.py (python -X importtime)")
+    parser.add_argument("--json", nargs = "?",
+                        help = "Write the results to a JSON file")
+    return parser.parse_args()
+
+def measure(command: list, runs: int) -> list:
+    """
+        Return type: class 'list' of the wall time in seconds of each run
+    """
+    durations = list()
+    for _ in range(runs):
+        start = time.perf_counter()
+        subprocess.run(command, cwd=ROOT_DIR, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL, check=True)
+        durations.append(time.perf_counter() - start)
+    return durations
+
+def slowest_imports(count=15) -> list:
+    """
+        Return type: class 'list' of (cumulative microseconds, module) imported by "import main"
+    """
+    output = subprocess.run([sys.executable, "-X", "importtime", "-c", "import main"], cwd=ROOT_DIR,
+                            capture_output=True, text=True, check=True).stderr
+    imports = list()
+    for line in output.splitlines()[1:]:
+        _, cumulative, module = [field.strip() for field in line.split("|")]
+        imports.append((int(cumulative), module.strip()))
+    return sorted(imports, reverse=True)[:count]
+
+
+if __name__ == "__main__":
+    args = get_command_line_args()
+    # Python itself, the floor of every measurement
+    results = {"python -c pass": measure([sys.executable, "-c", "pass"], args.runs)}
+    results.update({name: measure(command, args.runs) for name, command in COMMANDS.items()})
+
+    summary = {name: dict(mean = statistics.mean(durations),
+                          median = statistics.median(durations),
+                          min = min(durations),
+                          max = max(durations)) for name, durations in results.items()}
+    print(f"{'Command':<24}{'Median (ms)':>12}{'Mean (ms)':>12}{'Min (ms)':>12}{'Max (ms)':>12}")
+    for name, stats in summary.items():
+        print(f"{name:<24}{stats['median'] * 1000:>12.1f}{stats['mean'] * 1000:>12.1f}{stats['min'] * 1000:>12.1f}{stats['max'] * 1000:>12.1f}")
+    if args.importtime:
+        print("\nSlowest imports of main.py:")
+        for cumulative, module in slowest_imports():
+            print(f"{cumulative / 1000:>10.1f} ms  {module}")
+    if args.json:
+        with open(args.json, "w") as file:
+            json.dump(dict(runs=args.runs, commands=summary), file, indent=4)
@@ -1,38 +1,65 @@
 import os
-import sys
-
-UTILITIES_DIR = os.path.dirname(os.path.realpath(__file__))
-while not os.path.isdir(os.path.join(UTILITIES_DIR, "utilities")):
-    UTILITIES_DIR = os.path.realpath(UTILITIES_DIR + "/../")
-UTILITIES_DIR = os.path.join(UTILITIES_DIR, "utilities")
-sys.path.insert(0, UTILITIES_DIR)
-
-from aos import *
-
-def fota_test(unit_id: str, unit_name: str, unit_version: str, new_firmware: str):
-    verify = False
-    if not os.path.exists(os.path.join(os.path.dirname(__file__), new_firmware)):
-        log.error(f"No such file or directory: {new_firmware}")
-        return verify
-    
+
+from utilities.aos import AosCloud, log
+
+def firmware_files(new_firmware) -> list:
+    """
+        Return the batch files of new_firmware: a file or a directory of batch files, or a list of
+        them, relative to the Fota folder. None if one of them does not exist.
+    """
+    paths = [new_firmware] if isinstance(new_firmware, str) else list(new_firmware)
+    files = list()
+    for path in paths:
+        path = os.path.join(os.path.dirname(__file__), path)
+        if os.path.isdir(path):
+            files += sorted(os.path.join(path, name) for name in os.listdir(path)
+                            if not name.startswith(".") and os.path.isfile(os.path.join(path, name)))
+        elif os.path.isfile(path):
+            files.append(path)
+        else:
+            log.error(f"No such file or directory: {path}")
+            return None
+    return list(dict.fromkeys(files))
+
+def upload_firmware(new_firmware) -> list:
+    """
+        Upload the batch files of new_firmware and approve their components, once for every unit
+        updated with it. Images of a release are uploaded concurrently and approved from one
+        snapshot of the validation queue.
+        Return type: class 'list' of AosCloud.Entities.Component, None if a file does not exist
+    """
+    files = firmware_files(new_firmware)
+    if not files:
+        return None
+    components = AosCloud.Entities.Component.upload_batch_files(files)
+    AosCloud.Entities.Component.approve_components(components)
+    return components
+
+def verify_firmware(unit_id: str, unit_name: str, unit_version: str, components) -> bool:
+    """
+        Check that a unit installs the components returned by upload_firmware()
+    """
+    if not components:
+        return False
     unit = AosCloud.Entities.Unit(id      = unit_id,
                                   name    = unit_name,
                                   version = unit_version)
 
     if not unit.is_online(timeout=20):
-        return verify
-
-    with open(os.path.join(os.path.dirname(__file__), new_firmware), "rb") as fp:
-        file_data = fp.read()
-
-    firmware_to_upload = {
-        "file": (new_firmware, file_data)
-    }
-    component = AosCloud.Entities.Component()
-    component.upload_batch_file(firmware_to_upload)
-    component.approve_component()
-    if unit.verify_fota_function(component.component_id, component.component_vendor_version, timeout=500):
-        verify = True
+        return False
+
+    uploaded_components = [uploaded for component in components for uploaded in component.uploaded_components]
+    return unit.verify_fota_components(uploaded_components, timeout=500)
+
+def remove_firmware(components) -> None:
     log.info("CLEAN UP RESOURCES AFTER TESTING FOTA FUNCTION")
-    component.remove_uploaded_component()
-    return verify
\ No newline at end of file
+    for component in components or []:
+        component.remove_uploaded_component()
+
+def fota_test(unit_id: str, unit_name: str, unit_version: str, new_firmware, keep_resources=False):
+    components = upload_firmware(new_firmware)
+    verify = verify_firmware(unit_id, unit_name, unit_version, components)
+    if components and not keep_resources:
+        # Kept, the components stay on AosCloud so the next run with the same images skips the upload
+        remove_firmware(components)
+    return verify
@@ -1,15 +1,13 @@
-import os
-import sys
+from utilities.aos import AosCloud, log
+from utilities.collector import MonitoringCollector
 
-UTILITIES_DIR = os.path.dirname(os.path.realpath(__file__))
-while not os.path.isdir(os.path.join(UTILITIES_DIR, "utilities")):
-    UTILITIES_DIR = os.path.realpath(UTILITIES_DIR + "/../")
-UTILITIES_DIR = os.path.join(UTILITIES_DIR, "utilities")
-sys.path.insert(0, UTILITIES_DIR)
-
-from aos import *
-
-def monitoring_test(unit_id: str):
+def monitoring_test(unit_id: str, duration=0, interval=10, export=None):
+    """
+        Check that the unit reports monitoring data. If duration is set, keep collecting samples
+        every "interval" seconds for "duration" seconds, log the statistics of each metric and
+        export the samples to "export" (CSV, or Parquet for a ".parquet" path; "{unit_id}" is
+        replaced by the unit system id).
+    """
     verify = False
     unit = AosCloud.Entities.Unit(id      = unit_id,
                                   name    = None,
@@ -17,4 +15,12 @@ def monitoring_test(unit_id: str):
     log.info("GATHER SYSTEM INFORMATION")
     if unit.system_monitoring(timeout=30):
         verify = True
+    if verify and duration:
+        log.info(f"COLLECT SYSTEM INFORMATION FOR {duration}s")
+        collector = MonitoringCollector(unit_id, interval=interval, capacity=max(int(duration // interval) + 1, 1))
+        collector.run(duration)
+        for metric, stats in collector.stats().items():
+            log.info(f"{metric}: min {stats['min']} mean {stats['mean']} p95 {stats['p95']} max {stats['max']} ({stats['count']} samples)")
+        if export:
+            collector.export(export.format(unit_id=unit_id))
     return verify
\ No newline at end of file
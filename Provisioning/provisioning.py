@@ -1,15 +1,8 @@
 import os
-import sys
 import subprocess
 import json
 
-UTILITIES_DIR = os.path.dirname(os.path.realpath(__file__))
-while not os.path.isdir(os.path.join(UTILITIES_DIR, "utilities")):
-    UTILITIES_DIR = os.path.realpath(UTILITIES_DIR + "/../")
-UTILITIES_DIR = os.path.join(UTILITIES_DIR, "utilities")
-sys.path.insert(0, UTILITIES_DIR)
-
-from aos import *
+from utilities.aos import AosCloud, log
 
 def provision_test(unit_ip: str, unit_id: str, unit_name: str, unit_version: str) -> bool:
     log.info(f"PROVISION TARGET DEVICE {unit_name}")
@@ -1,49 +1,38 @@
 import os
-import sys
 import json
 import subprocess
 
-UTILITIES_DIR = os.path.dirname(os.path.realpath(__file__))
-while not os.path.isdir(os.path.join(UTILITIES_DIR, "utilities")):
-    UTILITIES_DIR = os.path.realpath(UTILITIES_DIR + "/../")
-UTILITIES_DIR = os.path.join(UTILITIES_DIR, "utilities")
-sys.path.insert(0, UTILITIES_DIR)
-
-from aos import *
+from utilities.aos import AosCloud, log
+from utilities.upload import tree_sha256
 
 #Directory path
 WORK_DIR = os.path.dirname(os.path.realpath(__file__))
 JSON_DIR = os.path.join(WORK_DIR, "json")
 META_DIR = os.path.join(WORK_DIR, "meta")
+SRC_DIR  = os.path.join(WORK_DIR, "src")
 
 #Service configuration files
 service_json = os.path.join(JSON_DIR, "service.json")
 config_yaml  = os.path.join(META_DIR, "config.yaml") 
 
-#Change working dir to current directory
-os.chdir(WORK_DIR)
-
-def sota_test(unit_id: str, unit_name: str, unit_version: str):
-    verify = False
-
+def publish_service() -> dict:
+    """
+        Create the service instance and the subject of service.json, publish the service build
+        and approve it, once for every unit under test
+        Return type: class 'dict' with the service, the subject, the SHA-256 of the build and its
+                     latest system version
+    """
     # Retrieve information from service.json file
     with open (service_json, "r") as jsonfile:
         info = json.load(jsonfile)
 
-    #Initiate unit, service and subject objects
-    unit = AosCloud.Entities.Unit(id      = unit_id,
-                                  name    = unit_name,
-                                  version = unit_version)
-
+    #Initiate service and subject objects
     service = AosCloud.Entities.ServiceInstance(title       = info["Service"]["instance"]["title"],
                                                 description = info["Service"]["instance"]["description"])
 
     subject = AosCloud.Entities.Subjects(label     = info["Subject"]["label"],
                                          priority  = info["Subject"]["priority"],
                                          is_group  = info["Subject"]["is_group"])
-    
-    if not unit.is_online(timeout=10):
-        return verify
 
     service.create_service_instance()
         
@@ -52,22 +41,59 @@ def sota_test(unit_id: str, unit_name: str, unit_version: str):
                                     sv_info_file = service_json, 
                                     sv_metadata_file = config_yaml)
     
-    log.info("SIGN AND UPLOAD NEW VERSION OF SERVICE")
-    subprocess.run(["aos-signer go"], timeout=10, shell=True, capture_output=True)
+    # The service sources and the rendered metadata identify a build, signing it again would
+    # only publish an identical version
+    build_sha256 = tree_sha256(SRC_DIR, config_yaml)
+    if service.find_published_build(build_sha256):
+        log.info(f"SERVICE BUILD {build_sha256} IS ALREADY THE LATEST VERSION, SKIP SIGNING AND UPLOAD")
+    else:
+        log.info("SIGN AND UPLOAD NEW VERSION OF SERVICE")
+        subprocess.run(["aos-signer go"], timeout=10, shell=True, capture_output=True, cwd=WORK_DIR)
+        # aos-signer uploads the new version outside of AosCloud.Request, so drop what is cached
+        AosCloud.Cache.invalidate("services")
         
     subject.create_subject()
     
     subject.assign_service_to_subject(service.service_uuid)
 
-    subject.assign_unit_to_subject(unit.unit_system_id)
-
     service.approve_service()
 
-    if unit.verify_sota_function(service.service_uuid, service.latest_service_system_version(), timeout=40):
-        verify = True
-    
+    return dict(service = service,
+                subject = subject,
+                build_sha256 = build_sha256,
+                latest_version = service.latest_service_system_version())
+
+def verify_service(unit_id: str, unit_name: str, unit_version: str, release: dict) -> bool:
+    """
+        Assign a unit to the subject of publish_service() and check that it runs the latest
+        version of the service
+    """
+    unit = AosCloud.Entities.Unit(id      = unit_id,
+                                  name    = unit_name,
+                                  version = unit_version)
+
+    if not unit.is_online(timeout=10):
+        return False
+
+    release["subject"].assign_unit_to_subject(unit.unit_system_id)
+
+    return unit.verify_sota_function(release["service"].service_uuid, release["latest_version"], timeout=40)
+
+def remove_service(release: dict, keep_resources=False, verified=False) -> None:
+    """
+        Remove the service and the subject of publish_service(). With keep_resources they stay on
+        AosCloud and a verified build is recorded, so the next run with the same sources skips signing.
+    """
+    if keep_resources:
+        if verified:
+            release["service"].record_published_build(release["build_sha256"], release["latest_version"])
+        return
     log.info("CLEAN UP RESOURCES AFTER TESTING SOTA FUNCTION")
-    subject.remove_subject()
-    service.remove_service_instance()
+    release["subject"].remove_subject()
+    release["service"].remove_service_instance()
+
+def sota_test(unit_id: str, unit_name: str, unit_version: str, keep_resources=False):
+    release = publish_service()
+    verify = verify_service(unit_id, unit_name, unit_version, release)
+    remove_service(release, keep_resources=keep_resources, verified=verify)
     return verify
-    
\ No newline at end of file
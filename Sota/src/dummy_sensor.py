@@ -1,37 +1,83 @@
-from urllib import request
 from time import sleep
 import datetime
-import json
+import signal
+import sys
+import argparse
 import random
+import json
+import os
+
+from sender import TelemetrySender
 
 HTTP_REQUESTS_RECEIVE_URL = "https://webhook.site/ada814c5-6c66-4538-93c6-cfe68d2779f9"
 DELAY_TIME = 30
+# Readings are sent in batches of BATCH_SIZE or every FLUSH_INTERVAL seconds, whichever comes first,
+# and kept in SPOOL_DIR while the receiver cannot be reached
+BATCH_SIZE = int(os.environ.get("TELEMETRY_BATCH_SIZE", 10))
+FLUSH_INTERVAL = float(os.environ.get("TELEMETRY_FLUSH_INTERVAL", 300))
+COMPRESS = os.environ.get("TELEMETRY_GZIP", "1") != "0"
+SPOOL_DIR = os.environ.get("TELEMETRY_SPOOL_DIR")
 
 def dummy_sensor():
     sensor_data = random.randint(10,50)
     return sensor_data
 
-def main():
-    while True:
-        json_data = {
-            "Description": "Temperature sensor data monitoring",
-            "Timestamp": datetime.datetime.now().isoformat(),
-            "Temperature sensor": dummy_sensor()
-        }
-        params = json.dumps(json_data).encode('utf-8')
-        try:
-            send_data = request.Request(
-                url     = HTTP_REQUESTS_RECEIVE_URL,
-                data    = params,
-                headers = {
-                    'Content-Type': 'application/json'
-                }
-            )
-            request.urlopen(send_data)
-        except request.HTTPError as err:
-            print(f"Unhandle exception: {err}")
-        
-        sleep(DELAY_TIME)
+def get_command_line_args():
+    parser = argparse.ArgumentParser(description="Sample sensor service, or a load generator simulating many sensors")
+    parser.add_argument("--url", default = os.environ.get("TELEMETRY_URL", HTTP_REQUESTS_RECEIVE_URL),
+                        help = "Receiving endpoint, e.g. the local receiver of Benchmark/receiver.py")
+    parser.add_argument("--sensors", type = int, default = 0,
+                        help = "Simulate this many sensors for --duration seconds and report the throughput")
+    parser.add_argument("--rate", type = float, default = 1.0,
+                        help = "Readings per second of each simulated sensor")
+    parser.add_argument("--duration", type = float, default = 60)
+    parser.add_argument("--batch-size", type = int, default = 1,
+                        help = "Readings per request of each simulated sensor")
+    parser.add_argument("--connections", type = int, default = 10,
+                        help = "Kept-alive connections shared by the simulated sensors")
+    parser.add_argument("--gzip", action = "store_true")
+    parser.add_argument("--json", nargs = "?",
+                        help = "Write the load report to a JSON file")
+    return parser.parse_args()
+
+def load_test(args):
+    import asyncio
+    from loadgen import LoadGenerator, print_report
+    generator = LoadGenerator(url         = args.url,
+                              sensors     = args.sensors,
+                              rate        = args.rate,
+                              batch_size  = args.batch_size,
+                              connections = args.connections,
+                              compress    = args.gzip)
+    report = asyncio.run(generator.run(args.duration))
+    print_report(report)
+    if args.json:
+        with open(args.json, "w") as file:
+            json.dump(report, file, indent=4)
+
+def main(url=HTTP_REQUESTS_RECEIVE_URL):
+    sender = TelemetrySender(url            = url,
+                             batch_size     = BATCH_SIZE,
+                             flush_interval = FLUSH_INTERVAL,
+                             compress       = COMPRESS,
+                             spool_dir      = SPOOL_DIR)
+    # Stopping the service sends SIGTERM: flush the buffered readings before exiting
+    signal.signal(signal.SIGTERM, lambda signum, frame: sys.exit(0))
+    try:
+        while True:
+            json_data = {
+                "Description": "Temperature sensor data monitoring",
+                "Timestamp": datetime.datetime.now().isoformat(),
+                "Temperature sensor": dummy_sensor()
+            }
+            sender.add(json_data)
+            sleep(DELAY_TIME)
+    finally:
+        sender.close()
     
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    args = get_command_line_args()
+    if args.sensors:
+        load_test(args)
+    else:
+        main(args.url)
@@ -0,0 +1,200 @@
+import ssl
+import gzip
+import json
+import math
+import time
+import random
+import asyncio
+import datetime
+from urllib.parse import urlsplit
+
+class Connection():
+    """
+        Minimal HTTP/1.1 client connection kept alive between requests
+    """
+    def __init__(self, url, timeout):
+        self.url = url
+        self.timeout = timeout
+        self.reader = None
+        self.writer = None
+
+    async def _open(self):
+        https = self.url.scheme == "https"
+        port = self.url.port or (443 if https else 80)
+        self.reader, self.writer = await asyncio.open_connection(self.url.hostname, port,
+                                                                 ssl=ssl.create_default_context() if https else None)
+
+    def close(self):
+        if self.writer is not None:
+            self.writer.close()
+            self.writer = None
+
+    async def post(self, path, body, headers) -> int:
+        """
+            Send a POST and read its whole response
+            Return type: class 'int', the status code
+        """
+        for attempt in range(2):
+            reused = self.writer is not None
+            if not reused:
+                await self._open()
+            lines = [f"POST {path} HTTP/1.1", f"Host: {self.url.netloc}", f"Content-Length: {len(body)}"]
+            lines += [f"{name}: {value}" for name, value in headers.items()]
+            self.writer.write(("\r\n".join(lines) + "\r\n\r\n").encode() + body)
+            try:
+                await self.writer.drain()
+                return await asyncio.wait_for(self._response(), self.timeout)
+            except (ConnectionError, asyncio.IncompleteReadError):
+                # A kept-alive connection closed by the server: open a new one and send again
+                self.close()
+                if attempt or not reused:
+                    raise
+            except BaseException:
+                self.close()
+                raise
+
+    async def _response(self) -> int:
+        status = int((await self.reader.readuntil(b"\r\n")).split()[1])
+        headers = dict()
+        while True:
+            line = await self.reader.readuntil(b"\r\n")
+            if line == b"\r\n":
+                break
+            name, _, value = line.decode("latin-1").partition(":")
+            headers[name.strip().lower()] = value.strip()
+        if headers.get("transfer-encoding", "").lower() == "chunked":
+            while True:
+                size = int((await self.reader.readuntil(b"\r\n")).split(b";")[0], 16)
+                await self.reader.readexactly(size + 2)
+                if not size:
+                    break
+        else:
+            await self.reader.readexactly(int(headers.get("content-length", 0)))
+        if headers.get("connection", "").lower() == "close":
+            self.close()
+        return status
+
+
+class LoadGenerator():
+    """
+        Simulate many sensors from one asyncio process. Every virtual sensor produces "rate"
+        readings per second on its own schedule and sends them, "batch_size" at a time, over a
+        pool of kept-alive connections. The send latency is measured from the time a request was
+        due, so time spent waiting for a free connection counts when the receiver falls behind.
+        Requests still due when the duration is over are not sent and reported as missed.
+    """
+    def __init__(self, url, sensors=100, rate=1.0, batch_size=1, connections=10, compress=False, timeout=30):
+        """
+            Parameters:
+                url: receiving endpoint, http or https (class 'str')
+                sensors: number of virtual sensors (class 'int')
+                rate: readings per second of each sensor (class 'float')
+                batch_size: readings sent per request (class 'int')
+                connections: number of kept-alive connections (class 'int')
+                compress: whether request bodies are gzipped (class 'bool')
+                timeout: seconds to wait for a response (class 'float')
+        """
+        self.url = urlsplit(url)
+        self.sensors = sensors
+        self.rate = rate
+        self.batch_size = batch_size
+        self.connections = connections
+        self.compress = compress
+        self.timeout = timeout
+        self.latencies = list()
+        self.errors = dict()
+        self.readings = 0
+        self.missed = 0
+        self.sent_bytes = 0
+
+    def _reading(self, sensor: int) -> dict:
+        return {
+            "Description": "Temperature sensor data monitoring",
+            "Sensor": sensor,
+            "Timestamp": datetime.datetime.now().isoformat(),
+            "Temperature sensor": random.randint(10, 50)
+        }
+
+    async def _sensor(self, sensor: int, pool: asyncio.Queue, deadline: float) -> None:
+        interval = self.batch_size / self.rate
+        # Random phase so that the sensors do not all send at the same instant
+        due = time.monotonic() + random.uniform(0, interval)
+        path = (self.url.path or "/") + (f"?{self.url.query}" if self.url.query else "")
+        headers = {"Content-Type": "application/json"}
+        if self.compress:
+            headers["Content-Encoding"] = "gzip"
+        while due < deadline:
+            if time.monotonic() >= deadline:
+                # Behind schedule at the end of the run
+                self.missed += math.ceil((deadline - due) / interval) * self.batch_size
+                break
+            await asyncio.sleep(max(due - time.monotonic(), 0))
+            body = json.dumps([self._reading(sensor) for _ in range(self.batch_size)]).encode()
+            if self.compress:
+                body = gzip.compress(body)
+            connection = await pool.get()
+            try:
+                status = await connection.post(path, body, headers)
+                error = None if status < 400 else f"HTTP {status}"
+            except asyncio.TimeoutError:
+                error = "timeout"
+            except (OSError, asyncio.IncompleteReadError, ValueError, IndexError) as err:
+                error = type(err).__name__
+            finally:
+                pool.put_nowait(connection)
+            if error:
+                self.errors[error] = self.errors.get(error, 0) + 1
+            else:
+                self.latencies.append(time.monotonic() - due)
+                self.readings += self.batch_size
+                self.sent_bytes += len(body)
+            due += interval
+
+    async def run(self, duration: float) -> dict:
+        """
+            Run the sensors for duration seconds
+            Return type: class 'dict', see report()
+        """
+        pool = asyncio.Queue()
+        connections = [Connection(self.url, self.timeout) for _ in range(self.connections)]
+        for connection in connections:
+            pool.put_nowait(connection)
+        start = time.monotonic()
+        try:
+            await asyncio.gather(*(self._sensor(sensor, pool, start + duration) for sensor in range(self.sensors)))
+        finally:
+            for connection in connections:
+                connection.close()
+        return self.report(time.monotonic() - start)
+
+    def report(self, elapsed: float) -> dict:
+        """
+            Return type: class 'dict' with the achieved throughput, the send latency percentiles in
+                         seconds and the number of errors by kind
+        """
+        latencies = sorted(self.latencies)
+        def percentile(q):
+            return latencies[min(int(q * len(latencies)), len(latencies) - 1)] if latencies else 0.0
+        requests = len(latencies)
+        return dict(sensors = self.sensors,
+                    target_readings_per_second = self.sensors * self.rate,
+                    elapsed = elapsed,
+                    requests = requests,
+                    readings = self.readings,
+                    missed_readings = self.missed,
+                    requests_per_second = requests / elapsed,
+                    readings_per_second = self.readings / elapsed,
+                    sent_bytes_per_second = self.sent_bytes / elapsed,
+                    p50 = percentile(0.5), p95 = percentile(0.95), p99 = percentile(0.99),
+                    max = latencies[-1] if latencies else 0.0,
+                    errors = dict(self.errors))
+
+
+def print_report(report: dict) -> None:
+    print(f"{report['sensors']} sensors, {report['elapsed']:.1f}s: "
+          f"{report['readings_per_second']:.1f} readings/s of {report['target_readings_per_second']:.1f} targeted, "
+          f"{report['requests_per_second']:.1f} requests/s, {report['sent_bytes_per_second'] / 2**10:.1f} KB/s, "
+          f"{report['missed_readings']} readings missed")
+    print(f"Send latency: p50 {report['p50'] * 1000:.1f}ms, p95 {report['p95'] * 1000:.1f}ms, "
+          f"p99 {report['p99'] * 1000:.1f}ms, max {report['max'] * 1000:.1f}ms")
+    print(f"Errors: {sum(report['errors'].values())} {report['errors'] or ''}")
@@ -0,0 +1,171 @@
+import os
+import gzip
+import json
+import time
+import tempfile
+import http.client
+from urllib.parse import urlsplit
+
+class TelemetrySender():
+    """
+        Send readings in batches over one persistent HTTP(S) connection.
+        Readings are buffered in memory and sent as one JSON array when "batch_size" readings are
+        buffered or "flush_interval" seconds have passed since the last flush. A batch that cannot
+        be sent (connection error, timeout, 408, 429 or 5xx) is written to a spool directory and
+        sent again, oldest first, before any newer batch once the server can be reached. The spool
+        is bounded by "max_spool_bytes": past that size the oldest batches are dropped.
+        Batch bodies can be gzipped to save bandwidth on metered links.
+    """
+    def __init__(self, url, batch_size=20, flush_interval=300, compress=False, spool_dir=None,
+                 max_spool_bytes=10 * 2**20, timeout=30, max_retry_interval=300):
+        """
+            Parameters:
+                url: receiving endpoint, http or https (class 'str')
+                batch_size: number of readings that triggers a flush (class 'int')
+                flush_interval: seconds after which buffered readings are flushed anyway (class 'float')
+                compress: whether batch bodies are gzipped (class 'bool')
+                spool_dir: directory of the batches waiting to be sent (class 'str')
+                max_spool_bytes: maximum size of the spool directory (class 'int')
+                timeout: seconds to connect and to wait for a response (class 'float')
+                max_retry_interval: longest wait in seconds between two attempts while offline (class 'float')
+        """
+        self.url = urlsplit(url)
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.compress = compress
+        self.spool_dir = spool_dir or os.path.join(tempfile.gettempdir(), "telemetry-spool")
+        self.max_spool_bytes = max_spool_bytes
+        self.timeout = timeout
+        self.max_retry_interval = max_retry_interval
+        self.buffer = list()
+        self.last_flush = time.monotonic()
+        self.retry_interval = 0
+        self.next_attempt = 0.0
+        self.connection = None
+        self.stats = dict(readings=0, batches=0, requests=0, sent_bytes=0, spooled=0, dropped=0)
+        os.makedirs(self.spool_dir, exist_ok=True)
+
+    def add(self, reading: dict) -> None:
+        """
+            Buffer a reading and flush if the size or time trigger is reached
+        """
+        self.buffer.append(reading)
+        self.stats["readings"] += 1
+        if len(self.buffer) >= self.batch_size or time.monotonic() - self.last_flush >= self.flush_interval:
+            self.flush()
+
+    def flush(self, force=False) -> bool:
+        """
+            Send the spooled batches, then the buffered readings. While the server cannot be
+            reached, the buffer is spooled and no request is sent until the retry delay has passed,
+            unless force is set.
+            Return type: class 'bool', True when nothing is left to send
+        """
+        self.last_flush = time.monotonic()
+        if self.buffer:
+            body = json.dumps(self.buffer).encode("utf-8")
+            self.buffer = list()
+            # Older batches go first, so a new batch is only sent directly when none is waiting
+            if self._spooled() or not self._can_attempt(force) or not self._send(body):
+                self._spool(body)
+        if not self._can_attempt(force):
+            return not self._spooled()
+        for path in self._spooled():
+            with open(path, "rb") as file:
+                body = file.read()
+            if not self._send(body):
+                return False
+            os.remove(path)
+        return True
+
+    def close(self) -> None:
+        """
+            Flush what is left, e.g. when the service is stopped, and close the connection
+        """
+        self.flush(force=True)
+        self._disconnect()
+
+    def _can_attempt(self, force: bool) -> bool:
+        return force or time.monotonic() >= self.next_attempt
+
+    def _connect(self) -> http.client.HTTPConnection:
+        if self.connection is None:
+            port = self.url.port
+            if self.url.scheme == "https":
+                self.connection = http.client.HTTPSConnection(self.url.hostname, port, timeout=self.timeout)
+            else:
+                self.connection = http.client.HTTPConnection(self.url.hostname, port, timeout=self.timeout)
+        return self.connection
+
+    def _send(self, body: bytes) -> bool:
+        """
+            POST one batch, reconnecting once if the kept-alive connection was closed by the server
+            Return type: class 'bool', False if the batch has to be sent again later
+        """
+        headers = {"Content-Type": "application/json", "Connection": "keep-alive"}
+        if self.compress:
+            body = gzip.compress(body)
+            headers["Content-Encoding"] = "gzip"
+        path = self.url.path or "/"
+        if self.url.query:
+            path += "?" + self.url.query
+        for attempt in range(2):
+            try:
+                connection = self._connect()
+                connection.request("POST", path, body=body, headers=headers)
+                response = connection.getresponse()
+                response.read()
+                break
+            except (http.client.RemoteDisconnected, BrokenPipeError, ConnectionResetError) as err:
+                # A kept-alive connection closed by the server: open a new one and send again
+                self._disconnect()
+                if attempt:
+                    return self._failed(err)
+            except (OSError, http.client.HTTPException) as err:
+                self._disconnect()
+                return self._failed(err)
+        self.stats["requests"] += 1
+        if response.status >= 500 or response.status in (408, 429):
+            return self._failed(f"HTTP {response.status}")
+        if response.status >= 400:
+            # Rejected by the server, sending it again would not help
+            print(f"Batch rejected with HTTP {response.status}, dropped")
+            self.stats["dropped"] += 1
+        else:
+            self.stats["batches"] += 1
+            self.stats["sent_bytes"] += len(body)
+        self.retry_interval = 0
+        self.next_attempt = 0.0
+        return True
+
+    def _failed(self, err) -> bool:
+        self.retry_interval = min(max(self.retry_interval * 2, 5), self.max_retry_interval)
+        self.next_attempt = time.monotonic() + self.retry_interval
+        print(f"Cannot send telemetry: {err}, next attempt in {self.retry_interval}s")
+        return False
+
+    def _disconnect(self) -> None:
+        if self.connection is not None:
+            self.connection.close()
+            self.connection = None
+
+    def _spooled(self) -> list:
+        """
+            Return type: class 'list' of the spooled batch files, oldest first
+        """
+        return sorted(os.path.join(self.spool_dir, name) for name in os.listdir(self.spool_dir) if name.endswith(".json"))
+
+    def _spool(self, body: bytes) -> None:
+        path = os.path.join(self.spool_dir, f"{time.time_ns():020d}.json")
+        with open(path + ".tmp", "wb") as file:
+            file.write(body)
+        os.replace(path + ".tmp", path)
+        self.stats["spooled"] += 1
+        spooled = self._spooled()
+        total = sum(os.path.getsize(name) for name in spooled)
+        while total > self.max_spool_bytes and len(spooled) > 1:
+            oldest = spooled.pop(0)
+            total -= os.path.getsize(oldest)
+            os.remove(oldest)
+            self.stats["dropped"] += 1
+            print("Telemetry spool is full, oldest batch dropped")
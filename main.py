@@ -1,83 +1,279 @@
 import argparse
+import datetime
 import time
-from Sota.sota import sota_test
-from Fota.fota import fota_test
-from Monitoring.monitoring import monitoring_test
-from Provisioning.provisioning import provision_test
-from rich.console import Console
-from rich.table import Table
-
-def get_command_line_args():
+import json
+import os
+import logging
+import contextvars
+from concurrent.futures import ThreadPoolExecutor
+from utilities import configure_logging
+from utilities.scheduler import StageScheduler
+from utilities.metrics import request_metrics, CallTrace, submit_in_context
+
+# The stages, the AosCloud client and rich are imported when they are first used, so that
+# argument errors and --help do not pay for loading requests, yaml and rich
+
+def get_command_line_args(argv=None):
     # Get unit infomation from command line arguments
     parser = argparse.ArgumentParser()
-    parser.add_argument("--unit-id", nargs = "?", required = True)
-    parser.add_argument("--unit-name", nargs = "?", required = True)
-    parser.add_argument("--unit-version", nargs = "?", required = True)
-    parser.add_argument("--unit-ip", nargs = "?", required = True)
-    parser.add_argument("--new-firmware", nargs = "?", required = True)
-    args = parser.parse_args()
+    parser.add_argument("--unit-id", nargs = "?")
+    parser.add_argument("--unit-name", nargs = "?")
+    parser.add_argument("--unit-version", nargs = "?")
+    parser.add_argument("--unit-ip", nargs = "?")
+    parser.add_argument("--new-firmware", nargs = "+", required = True,
+                        help = "Batch file(s), or a directory of batch files, uploaded concurrently by the FOTA test")
+    parser.add_argument("--keep-resources", action = "store_true",
+                        help = "Keep uploaded components, services and subjects on AosCloud so that re-runs skip identical uploads and service builds")
+    parser.add_argument("--monitoring-duration", type = float, default = 0,
+                        help = "Seconds of continuous monitoring after the monitoring test (default: none)")
+    parser.add_argument("--monitoring-interval", type = float, default = 10,
+                        help = "Seconds between two monitoring samples")
+    parser.add_argument("--monitoring-export", nargs = "?",
+                        help = "CSV or .parquet file of the monitoring samples, \"{unit_id}\" is replaced by the unit id")
+    parser.add_argument("--inventory", nargs = "?",
+                        help = "JSON file listing the units to test instead of --unit-id/--unit-ip/--unit-name/--unit-version")
+    parser.add_argument("--workers", type = int, default = 4,
+                        help = "Number of units tested at the same time in inventory mode")
+    parser.add_argument("--log-dir", nargs = "?", default = "logs",
+                        help = "Directory of the per-unit log files in inventory mode")
+    parser.add_argument("--trace-calls", action = "store_true",
+                        help = "Log the ordered list of AosCloud requests sent by each test")
+    parser.add_argument("--metrics-json", nargs = "?",
+                        help = "Write the per-endpoint request histograms to a JSON file")
+    parser.add_argument("--metrics-prometheus", nargs = "?",
+                        help = "Write the per-endpoint request histograms to a file in the Prometheus text format")
+    parser.add_argument("--history", nargs = "?",
+                        help = "SQLite file recording the stage durations and request metrics of every run (default: ~/.aos/run-history.sqlite or AOS_HISTORY), see report.py")
+    parser.add_argument("--no-history", action = "store_true",
+                        help = "Do not record this run")
+    parser.add_argument("--label", nargs = "?",
+                        help = "Label of the run in the history, e.g. the release under test")
+    args = parser.parse_args(argv)
+    if not args.inventory and not all([args.unit_id, args.unit_name, args.unit_version, args.unit_ip]):
+        parser.error("--unit-id, --unit-ip, --unit-name and --unit-version are required without --inventory")
     return args
 
+def load_inventory(inventory_file) -> list:
+    """
+        Read the units to test from an inventory file with the following format:
+        [
+            {
+                "unit_id": <VIN_ID>,
+                "unit_ip": <IP>,
+                "unit_name": <NAME>,
+                "unit_version": <VERSION>
+            },
+            ...
+        ]
+        An entry may also set "new_firmware" (a file, a directory or a list of them) to override
+        --new-firmware for that unit.
+    """
+    with open(inventory_file, "r") as file:
+        return json.load(file)
+
+def firmware_option(firmware):
+    """
+        A single batch file or directory as a path, several as a tuple, so that it can key the firmware
+        uploads of SharedResources
+    """
+    if isinstance(firmware, str):
+        return firmware
+    return firmware[0] if len(firmware) == 1 else tuple(firmware)
+
 def test_provision(id, ip, name, version):
-    print("START PROVISIONING TEST")
-    print("Logs:")
+    from Provisioning.provisioning import provision_test
+    logging.getLogger().info("START PROVISIONING TEST")
     start_time = time.time()
     status = "PASS" if provision_test(unit_id=id, unit_ip=ip, unit_name=name, unit_version=version) else "FAILED"
     time_execution = round(float(time.time() - start_time), 4)
-    print("END PROVISIONING TEST\n\n")
+    logging.getLogger().info("END PROVISIONING TEST")
     return status, time_execution
 
-def test_sota(id, name, version):
-    print("START SOTA TEST")
-    print("Logs:")
+def test_sota(id, name, version, shared):
+    from Sota.sota import verify_service
+    logging.getLogger().info("START SOTA TEST")
     start_time = time.time()
-    status = "PASS" if sota_test(unit_id=id, unit_name=name, unit_version=version) else "FAILED"
+    verify = verify_service(unit_id=id, unit_name=name, unit_version=version, release=shared.release())
+    shared.sota_results.append(verify)
+    status = "PASS" if verify else "FAILED"
     time_execution = round(float(time.time() - start_time), 4)
-    print("END SOTA TEST\n\n")
+    logging.getLogger().info("END SOTA TEST")
     return status, time_execution
 
-def test_fota(id, name, version, firmware):
-    print("START FOTA TEST")
-    print("Logs:")
+def test_fota(id, name, version, firmware, shared):
+    from Fota.fota import verify_firmware
+    logging.getLogger().info("START FOTA TEST")
     start_time = time.time()
-    status = "PASS" if fota_test(unit_id=id, unit_name=name, unit_version=version, new_firmware=firmware) else "FAILED"
+    status = "PASS" if verify_firmware(unit_id=id, unit_name=name, unit_version=version, components=shared.components(firmware)) else "FAILED"
     time_execution = round(float(time.time() - start_time), 4)
-    print("END FOTA TEST\n\n")
+    logging.getLogger().info("END FOTA TEST")
     return status, time_execution
 
-def test_monitoring(id):
-    print("START SYSTEM MONITORING TEST")
-    print("Logs:")
+def test_monitoring(id, duration=0, interval=10, export=None):
+    from Monitoring.monitoring import monitoring_test
+    logging.getLogger().info("START SYSTEM MONITORING TEST")
     start_time = time.time()
-    status = "PASS" if monitoring_test(unit_id=id) else "FAILED"
+    status = "PASS" if monitoring_test(unit_id=id, duration=duration, interval=interval, export=export) else "FAILED"
     time_execution = round(float(time.time() - start_time), 4)
-    print("END SYSTEM MONITORING TEST\n\n")
+    logging.getLogger().info("END SYSTEM MONITORING TEST")
     return status, time_execution
         
 
-if __name__ == "__main__":
-    device_id = get_command_line_args().unit_id
-    device_name = get_command_line_args().unit_name
-    device_version = get_command_line_args().unit_version
-    device_ip = get_command_line_args().unit_ip
-    new_device_firmware = get_command_line_args().new_firmware
+# Unit whose pipeline runs in the current thread, used to route log records to per-unit files
+current_unit = contextvars.ContextVar("current_unit", default=None)
+
+class UnitLogFilter(logging.Filter):
+    def __init__(self, unit_id):
+        super().__init__()
+        self.unit_id = unit_id
+
+    def filter(self, record):
+        return current_unit.get() == self.unit_id
+
+def traced(function, func):
+    """
+        Wrap a stage so that the AosCloud requests it sends are logged in order once it ends
+    """
+    def run():
+        with CallTrace(function) as trace:
+            try:
+                return func()
+            finally:
+                logging.getLogger().info(f"{function.upper()} TEST SENT {len(trace.calls)} REQUESTS:\n{trace.format()}")
+    return run
+
+class SharedResources():
+    """
+        AosCloud resources shared by every unit under test: the components of each firmware and the
+        service and subject of the SOTA test. They are created once, in the background while the
+        units are provisioned, so that the FOTA and SOTA tests of each unit only verify that unit
+        and run concurrently. close() removes them once after the last unit, unless resources are kept.
+    """
+    def __init__(self, firmwares, keep_resources=False, trace_calls=False):
+        from Fota.fota import upload_firmware
+        from Sota.sota import publish_service
+
+        self.keep_resources = keep_resources
+        self.sota_results = list()
+        firmwares = list(dict.fromkeys(firmwares))
+        self.executor = ThreadPoolExecutor(max_workers=len(firmwares) + 1, thread_name_prefix="shared")
+        def submit(function, func):
+            if trace_calls:
+                func = traced(function, func)
+            return submit_in_context(self.executor, func)
+        self.firmware = {firmware: submit(f"Shared FOTA {firmware}", lambda firmware=firmware: upload_firmware(firmware))
+                         for firmware in firmwares}
+        self.service = submit("Shared SOTA", publish_service)
+
+    def components(self, firmware) -> list:
+        """
+            Wait for the components of a firmware to be uploaded and approved
+        """
+        return self.firmware[firmware].result()
+
+    def release(self) -> dict:
+        """
+            Wait for the service of the SOTA test to be published, see Sota.sota.publish_service()
+        """
+        return self.service.result()
+
+    def close(self) -> None:
+        from Fota.fota import remove_firmware
+        from Sota.sota import remove_service
+
+        cleanups = [lambda future=future: None if self.keep_resources else remove_firmware(future.result())
+                    for future in self.firmware.values()]
+        cleanups.append(lambda: remove_service(self.service.result(), keep_resources=self.keep_resources,
+                                               verified=bool(self.sota_results) and all(self.sota_results)))
+        for cleanup in cleanups:
+            try:
+                cleanup()
+            except (Exception, SystemExit) as err:
+                # Creating the resource failed, or removing it did: the other resources are still removed
+                logging.getLogger().error(f"CLEAN UP OF SHARED RESOURCES FAILED: {err}")
+        self.executor.shutdown()
+
+def run_pipeline(id, ip, name, version, firmware, shared, monitoring=None, trace_calls=False) -> list:
+    """
+        Run the provisioning, FOTA, SOTA and monitoring tests of one unit. FOTA, SOTA and monitoring
+        only depend on provisioning, so they run concurrently once the unit is provisioned.
+        shared holds the SharedResources verified by the FOTA and SOTA tests.
+        monitoring holds the optional duration, interval and export arguments of test_monitoring.
+        With trace_calls, the requests sent by each test are logged in order.
+        Return type: class 'list' of [function, start, end, time execution, result] in summary order
+    """
+    stages = dict(Provisioning = lambda: test_provision(id=id, ip=ip, name=name, version=version),
+                  FOTA = lambda: test_fota(id=id, name=name, version=version, firmware=firmware, shared=shared),
+                  SOTA = lambda: test_sota(id=id, name=name, version=version, shared=shared),
+                  Monitoring = lambda: test_monitoring(id=id, **(monitoring or {})))
+    if trace_calls:
+        stages = {function: traced(function, func) for function, func in stages.items()}
+
+    scheduler = StageScheduler()
+    scheduler.add("Provisioning", stages["Provisioning"])
+    scheduler.add("FOTA", stages["FOTA"], depends=["Provisioning"])
+    scheduler.add("SOTA", stages["SOTA"], depends=["Provisioning"])
+    scheduler.add("Monitoring", stages["Monitoring"], depends=["Provisioning"])
+    outcomes = scheduler.run()
+
+    results = list()
+    for function in ["Provisioning", "SOTA", "FOTA", "Monitoring"]:
+        outcome = outcomes[function]
+        status, time_execution = outcome["result"] or ("FAILED", "-")
+        if outcome["error"]:
+            logging.getLogger().error(f"{function.upper()} TEST OF UNIT {id} STOPPED: {outcome['error']}")
+        start, end = [time.strftime("%H:%M:%S", time.localtime(t)) if t else "-" for t in (outcome["start"], outcome["end"])]
+        results.append([function, start, end, f"{time_execution}", f"{status}"])
+    return results
+
+def run_unit(unit: dict, options: dict, log_dir) -> list:
+    """
+        Run the pipeline of one inventory unit and capture its logs in <log_dir>/<unit_id>.log
+        options holds the keyword arguments of run_pipeline shared by every unit.
+    """
+    os.makedirs(log_dir, exist_ok=True)
+    handler = logging.FileHandler(os.path.join(log_dir, f"{unit['unit_id']}.log"))
+    handler.setFormatter(logging.Formatter('%(asctime)s %(levelname)-8s %(message)s', '%Y-%m-%d %H:%M:%S'))
+    handler.addFilter(UnitLogFilter(unit["unit_id"]))
+    logging.getLogger().addHandler(handler)
+    current_unit.set(unit["unit_id"])
+    try:
+        return run_pipeline(id=unit["unit_id"], ip=unit["unit_ip"], name=unit["unit_name"], version=unit["unit_version"],
+                            **dict(options, firmware=firmware_option(unit.get("new_firmware", options["firmware"]))))
+    except (Exception, SystemExit) as err:
+        logging.getLogger().exception(f"PIPELINE OF UNIT {unit['unit_id']} STOPPED: {err}")
+        return [[function, "-", "-", "-", "FAILED"] for function in ["Provisioning", "SOTA", "FOTA", "Monitoring"]]
+    finally:
+        logging.getLogger().removeHandler(handler)
+        handler.close()
+
+def run_inventory(units: list, options: dict, workers, log_dir) -> list:
+    """
+        Run the pipeline of every unit on a bounded worker pool
+        Return type: class 'list' of (unit, results of run_pipeline) in inventory order
+    """
+    with ThreadPoolExecutor(max_workers=workers, thread_name_prefix="unit") as executor:
+        futures = [submit_in_context(executor, run_unit, unit, options, log_dir)
+                   for unit in units]
+        return [(unit, future.result()) for unit, future in zip(units, futures)]
+
+
+def print_summary(results: list) -> None:
+    """
+        Print the result of every test function, the AosCloud cache statistics and the requests per endpoint
+    """
+    from rich.console import Console
+    from rich.table import Table
+    from utilities.aos import AosCloud
+    from utilities.retry import default_hedger
 
-    # Test
     table = Table(title="AosEdge Test Functions")
-    columns = ["No.", "Board ID", "Board Name", "Board Version", "Function", "Time execution", "Result"]
-    provision_status, provision_time = test_provision(id=device_id, ip=device_ip, name=device_name, version=device_version)
-    fota_status, fota_time = test_fota(id=device_id, name=device_name, version=device_version, firmware=new_device_firmware)
-    sota_status, sota_time = test_sota(id=device_id, name=device_name, version=device_version)
-    monitoring_status, monitoring_time = test_monitoring(id=device_id)
-
-    # Summary table
-    rows = [
-        ["1", f"{device_id}", f"{device_name}", f"{device_version}", "Provisioning", f"{provision_time}", f"{provision_status}"],
-        ["2", f"{device_id}", f"{device_name}", f"{device_version}", "SOTA", f"{sota_time}", f"{sota_status}"],
-        ["3", f"{device_id}", f"{device_name}", f"{device_version}", "FOTA", f"{fota_time}", f"{fota_status}"],
-        ["4", f"{device_id}", f"{device_name}", f"{device_version}", "Monitoring", f"{monitoring_time}", f"{monitoring_status}"],
-    ]
-    
+    columns = ["No.", "Board ID", "Board Name", "Board Version", "Function", "Start", "End", "Time execution", "Result"]
+    rows = list()
+    for unit, unit_results in results:
+        for function, start, end, time_execution, status in unit_results:
+            rows.append([f"{len(rows) + 1}", f"{unit['unit_id']}", f"{unit['unit_name']}", f"{unit['unit_version']}", function, start, end, time_execution, status])
+
     for column in columns:
         table.add_column(column)
     for row in rows:
@@ -85,3 +281,74 @@ if __name__ == "__main__":
 
     console = Console()
     console.print(table)
+    cache_stats = AosCloud.Cache.stats()
+    console.print(f"AosCloud cache: {cache_stats['hits']} hits, {cache_stats['misses']} misses "
+                  f"(hit ratio {cache_stats['hit_ratio']:.0%}), {cache_stats['invalidations']} invalidations")
+    validator_stats = AosCloud.Validators.stats()
+    console.print(f"AosCloud polls: {validator_stats['not_modified']} not modified, {validator_stats['unchanged']} unchanged, "
+                  f"{validator_stats['changed']} changed")
+    hedge_stats = default_hedger.stats()
+    if hedge_stats["hedged"]:
+        console.print(f"AosCloud hedged GETs: {hedge_stats['hedged']} sent, {hedge_stats['won']} answered first")
+
+    # Requests per endpoint, slowest in total first
+    endpoints_table = Table(title="AosCloud Requests")
+    for column in ["Method", "Endpoint", "Calls", "Errors", "Retries", "p50 (s)", "p95 (s)", "Max (s)", "Total (s)", "Sent", "Received"]:
+        endpoints_table.add_column(column)
+    for row in request_metrics.summary():
+        endpoints_table.add_row(row["method"], row["endpoint"], f"{row['calls']}", f"{row['errors']}", f"{row['retries']}",
+                                f"{row['p50']:.3f}", f"{row['p95']:.3f}", f"{row['max']:.3f}", f"{row['total']:.3f}",
+                                f"{row['sent'] / 2**10:.1f} KB", f"{row['received'] / 2**10:.1f} KB",
+                                style="bright_red" if row["errors"] else None)
+    console.print(endpoints_table)
+
+def record_history(results: list, started, path=None, label=None) -> None:
+    """
+        Store the stage durations and the per-endpoint request metrics of the run
+    """
+    from utilities.history import RunHistory
+    with RunHistory(path) as history:
+        run_id = history.record_run(results, request_metrics.summary(), started=started, label=label)
+        print(f"Run {run_id} recorded in {history.path}")
+
+def main(argv=None) -> None:
+    args = get_command_line_args(argv)
+    configure_logging()
+    started = datetime.datetime.now().astimezone()
+    if args.inventory:
+        units = load_inventory(args.inventory)
+    else:
+        units = [dict(unit_id=args.unit_id, unit_ip=args.unit_ip, unit_name=args.unit_name, unit_version=args.unit_version)]
+
+    firmware = firmware_option(args.new_firmware)
+    shared = SharedResources([firmware_option(unit.get("new_firmware", firmware)) for unit in units],
+                             keep_resources = args.keep_resources,
+                             trace_calls = args.trace_calls)
+    options = dict(firmware = firmware,
+                   shared = shared,
+                   trace_calls = args.trace_calls,
+                   monitoring = dict(duration = args.monitoring_duration,
+                                     interval = args.monitoring_interval,
+                                     export = args.monitoring_export))
+
+    # Test
+    try:
+        if args.inventory:
+            results = run_inventory(units, options, args.workers, args.log_dir)
+        else:
+            unit = units[0]
+            results = [(unit, run_pipeline(id=unit["unit_id"], ip=unit["unit_ip"], name=unit["unit_name"], version=unit["unit_version"], **options))]
+    finally:
+        shared.close()
+
+    print_summary(results)
+    if not args.no_history:
+        record_history(results, started, args.history, args.label)
+    if args.metrics_json:
+        request_metrics.to_json(args.metrics_json)
+    if args.metrics_prometheus:
+        request_metrics.to_prometheus(args.metrics_prometheus)
+
+
+if __name__ == "__main__":
+    main()
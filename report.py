@@ -0,0 +1,84 @@
+import sys
+import argparse
+
+def get_command_line_args(argv=None):
+    parser = argparse.ArgumentParser(description="Compare the latest recorded run of main.py with the previous runs and flag stage regressions")
+    parser.add_argument("--history", nargs = "?",
+                        help = "SQLite file written by main.py (default: ~/.aos/run-history.sqlite or AOS_HISTORY)")
+    parser.add_argument("--run", type = int,
+                        help = "Id of the run to check (default: the latest)")
+    parser.add_argument("--baseline", type = int, default = 5,
+                        help = "Number of previous passing runs in the rolling baseline")
+    parser.add_argument("--threshold", type = float, default = 0.2,
+                        help = "Relative slowdown flagged as a regression (0.2 = 20%%)")
+    parser.add_argument("--min-delta", type = float, default = 1.0,
+                        help = "Slowdown in seconds below which a stage is never flagged")
+    parser.add_argument("--runs", action = "store_true",
+                        help = "List the recorded runs instead")
+    parser.add_argument("--endpoints", action = "store_true",
+                        help = "Also print the per-endpoint request metrics of the run")
+    parser.add_argument("--json", nargs = "?",
+                        help = "Write the comparison and the endpoint metrics to a JSON file")
+    return parser.parse_args(argv)
+
+def main(argv=None) -> int:
+    """
+        Return type: class 'int', the exit status: 1 if a stage regressed or failed
+    """
+    from rich.console import Console
+    from rich.table import Table
+    from utilities.history import RunHistory
+
+    args = get_command_line_args(argv)
+    console = Console()
+    with RunHistory(args.history) as history:
+        if args.runs:
+            table = Table(title=f"Runs recorded in {history.path}")
+            for column in ["Run", "Started", "Finished", "Label", "Passed", "Failed"]:
+                table.add_column(column)
+            for run in history.runs():
+                table.add_row(f"{run['id']}", run["started"], run["finished"], run["label"] or "", f"{run['passed'] or 0}", f"{run['failed'] or 0}")
+            console.print(table)
+            return 0
+
+        run_id = args.run or history.latest_run_id()
+        if run_id is None:
+            console.print(f"No run recorded in {history.path}")
+            return 0
+        options = dict(baseline=args.baseline, threshold=args.threshold, min_delta=args.min_delta)
+        comparison = history.compare(run_id, **options)
+        styles = {"regressed": "bright_red", "failed": "bright_red", "improved": "bright_green", "ok": None, "no baseline": "yellow"}
+        table = Table(title=f"Run {run_id} against the median of up to {args.baseline} previous passing runs")
+        for column in ["Board ID", "Function", "Result", "Time (s)", "Baseline (s)", "Runs", "Change", "Status"]:
+            table.add_column(column)
+        for row in comparison:
+            table.add_row(row["unit_id"], row["stage"], row["result"],
+                          f"{row['duration']:.2f}" if row["duration"] is not None else "-",
+                          f"{row['baseline']:.2f}" if row["baseline"] is not None else "-",
+                          f"{row['samples']}",
+                          f"{row['change']:+.0%}" if row["change"] is not None else "-",
+                          row["status"].upper(), style=styles[row["status"]])
+        console.print(table)
+
+        if args.endpoints:
+            endpoints_table = Table(title=f"AosCloud Requests of run {run_id}")
+            for column in ["Method", "Endpoint", "Calls", "Errors", "Retries", "p50 (s)", "p95 (s)", "Max (s)", "Total (s)"]:
+                endpoints_table.add_column(column)
+            for row in history.endpoints(run_id):
+                endpoints_table.add_row(row["method"], row["endpoint"], f"{row['calls']}", f"{row['errors']}", f"{row['retries']}",
+                                        f"{row['p50']:.3f}", f"{row['p95']:.3f}", f"{row['max']:.3f}", f"{row['total']:.3f}")
+            console.print(endpoints_table)
+        if args.json:
+            history.to_json(args.json, run_id, **options)
+
+    regressed = [row for row in comparison if row["status"] in ("regressed", "failed")]
+    for row in regressed:
+        # The change is None against a baseline of 0 seconds: print the slowdown in seconds instead
+        change = f"{row['change']:+.0%}" if row["change"] is not None else f"{row['duration'] - row['baseline']:+.2f}s"
+        console.print(f"{row['stage']} of {row['unit_id']} " + ("FAILED" if row["status"] == "failed" else
+                      f"REGRESSED: {row['duration']:.2f}s against {row['baseline']:.2f}s ({change})"), style="bright_red")
+    return 1 if regressed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
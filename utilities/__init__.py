@@ -0,0 +1,12 @@
+import logging
+
+def configure_logging() -> None:
+    """
+        Log format shared by the command line tools and the AosCloud client. It only takes effect
+        for the first caller, as logging.basicConfig().
+    """
+    logging.basicConfig(
+        format = '%(asctime)s %(levelname)-8s %(message)s',
+        datefmt = '%Y-%m-%d %H:%M:%S',
+        level = logging.INFO
+    )
@@ -1,114 +1,595 @@
 import os
 from requests import *
+from requests.adapters import HTTPAdapter
+from urllib.parse import urlparse
 from pathlib import Path
 import json
-import yaml
+import hashlib
 import logging
 import time
+import threading
+from concurrent.futures import ThreadPoolExecutor
+import re
+from fnmatch import fnmatchcase
+from collections import OrderedDict
+from . import configure_logging
+from .poller import default_poller
+from .upload import MultipartFileStream, file_sha256
+from .metrics import request_metrics, endpoint_template, submit_in_context
+from .ratelimit import TokenBucket, parse_retry_after
+from .retry import RetryPolicy, default_hedger, never_sent
 
-logging.basicConfig(
-    format = '%(asctime)s %(levelname)-8s %(message)s',
-    datefmt = '%Y-%m-%d %H:%M:%S',
-    level = logging.INFO
-)
+configure_logging()
 log = logging.getLogger(__name__)
 
 class AosCloud():
+    # Base url of the REST API and certificates of each user role. They can be overridden, e.g. to
+    # run against the local stand-in server of utilities/mock_cloud.py
+    api_url = {
+        "sp": os.environ.get("AOS_SP_URL", "https://sp.aoscloud.io:10000/api/v1"),
+        "oem": os.environ.get("AOS_OEM_URL", "https://oem.aoscloud.io:10000/api/v1")
+    }
+    security_dir = Path(os.environ.get("AOS_SECURITY_DIR", Path.home()/".aos"/"security"))
+
+    @classmethod
+    def url(cls, role: str, endpoint: str) -> str:
+        """
+            Return the url of an API endpoint, e.g. AosCloud.url("oem", "units/")
+        """
+        return f"{cls.api_url[role]}/{endpoint}"
+
+    class SessionPool():
+        """
+            Keep-alive mTLS sessions shared by every AosCloud.Request. One session is kept per
+            (role, host) pair, e.g. ("sp", "sp.aoscloud.io:10000") and ("oem", "oem.aoscloud.io:10000"),
+            so the TCP connection and TLS handshake are reused across calls instead of being
+            established again for every request.
+            The number of pooled connections per host can be set with the AOS_POOL_SIZE
+            environment variable or AosCloud.SessionPool.configure().
+        """
+        pool_size = int(os.environ.get("AOS_POOL_SIZE", 10))
+        _sessions = dict()
+        _lock = threading.Lock()
+
+        @classmethod
+        def get(cls, role: str, host: str) -> Session:
+            """
+                Return the pooled session of a role for a host, creating it on first use
+                Parameters:
+                    role: "sp" or "oem" (class 'str')
+                    host: network location of the request url (class 'str')
+                Return type: class 'requests.Session'
+            """
+            with cls._lock:
+                session = cls._sessions.get((role, host))
+                if session is None:
+                    session = Session()
+                    session.cert = str(AosCloud.security_dir/f"aos-long-user-{role}.pem")
+                    session.verify = str(AosCloud.security_dir/"aos-root-certificate.pem")
+                    adapter = HTTPAdapter(pool_connections=1, pool_maxsize=cls.pool_size)
+                    session.mount("https://", adapter)
+                    cls._sessions[(role, host)] = session
+                return session
+
+        @classmethod
+        def configure(cls, pool_size: int) -> None:
+            """
+                Change the number of pooled connections per host. Existing sessions are closed
+                and re-created with the new size on the next request.
+            """
+            cls.close()
+            cls.pool_size = pool_size
+
+        @classmethod
+        def close(cls) -> None:
+            with cls._lock:
+                for session in cls._sessions.values():
+                    session.close()
+                cls._sessions.clear()
+
+    class RateLimiter():
+        """
+            Token bucket of each user role, i.e. of each AosCloud host (sp.aoscloud.io and
+            oem.aoscloud.io), shared by every AosCloud.Request of the process, whether it is sent
+            from a thread, the inventory workers or the AsyncAosCloud worker pool. The sustained
+            rate in requests per second is set with AOS_RATE_LIMIT (default 20, 0 for no limit) or
+            per role with AOS_RATE_LIMIT_SP and AOS_RATE_LIMIT_OEM, the burst size with
+            AOS_RATE_BURST. The rate adapts to 429 responses, see ratelimit.TokenBucket.
+        """
+        _buckets = dict()
+        _lock = threading.Lock()
+
+        @classmethod
+        def bucket(cls, role: str) -> TokenBucket:
+            with cls._lock:
+                bucket = cls._buckets.get(role)
+                if bucket is None:
+                    rate = float(os.environ.get(f"AOS_RATE_LIMIT_{role.upper()}", os.environ.get("AOS_RATE_LIMIT", 20)))
+                    burst = os.environ.get("AOS_RATE_BURST")
+                    bucket = cls._buckets[role] = TokenBucket(rate, burst=int(burst) if burst else None)
+                return bucket
+
+        @classmethod
+        def configure(cls, role: str, rate: float, burst=None) -> None:
+            """
+                Change the rate (requests per second, 0 for no limit) and burst size of a role
+            """
+            with cls._lock:
+                cls._buckets[role] = TokenBucket(rate, burst=burst)
+
+        @classmethod
+        def stats(cls) -> dict:
+            with cls._lock:
+                return {role: bucket.stats() for role, bucket in cls._buckets.items()}
+
+    class Cache():
+        """
+            Size-bounded LRU cache of GET responses for AosCloud collections, shared by every
+            AosCloud.Request. Each endpoint has its own time-to-live; endpoints without one (the
+            polled ones such as connection-info or monitoring) are never cached. A POST, PATCH or
+            DELETE sent by the client drops every cached response of the same resource, e.g. a
+            POST to /subjects/{id}/units/ invalidates /subjects/ and /subjects/{id}/units/.
+            Collections that AosCloud changes on its own, such as update-components and the
+            fleet-validation-batch queue filled when a build finishes, are never cached either.
+            The cache can be disabled with AOS_CACHE=0 and sized with AOS_CACHE_SIZE.
+        """
+        enabled = os.environ.get("AOS_CACHE", "1") != "0"
+        max_entries = int(os.environ.get("AOS_CACHE_SIZE", 256))
+        # Time-to-live in seconds of each cached endpoint, relative to /api/v1/
+        ttl = {
+            r"services/": 30,
+            r"subjects/": 30,
+            r"subjects/\d+/services/": 30,
+            r"subjects/\d+/units/": 30,
+            r"units/": 60,
+            r"unit-models/": 300
+        }
+        _entries = OrderedDict()
+        _lock = threading.Lock()
+        _stats = dict(hits=0, misses=0, evictions=0, invalidations=0)
+
+        @staticmethod
+        def resource(path: str) -> str:
+            return path.split("/api/v1/", 1)[-1].split("/", 1)[0]
+
+        @classmethod
+        def _ttl(cls, path: str):
+            endpoint = path.split("/api/v1/", 1)[-1]
+            return next((ttl for pattern, ttl in cls.ttl.items() if re.fullmatch(pattern, endpoint)), None)
+
+        @classmethod
+        def lookup(cls, role: str, url: str, params=None):
+            """
+                Return the cached response of a GET request or None when it is not cached or expired
+            """
+            if not cls.enabled or cls._ttl(urlparse(url).path) is None:
+                return None
+            key = (role, url, tuple(sorted((params or {}).items())))
+            with cls._lock:
+                entry = cls._entries.get(key)
+                if entry and entry[0] > time.monotonic():
+                    cls._entries.move_to_end(key)
+                    cls._stats["hits"] += 1
+                    return entry[1]
+                if entry:
+                    del cls._entries[key]
+                cls._stats["misses"] += 1
+            return None
+
+        @classmethod
+        def store(cls, role: str, url: str, params, response) -> None:
+            ttl = cls._ttl(urlparse(url).path)
+            if not cls.enabled or ttl is None:
+                return
+            key = (role, url, tuple(sorted((params or {}).items())))
+            with cls._lock:
+                cls._entries[key] = (time.monotonic() + ttl, response)
+                cls._entries.move_to_end(key)
+                while len(cls._entries) > cls.max_entries:
+                    cls._entries.popitem(last=False)
+                    cls._stats["evictions"] += 1
+
+        @classmethod
+        def invalidate(cls, resource: str) -> None:
+            """
+                Drop every cached response of a resource
+                Parameters:
+                    resource: resource name below /api/v1/, e.g. "subjects" (class 'str')
+            """
+            with cls._lock:
+                for key in [key for key in cls._entries if cls.resource(urlparse(key[1]).path) == resource]:
+                    del cls._entries[key]
+                    cls._stats["invalidations"] += 1
+
+        @classmethod
+        def clear(cls) -> None:
+            with cls._lock:
+                cls._entries.clear()
+
+        @classmethod
+        def stats(cls) -> dict:
+            """
+                Return hit/miss counters of the cache
+                Return type: class 'dict' with keys hits, misses, hit_ratio, evictions, invalidations, entries
+            """
+            with cls._lock:
+                stats = dict(cls._stats, entries=len(cls._entries))
+            lookups = stats["hits"] + stats["misses"]
+            stats["hit_ratio"] = round(stats["hits"] / lookups, 4) if lookups else 0.0
+            return stats
+
+    class Index():
+        """
+            In-process index of units by system_uid, unit models by name and update components by
+            (component_id, vendor_version). Every element seen while paging through a collection is
+            added to the index, so later lookups of other keys are answered without downloading the
+            collection again. Misses are refreshed with server-side filter parameters and stop at
+            the first page holding the key. A write to a resource drops its index, and entries
+            expire like cached responses, so elements changed or deleted on AosCloud by another
+            process are read again.
+        """
+        # Resource: (collection endpoint, fields forming the key, also used as server-side filters)
+        endpoints = {
+            "units": ("units/", ("system_uid",)),
+            "unit-models": ("unit-models/", ("name",)),
+            "update-components": ("update-components/", ("component_id", "vendor_version"))
+        }
+        # Time-to-live in seconds of the entries of each resource, the same as the cached units and
+        # unit models. Components are short-lived: a stale "Ready" entry would skip a needed upload.
+        ttl = {
+            "units": 60,
+            "unit-models": 300,
+            "update-components": 30
+        }
+        _entries = {resource: dict() for resource in endpoints}
+        _lock = threading.Lock()
+        _stats = dict(hits=0, misses=0)
+
+        @classmethod
+        def add(cls, resource: str, element: dict) -> tuple:
+            key = tuple(element[field] for field in cls.endpoints[resource][1])
+            with cls._lock:
+                cls._entries[resource][key] = (time.monotonic() + cls.ttl[resource], element)
+            return key
+
+        @classmethod
+        def lookup(cls, resource: str, key, match=None):
+            """
+                Return the element of a resource identified by key, or None if AosCloud has no such element
+                Parameters:
+                    resource: "units", "unit-models" or "update-components" (class 'str')
+                    key: value of the key fields, a tuple for update-components (class 'str' or 'tuple')
+                    match: optional predicate the element must satisfy, e.g. a state check (class 'function')
+                Return type: class 'dict'
+            """
+            key = key if isinstance(key, tuple) else (key,)
+            with cls._lock:
+                expires, element = cls._entries[resource].get(key, (0, None))
+                if expires > time.monotonic() and (match is None or match(element)):
+                    cls._stats["hits"] += 1
+                    return element
+                cls._stats["misses"] += 1
+            endpoint, fields = cls.endpoints[resource]
+            aos_request = AosCloud.Request(url = AosCloud.url("oem", endpoint), role = "oem")
+            for element in aos_request.paginate(params = dict(zip(fields, key))):
+                if cls.add(resource, element) == key and (match is None or match(element)):
+                    return element
+            return None
+
+        @classmethod
+        def invalidate(cls, resource: str) -> None:
+            if resource in cls._entries:
+                with cls._lock:
+                    cls._entries[resource].clear()
+
+        @classmethod
+        def stats(cls) -> dict:
+            with cls._lock:
+                return dict(cls._stats, entries={resource: len(entries) for resource, entries in cls._entries.items()})
+
+    class Validators():
+        """
+            Validators of the last response of each polled URL: its ETag and Last-Modified headers,
+            a hash of its body and the parsed JSON. Request.get_json() sends them back as a
+            conditional GET; when the server answers 304 Not Modified or the body hash did not
+            change, the parsed JSON of the previous response is returned without parsing again.
+        """
+        max_entries = int(os.environ.get("AOS_CACHE_SIZE", 256))
+        _entries = OrderedDict()
+        _lock = threading.Lock()
+        _stats = dict(not_modified=0, unchanged=0, changed=0)
+
+        @classmethod
+        def lookup(cls, key: tuple):
+            with cls._lock:
+                entry = cls._entries.get(key)
+                if entry:
+                    cls._entries.move_to_end(key)
+                return entry
+
+        @classmethod
+        def store(cls, key: tuple, etag, last_modified, digest: bytes, data) -> None:
+            with cls._lock:
+                cls._entries[key] = dict(etag=etag, last_modified=last_modified, digest=digest, data=data)
+                cls._entries.move_to_end(key)
+                while len(cls._entries) > cls.max_entries:
+                    cls._entries.popitem(last=False)
+
+        @classmethod
+        def count(cls, outcome: str) -> None:
+            with cls._lock:
+                cls._stats[outcome] += 1
+
+        @classmethod
+        def clear(cls) -> None:
+            with cls._lock:
+                cls._entries.clear()
+
+        @classmethod
+        def stats(cls) -> dict:
+            """
+                Return type: class 'dict' with the number of "not_modified" (304), "unchanged" (same
+                             body hash) and "changed" responses of conditional GETs
+            """
+            with cls._lock:
+                return dict(cls._stats)
+
+    class Manifest():
+        """
+            Local JSON record of what was already published on AosCloud, keyed by a content hash
+        """
+        path = None
+
+        @classmethod
+        def _load(cls) -> dict:
+            try:
+                with open(cls.path, "r") as file:
+                    return json.load(file)
+            except (FileNotFoundError, json.JSONDecodeError):
+                return dict()
+
+        @classmethod
+        def _save(cls, manifest: dict) -> None:
+            cls.path.parent.mkdir(parents=True, exist_ok=True)
+            with open(cls.path, "w") as file:
+                json.dump(manifest, file, indent=2)
+
+        @classmethod
+        def get(cls, sha256: str):
+            with cls._lock:
+                return cls._load().get(sha256)
+
+        @classmethod
+        def record(cls, sha256: str, value) -> None:
+            with cls._lock:
+                manifest = cls._load()
+                manifest[sha256] = value
+                cls._save(manifest)
+
+        @classmethod
+        def _discard(cls, condition) -> None:
+            """
+                Drop every entry whose value satisfies condition
+            """
+            with cls._lock:
+                manifest = cls._load()
+                kept = {sha256: value for sha256, value in manifest.items() if not condition(value)}
+                if kept != manifest:
+                    cls._save(kept)
+
+    class ComponentManifest(Manifest):
+        """
+            Local record of the batch files already uploaded to AosCloud, keyed by the SHA-256 of
+            the file and holding the components built from it, as a list of
+            {"component_id": <value>, "version": <value>}. It lets Component.upload_batch_file
+            skip uploading an image that is still available as a Ready component on AosCloud.
+            The manifest is stored in ~/.aos/component-manifest.json unless AOS_COMPONENT_MANIFEST
+            points to another file.
+        """
+        path = Path(os.environ.get("AOS_COMPONENT_MANIFEST", Path.home()/".aos"/"component-manifest.json"))
+        _lock = threading.Lock()
+
+        @classmethod
+        def forget(cls, component_id: str, version: str) -> None:
+            """
+                Drop every batch file that contains a component removed from AosCloud
+            """
+            cls._discard(lambda components: dict(component_id = component_id, version = version) in components)
+
+    class ServiceManifest(Manifest):
+        """
+            Local record of the service versions signed and uploaded to AosCloud, keyed by the
+            SHA-256 of the service sources and rendered metadata (config.yaml) and holding
+            {"service_uuid": <value>, "version": <value>}. It lets a SOTA run skip aos-signer when
+            the same build is still the latest version of the service. The manifest is stored in
+            ~/.aos/service-manifest.json unless AOS_SERVICE_MANIFEST points to another file.
+        """
+        path = Path(os.environ.get("AOS_SERVICE_MANIFEST", Path.home()/".aos"/"service-manifest.json"))
+        _lock = threading.Lock()
+
+        @classmethod
+        def forget(cls, service_uuid: str) -> None:
+            """
+                Drop every build of a service removed from AosCloud
+            """
+            cls._discard(lambda build: build["service_uuid"] == service_uuid)
+
     class Request():
+        page_size = int(os.environ.get("AOS_PAGE_SIZE", 100))
+        page_size_param = "limit"
+        # 429 responses retried on top of the attempts given to server and connection errors
+        max_throttled_retries = 10
+        # (method, endpoint template, policy), the first match applies, see RetryPolicy
+        retry_policies = [
+            # Approving a batch and setting a unit model configuration set a state, they can be sent twice
+            ("PATCH", "*", RetryPolicy(idempotent = True)),
+            # Adding members that are already assigned to a subject changes nothing
+            ("POST", "subjects/{id}/services/", RetryPolicy(idempotent = True)),
+            ("POST", "subjects/{id}/units/", RetryPolicy(idempotent = True)),
+            # AosCloud checks the uploaded image before answering
+            ("POST", "update-components/upload/", RetryPolicy(read_timeout = 300)),
+            ("*", "*", RetryPolicy())
+        ]
+
+        @classmethod
+        def retry_policy(cls, method: str, url: str) -> RetryPolicy:
+            endpoint = endpoint_template(urlparse(url).path)
+            return next(policy for methods, endpoints, policy in cls.retry_policies
+                        if fnmatchcase(method, methods) and fnmatchcase(endpoint, endpoints))
+
         def __init__(self, url, role, header={"accept": "application/json"}, data=None, files=None):
             self.request_url = url
             self.upload_data = data
             self.upload_files = files
             self.request_headers = header
-            self.root_ca = str(Path.home()/".aos"/"security"/"aos-root-certificate.pem")
-            self.authenticate_cert = str(Path.home()/".aos"/"security"/f"aos-long-user-{role}.pem")
+            self.role = role
+            self.session = AosCloud.SessionPool.get(role, urlparse(url).netloc)
+            self.root_ca = self.session.verify
+            self.authenticate_cert = self.session.cert
 
-        def get(self):
-            retry = 0
-            while retry < 3:
+        def _send(self, method, url=None, headers={}, **kwargs):
+            url = url or self.request_url
+            if method == "GET":
+                response = AosCloud.Cache.lookup(self.role, url, kwargs.get("params"))
+                if response is not None:
+                    return response
+            policy = self.retry_policy(method, url)
+            bucket = AosCloud.RateLimiter.bucket(self.role)
+            hedge_delay = None
+            if method == "GET" and policy.hedge_percentile:
+                hedge_delay = request_metrics.latency_quantile(method, urlparse(url).path, policy.hedge_percentile)
+
+            def send():
+                bucket.acquire()
+                return self.session.request(
+                    method = method,
+                    url = url,
+                    headers = {**self.request_headers, **headers},
+                    # Passed explicitly: REQUESTS_CA_BUNDLE would take precedence over session.verify
+                    verify = self.root_ca,
+                    cert = self.authenticate_cert,
+                    timeout = policy.timeout,
+                    **kwargs
+                )
+
+            sent = 0
+            failed = 0
+            throttled = 0
+            response = None
+            start = time.perf_counter()
+            while True:
+                # A streamed body has to be sent again from its start on every attempt
+                if hasattr(kwargs.get("data"), "seek"):
+                    kwargs["data"].seek(0)
+                sent += 1
                 try:
-                    response = get(
-                        url = self.request_url,
-                        cert = self.authenticate_cert,
-                        verify = self.root_ca,
-                        headers = self.request_headers
-                    )
-                    response.raise_for_status()
-                    break
-                except HTTPError as err:
-                    SystemExit(f"{err}\n{response.json()}")
-                except ConnectionError as err:
+                    if hedge_delay is not None:
+                        # Slower than most calls of the endpoint: send a duplicate and keep the first response
+                        response = default_hedger.call(send, max(hedge_delay, policy.hedge_min_delay))
+                    else:
+                        response = send()
+                except (ConnectionError, Timeout) as err:
                     log.error(err)
-                retry += 1
-            if retry == 3:
-                SystemExit("Max retries exceed with url. Please check Internet connection")
+                    response = None
+                    received = not never_sent(err)
+                else:
+                    if response.status_code == 429 and throttled < self.max_throttled_retries:
+                        # Throttled: every request of the role waits, the attempt is not counted as a failure
+                        throttled += 1
+                        bucket.throttle(parse_retry_after(response.headers.get("Retry-After")))
+                        log.warning(f"THROTTLED BY AOSCLOUD ({throttled}/{self.max_throttled_retries}), RETRY {method} {url}")
+                        continue
+                    if response.status_code not in policy.retry_statuses:
+                        if response.status_code < 500:
+                            bucket.succeed()
+                        break
+                    log.error(f"{method} {url} FAILED WITH {response.status_code} (ATTEMPT {failed + 1}/{policy.attempts})")
+                    received = True
+                failed += 1
+                if not policy.may_retry(method, failed, received):
+                    break
+                delay = policy.delay(failed)
+                log.warning(f"RETRY {method} {url} IN {delay:.2f}s")
+                time.sleep(delay)
+            request_metrics.record(method = method,
+                                   path = urlparse(url).path,
+                                   status = response.status_code if response is not None else "error",
+                                   latency = time.perf_counter() - start,
+                                   retries = sent - 1,
+                                   request_bytes = int(response.request.headers.get("Content-Length") or 0) if response is not None else 0,
+                                   response_bytes = len(response.content) if response is not None else 0)
+            if response is None:
+                raise SystemExit(f"Max retries exceeded with url {url}. Please check Internet connection")
+            try:
+                response.raise_for_status()
+            except HTTPError as err:
+                raise SystemExit(f"{err}\n{response.text[:1000]}")
+            if method == "GET":
+                AosCloud.Cache.store(self.role, url, kwargs.get("params"), response)
+            else:
+                resource = AosCloud.Cache.resource(urlparse(url).path)
+                AosCloud.Cache.invalidate(resource)
+                AosCloud.Index.invalidate(resource)
             return response
 
+        def get(self):
+            return self._send("GET")
+
+        def get_json(self):
+            """
+                Same as get().json() for polled endpoints: the request is sent with the validators of
+                the previous response (If-None-Match, If-Modified-Since) and, if the server answers 304
+                or the body is unchanged, the previously parsed JSON is returned. The returned object
+                may be shared between calls and must not be modified.
+            """
+            key = (self.role, self.request_url)
+            entry = AosCloud.Validators.lookup(key)
+            headers = dict()
+            if entry and entry["etag"]:
+                headers["If-None-Match"] = entry["etag"]
+            if entry and entry["last_modified"]:
+                headers["If-Modified-Since"] = entry["last_modified"]
+            response = self._send("GET", headers=headers)
+            if response.status_code == 304 and entry:
+                AosCloud.Validators.count("not_modified")
+                return entry["data"]
+            digest = hashlib.blake2b(response.content, digest_size=16).digest()
+            if entry and entry["digest"] == digest:
+                AosCloud.Validators.count("unchanged")
+                data = entry["data"]
+            else:
+                AosCloud.Validators.count("changed")
+                data = response.json()
+            AosCloud.Validators.store(key, response.headers.get("ETag"), response.headers.get("Last-Modified"), digest, data)
+            return data
+
         def post(self):
-            retry = 0
-            while retry < 3:
-                try:
-                    response = post(
-                        url = self.request_url,
-                        cert = self.authenticate_cert,
-                        headers = self.request_headers,
-                        verify = self.root_ca,
-                        data = self.upload_data,
-                        files = self.upload_files
-                    )
-                    response.raise_for_status()
-                    break
-                except HTTPError as err:
-                    SystemExit(f"{err}\n{response.json()}")
-                except ConnectionError as err:
-                    log.error(err)
-                retry += 1
-            if retry == 3:
-                SystemExit("Max retries exceed with url. Please check Internet connection")
-            return response
-            
+            return self._send("POST", data=self.upload_data, files=self.upload_files)
+
         def patch(self):
-            retry = 0
-            while retry < 3:
-                try:
-                    response = patch(
-                        url = self.request_url,
-                        cert = self.authenticate_cert,
-                        headers = self.request_headers,
-                        verify = self.root_ca,
-                        data = self.upload_data
-                    )
-                    response.raise_for_status()
-                    break
-                except HTTPError as err:
-                    SystemExit(f"{err}\n{response.json()}")
-                except ConnectionError as err:
-                    log.error(err)
-                retry += 1
-            if retry == 3:
-                SystemExit("Max retries exceed with url. Please check Internet connection")
-            return response
+            return self._send("PATCH", data=self.upload_data)
 
         def delete(self):
-            retry = 0
-            while retry < 3:
-                try:
-                    response = delete(
-                        url = self.request_url,
-                        cert = self.authenticate_cert,
-                        verify = self.root_ca,
-                        headers = self.request_headers
-                    )
-                    response.raise_for_status()
-                    break
-                except HTTPError as err:
-                    SystemExit(f"{err}\n{response.json()}")
-                except ConnectionError as err:
-                    log.error(err)
-                retry += 1
-            if retry == 3:
-                SystemExit("Max retries exceed with url. Please check Internet connection")
-            return response
+            return self._send("DELETE", data=self.upload_data)
+
+        def paginate(self, page_size=None, params=None):
+            """
+                Stream the results of a list endpoint page by page by following the "next" link
+                of each response. Only one page is held in memory at a time and no more pages are
+                downloaded once the caller stops iterating, so lookups can stop at the first match.
+                Parameters:
+                    page_size: number of results per page, defaults to AosCloud.Request.page_size (class 'int')
+                    params: extra query parameters of the first page, e.g. filters (class 'dict')
+                Return type: generator of result elements (class 'dict')
+            """
+            url = self.request_url
+            params = {**(params or {}), self.page_size_param: page_size or self.page_size}
+            while url:
+                response = self._send("GET", url=url, params=params).json()
+                yield from response["results"]
+                # The "next" link already carries the paging parameters
+                url = response.get("next")
+                params = None
 
 
     class Entities():
@@ -136,20 +617,17 @@ class AosCloud():
                     }
                 }
                 # sv_name = list()
-                aos_request = AosCloud.Request(url = "https://sp.aoscloud.io:10000/api/v1/services/",
+                aos_request = AosCloud.Request(url = AosCloud.url("sp", "services/"),
                                                role = "sp",
                                                header = {"Content-Type": "application/json"},
                                                data = json.dumps(data))
 
-                exist = False 
-                for sv in self.list_service_instance():
-                    if self.service_title == sv.get("title"):
-                        log.info("SERVICE INSTANCE ALREADY EXISTS")
-                        self.service_uuid = sv.get("uuid")
-                        self.service_id = sv.get("id")
-                        exist = True
-                
-                if not exist:
+                sv = next((sv for sv in self.iter_service_instance() if self.service_title == sv.get("title")), None)
+                if sv:
+                    log.info("SERVICE INSTANCE ALREADY EXISTS")
+                    self.service_uuid = sv.get("uuid")
+                    self.service_id = sv.get("id")
+                else:
                     log.info("CREATE NEW SERVICE INSTANCE")
                     response = aos_request.post().json()
                     self.service_uuid = response.get("uuid")
@@ -160,9 +638,10 @@ class AosCloud():
                     Remove the service instance to AosCloud after testing
                 """
                 log.info(f"REMOVE SERVICE TITLE: {self.service_title} FROM AOSCLOUD")
-                aos_request = AosCloud.Request(url = f"https://sp.aoscloud.io:10000/api/v1/services/{self.service_id}/",
+                aos_request = AosCloud.Request(url = AosCloud.url("sp", f"services/{self.service_id}/"),
                                                role = "sp")
                 aos_request.delete()
+                AosCloud.ServiceManifest.forget(self.service_uuid)
 
             def modify_service_metadata(self, meta_dir, sv_info_file, sv_metadata_file) -> None:
                 """
@@ -176,6 +655,7 @@ class AosCloud():
                         sv_metadata_file: config.yaml file path (class 'str')
                     Return type: None
                 """
+                import yaml
                 log.info("MODIFY CONFIG.YAML METADATA FILE")
                 if not os.path.isdir(meta_dir):
                     os.makedirs(meta_dir)
@@ -207,20 +687,38 @@ class AosCloud():
                     ]
                     Return type: class 'list'
                 """
-                aos_request = AosCloud.Request(url = "https://sp.aoscloud.io:10000/api/v1/services/",
+                return list(self.iter_service_instance())
+
+            def iter_service_instance(self):
+                """
+                    Same as list_service_instance() but streams the service instances page by page
+                    Return type: generator of class 'dict'
+                """
+                aos_request = AosCloud.Request(url = AosCloud.url("sp", "services/"),
                                                role = "sp")
-                
-                response = aos_request.get().json()
-                instance_list = list()
-                for element in response["results"]:
-                    data ={
+                for element in aos_request.paginate():
+                    yield {
                         "title": element["title"],
                         "uuid": element["uuid"],
                         "id": element["id"]
                     }
-                    instance_list.append(data)
-                return instance_list
             
+            def find_published_build(self, build_sha256: str) -> bool:
+                """
+                    Check the local manifest for a build of this service with the same SHA-256 that is
+                    still the latest version of the service on AosCloud, in which case signing and
+                    uploading it again would publish an identical version.
+                    Return type: class 'bool'
+                """
+                build = AosCloud.ServiceManifest.get(build_sha256)
+                if not build or build["service_uuid"] != self.service_uuid:
+                    return False
+                return self.latest_service_system_version() == build["version"]
+
+            def record_published_build(self, build_sha256: str, version: int) -> None:
+                AosCloud.ServiceManifest.record(build_sha256, dict(service_uuid = self.service_uuid,
+                                                                   version = version))
+
             def latest_service_system_version(self) -> int:
                 """
                     AosCloud automatically uses the latest version of uploaded service for service
@@ -228,7 +726,7 @@ class AosCloud():
                     for later validation when service is deployed on Unit.
                     Return type: class 'int'
                 """
-                aos_request = AosCloud.Request(url = f"https://sp.aoscloud.io:10000/api/v1/services/{self.service_uuid}/service-versions/",
+                aos_request = AosCloud.Request(url = AosCloud.url("sp", f"services/{self.service_uuid}/service-versions/"),
                                                role = "sp")
                 
                 response = aos_request.get().json()
@@ -250,19 +748,21 @@ class AosCloud():
                     ...
                 ]
                 """
-                aos_request = AosCloud.Request(url = "https://oem.aoscloud.io:10000/api/v1/fleet-validation-batch/",
+                return list(self.iter_service_waiting_validation())
+
+            def iter_service_waiting_validation(self):
+                """
+                    Same as list_service_waiting_validation() but streams the services page by page
+                    Return type: generator of class 'dict'
+                """
+                aos_request = AosCloud.Request(url = AosCloud.url("oem", "fleet-validation-batch/"),
                                                role = "oem")
-        
-                service_validation_list = list()
-                response = aos_request.get().json()
-                for element in response["results"]:
+                for element in aos_request.paginate():
                     if element["state"] == "Waiting_validation" and element["batch_type"] == "service_layer":
-                        data = {
+                        yield {
                             "validation_id": element["id"],
                             "service_title": element["service"]["title"]
                         }
-                        service_validation_list.append(data)
-                return service_validation_list
             
             def approve_service(self) -> None:
                 """
@@ -270,14 +770,14 @@ class AosCloud():
                     service waiting validation on AosCloud and approve it to allow service to be deployed
                     on the target device.
                 """
-                validation_id = [d["validation_id"] for d in self.list_service_waiting_validation() if d["service_title"] == self.service_title][0]
+                validation_id = next((d["validation_id"] for d in self.iter_service_waiting_validation() if d["service_title"] == self.service_title), None)
                 
                 if not validation_id:
                     log.info("SERVICE IS ALREADY VALIDATED")
                     return
                 
                 log.info("VALIDATE SERVICE BATCH")
-                aos_request = AosCloud.Request(url = f"https://oem.aoscloud.io:10000/api/v1/fleet-validation-batch/{validation_id}/approve/",
+                aos_request = AosCloud.Request(url = AosCloud.url("oem", f"fleet-validation-batch/{validation_id}/approve/"),
                                                role = "oem",
                                                header = {"Content-Type": "application/json"},
                                                data = json.dumps({"is_valid": True}))
@@ -302,15 +802,12 @@ class AosCloud():
                     "label": self.subject_name,
                     "priority": self.subject_priority
                 }
-                aos_request = AosCloud.Request(url = "https://oem.aoscloud.io:10000/api/v1/subjects/",
+                aos_request = AosCloud.Request(url = AosCloud.url("oem", "subjects/"),
                                                role = "oem",
                                                header = {"Content-Type": "application/json"},
                                                data = json.dumps(data))
-                sbj_name = list()
-                for sbj in self.list_subjects():
-                    sbj_name.append(sbj["label"])
-
-                if self.subject_name in sbj_name: 
+                sbj = next((sbj for sbj in self.iter_subjects() if sbj["label"] == self.subject_name), None)
+                if sbj:
                     log.info("SUBJECT ALREADY EXISTS")
                     self.subject_id = sbj["id"]
                 else:
@@ -334,11 +831,17 @@ class AosCloud():
                         }
                     ]
                 """
-                aos_request = AosCloud.Request(url = "https://oem.aoscloud.io:10000/api/v1/subjects/",
-                                               role = "oem")        
-                response = aos_request.get().json()
-                subject_list = [{"label": d["label"], "id": d["id"]} for d in response["results"]]
-                return subject_list
+                return list(self.iter_subjects())
+
+            def iter_subjects(self):
+                """
+                    Same as list_subjects() but streams the subjects page by page
+                    Return type: generator of class 'dict'
+                """
+                aos_request = AosCloud.Request(url = AosCloud.url("oem", "subjects/"),
+                                               role = "oem")
+                for d in aos_request.paginate():
+                    yield {"label": d["label"], "id": d["id"]}
 
             def list_service_assigned(self) -> list:
                 """
@@ -346,11 +849,17 @@ class AosCloud():
                     Parameters: None
                     Return type: class 'list'
                 """
-                aos_request = AosCloud.Request(url = f"https://oem.aoscloud.io:10000/api/v1/subjects/{self.subject_id}/services/",
+                return list(self.iter_service_assigned())
+
+            def iter_service_assigned(self):
+                """
+                    Same as list_service_assigned() but streams the service uuids page by page
+                    Return type: generator of class 'str'
+                """
+                aos_request = AosCloud.Request(url = AosCloud.url("oem", f"subjects/{self.subject_id}/services/"),
                                                role = "oem")
-                response = aos_request.get().json()
-                service_assigned = [d["service"]["uuid"] for d in response["results"]]
-                return service_assigned
+                for d in aos_request.paginate():
+                    yield d["service"]["uuid"]
             
             def assign_service_to_subject(self, service_uuid: str) -> None:
                 """
@@ -359,29 +868,39 @@ class AosCloud():
                         service_uuid: class 'str'
                     Return type: None
                 """
-                log.info(f"ASSIGN SERVICE {service_uuid} TO SUBJECT {self.subject_name}")
-                data = {
-                    "service_uuids": [
-                        service_uuid
-                    ]
-                }
-                aos_request = AosCloud.Request(url = f"https://oem.aoscloud.io:10000/api/v1/subjects/{self.subject_id}/services/",
-                                               role = "oem",
-                                               header = {"Content-Type": "application/json"},
-                                               data = json.dumps(data))
-                
-                if service_uuid not in self.list_service_assigned():
-                    aos_request.post()
+                self.assign_services([service_uuid])
+
+            def assign_services(self, service_uuids, remove_extra=False) -> dict:
+                """
+                    Make the services assigned to the subject match a set of services: the current
+                    assignment is read once, then the missing services are assigned in a single request
+                    and, if remove_extra is set, the other assigned services are removed in another one.
+                    Parameters:
+                        service_uuids: uuids of the services to assign (class 'list' or 'set')
+                        remove_extra: whether to remove services that are not in service_uuids (class 'bool')
+                    Return type: class 'dict' with the "added" and "removed" service uuids
+                """
+                return self._reconcile(endpoint = "services",
+                                       field = "service_uuids",
+                                       members = service_uuids,
+                                       assigned = self.iter_service_assigned(),
+                                       remove_extra = remove_extra)
 
             def list_unit_assigned(self) -> list:
                 """
                     Return a list of unit assigned to a Subject
                 """
-                aos_request = AosCloud.Request(url = f"https://oem.aoscloud.io:10000/api/v1/subjects/{self.subject_id}/units/",
+                return list(self.iter_unit_assigned())
+
+            def iter_unit_assigned(self):
+                """
+                    Same as list_unit_assigned() but streams the unit system ids page by page
+                    Return type: generator of class 'str'
+                """
+                aos_request = AosCloud.Request(url = AosCloud.url("oem", f"subjects/{self.subject_id}/units/"),
                                                role = "oem")
-                response = aos_request.get().json()
-                unit_assigned_list = [d["system_uid"] for d in response["results"]]
-                return unit_assigned_list
+                for d in aos_request.paginate():
+                    yield d["system_uid"]
 
             def assign_unit_to_subject(self, unit_system_id: str) -> None:
                 """
@@ -390,28 +909,55 @@ class AosCloud():
                         unit_system_id: class 'str'
                     Return type: None
                 """
-                data = {
-                    "system_uids": [
-                        unit_system_id
-                    ]
-                }
-                aos_request = AosCloud.Request(url = f"https://oem.aoscloud.io:10000/api/v1/subjects/{self.subject_id}/units/",
-                                               role = "oem",
-                                               header = {"Content-Type": "application/json"},
-                                               data = json.dumps(data))
-                
-                if unit_system_id not in self.list_unit_assigned():
-                    log.info(f"ASSIGN UNIT WITH ID: {unit_system_id} TO SUBJECT {self.subject_name}")
-                    aos_request.post()
+                self.assign_units([unit_system_id])
+
+            def assign_units(self, unit_system_ids, remove_extra=False) -> dict:
+                """
+                    Same as assign_services() for the units of the subject
+                    Parameters:
+                        unit_system_ids: system ids of the units to assign (class 'list' or 'set')
+                        remove_extra: whether to remove units that are not in unit_system_ids (class 'bool')
+                    Return type: class 'dict' with the "added" and "removed" unit system ids
+                """
+                return self._reconcile(endpoint = "units",
+                                       field = "system_uids",
+                                       members = unit_system_ids,
+                                       assigned = self.iter_unit_assigned(),
+                                       remove_extra = remove_extra)
+
+            def _reconcile(self, endpoint, field, members, assigned, remove_extra) -> dict:
+                """
+                    POST the missing members to subjects/{id}/<endpoint>/ and, with remove_extra, DELETE
+                    the extra ones from it, each in one request carrying the whole array in "field"
+                """
+                members = list(dict.fromkeys(members))
+                assigned = set(assigned)
+                added = [member for member in members if member not in assigned]
+                removed = sorted(assigned.difference(members)) if remove_extra else []
+                for method, changed in (("post", added), ("delete", removed)):
+                    if not changed:
+                        continue
+                    log.info(f"{'ASSIGN' if method == 'post' else 'REMOVE'} {endpoint.upper()} {', '.join(changed[:5])}"
+                             f"{f' AND {len(changed) - 5} MORE' if len(changed) > 5 else ''} "
+                             f"{'TO' if method == 'post' else 'FROM'} SUBJECT {self.subject_name}")
+                    aos_request = AosCloud.Request(url = AosCloud.url("oem", f"subjects/{self.subject_id}/{endpoint}/"),
+                                                   role = "oem",
+                                                   header = {"Content-Type": "application/json"},
+                                                   data = json.dumps({field: changed}))
+                    getattr(aos_request, method)()
+                return dict(added = added, removed = removed)
 
             def remove_subject(self):
                 log.info(f"REMOVE SUBJECT NAME: {self.subject_name} FROM AOSCLOUD")
-                aos_request = AosCloud.Request(url = f"https://oem.aoscloud.io:10000/api/v1/subjects/{self.subject_id}/",
+                aos_request = AosCloud.Request(url = AosCloud.url("oem", f"subjects/{self.subject_id}/"),
                                                role = "oem")
                 aos_request.delete()
 
 
         class Unit():
+            # Seconds to wait after the first monitoring data so that every metric is reported
+            monitoring_settle_time = 10
+
             def __init__(self, id: str, name: str, version: str):
                 self.unit_system_id = id
                 self.unit_name = name
@@ -425,25 +971,23 @@ class AosCloud():
                         unit_system_id: class 'str'
                     Return type: class 'int'
                 """
-                aos_request = AosCloud.Request(url = "https://oem.aoscloud.io:10000/api/v1/units/",
-                                               role = "oem")
-                response = aos_request.get().json()
-                id = [d["id"] for d in response["results"] if d["system_uid"] == unit_system_id][0]
-                return id
+                unit = AosCloud.Index.lookup("units", unit_system_id)
+                if unit is None:
+                    raise SystemExit(f"UNIT {unit_system_id} NOT FOUND ON AOSCLOUD")
+                return unit["id"]
 
             def get_target_system_id(self):
-                aos_request = AosCloud.Request(url = "https://oem.aoscloud.io:10000/api/v1/unit-models/",
-                                               role = "oem")
-                response = aos_request.get().json()
-                id = [d["id"] for d in response["results"] if d["name"] == self.unit_name][0]
-                return id
+                unit_model = AosCloud.Index.lookup("unit-models", self.unit_name)
+                if unit_model is None:
+                    raise SystemExit(f"UNIT MODEL {self.unit_name} NOT FOUND ON AOSCLOUD")
+                return unit_model["id"]
                 
             def update_target_system(self, unit_config: dict):
                 data = {
                     "unit_config": unit_config
                 }
                 target_system_id = self.get_target_system_id()
-                aos_request = AosCloud.Request(url = f"https://oem.aoscloud.io:10000/api/v1/unit-models/{target_system_id}/",
+                aos_request = AosCloud.Request(url = AosCloud.url("oem", f"unit-models/{target_system_id}/"),
                                                role = "oem",
                                                header = {"Content-Type": "application/json"},
                                                data = json.dumps(data))
@@ -456,30 +1000,28 @@ class AosCloud():
                         unit_system_id: class 'str'
                         timeout: class 'int'
                 """
-                aos_request = AosCloud.Request(url = f"https://oem.aoscloud.io:10000/api/v1/units/{self.unit_system_id}/connection-info/",
+                aos_request = AosCloud.Request(url = AosCloud.url("oem", f"units/{self.unit_system_id}/connection-info/"),
                                                role = "oem")
-                start_time = time.time()
-                while not (online := aos_request.get().json()["is_online"]):
-                    if time.time() - start_time > timeout:
-                        SystemExit("UNIT IS OFFLINE")
-                return True
+                online, _ = default_poller.wait(poll = lambda: aos_request.get_json()["is_online"],
+                                                timeout = timeout)
+                if not online:
+                    log.error("UNIT IS OFFLINE")
+                return online
 
             def system_monitoring(self, timeout):
-                aos_request = AosCloud.Request(url = f"https://oem.aoscloud.io:10000/api/v1/units/{self.unit_system_id}/monitoring/",
+                aos_request = AosCloud.Request(url = AosCloud.url("oem", f"units/{self.unit_system_id}/monitoring/"),
                                                role = "oem")
-                start_time = time.time()
-                while True:
-                    response = aos_request.get().json()
-                    verify = False if not response[0] else True
-                    if verify:
-                        time.sleep(10) #Wait around 10s to get full information from unit
-                        cpu_val, ram_val, used_disk_val, in_traffic_val, out_traffic_val = [
-                            (d["cpu"][0]["value"], d["ram"][0]["value"], d["usedDisk"][0]["value"], d["inTraffic"][0]["value"], d["outTraffic"][0]["value"])
-                            for d in response][0]
-                        print(f"cpu used: {cpu_val}\nram used: {ram_val}\ndisk used: {used_disk_val}\nin-traffic network: {in_traffic_val}\nout-traffic network: {out_traffic_val}")
-                        break
-                    if (time.time() - start_time > timeout):
-                        break
+                verify, response = default_poller.wait(poll = lambda: aos_request.get_json(),
+                                                       predicate = lambda response: response and response[0],
+                                                       timeout = timeout)
+                if verify:
+                    time.sleep(self.monitoring_settle_time) #Wait around 10s to get full information from unit
+                    response = aos_request.get_json() or response
+                    cpu_val, ram_val, used_disk_val, in_traffic_val, out_traffic_val = [
+                        (d["cpu"][0]["value"], d["ram"][0]["value"], d["usedDisk"][0]["value"], d["inTraffic"][0]["value"], d["outTraffic"][0]["value"])
+                        for d in response][0]
+                    log.info(f"CPU USED: {cpu_val}, RAM USED: {ram_val}, DISK USED: {used_disk_val}, "
+                             f"IN-TRAFFIC NETWORK: {in_traffic_val}, OUT-TRAFFIC NETWORK: {out_traffic_val}")
                 return verify
 
             def verify_sota_function(self, service_uuid, service_latest_system_version, timeout) -> bool:
@@ -493,16 +1035,15 @@ class AosCloud():
                         service_latest_system_version: class 'int'
                     Return type: class 'bool'
                 """
-                aos_request = AosCloud.Request(url = f"https://oem.aoscloud.io:10000/api/v1/units/{self.unit_system_id}/subjects-services/",
+                aos_request = AosCloud.Request(url = AosCloud.url("oem", f"units/{self.unit_system_id}/subjects-services/"),
                                                role = "oem")
-                start_time = time.time()
-                while True:
-                    time.sleep(10)
-                    response = aos_request.get().json()
-                    aos_version, run_state = [(d["instances"][0]["aos_version"], d["instances"][0]["run_state"]) for d in response["results"] if d["service"]["uuid"] == service_uuid][0]
-                    verify = True if aos_version == service_latest_system_version and run_state == "active" else False
-                    if (time.time() - start_time > timeout) or verify:
-                        break                    
+                def is_deployed(response) -> bool:
+                    instance = next((d["instances"][0] for d in response["results"] if d["service"]["uuid"] == service_uuid and d["instances"]), None)
+                    return instance is not None and instance["aos_version"] == service_latest_system_version and instance["run_state"] == "active"
+
+                verify, _ = default_poller.wait(poll = lambda: aos_request.get_json(),
+                                                predicate = is_deployed,
+                                                timeout = timeout)
                 return verify
                 
             def verify_fota_function(self, uploaded_component_id, uploaded_component_version, timeout) -> bool:
@@ -510,21 +1051,199 @@ class AosCloud():
                     Verify the FOTA functionality by checking the vendor version of a specific component after
                     updating firmware
                 """
+                return self.verify_fota_components([dict(component_id = uploaded_component_id,
+                                                         version = uploaded_component_version)], timeout)
+
+            def verify_fota_components(self, uploaded_components: list, timeout) -> bool:
+                """
+                    Same as verify_fota_function() for several components at once, e.g. the
+                    uploaded_components of every batch file of a release
+                    Parameters:
+                        uploaded_components: class 'list' of dict(component_id, version)
+                    Return type: class 'bool'
+                """
                 self.unit_id = self.get_unit_id(self.unit_system_id)
-                aos_request = AosCloud.Request(url = f"https://oem.aoscloud.io:10000/api/v1/units/{self.unit_id}/",
+                aos_request = AosCloud.Request(url = AosCloud.url("oem", f"units/{self.unit_id}/"),
                                                role = "oem")
                 log.info("UPDATE NEW KERNEL IMAGE. PLEASE CHECK THE DEVICE AND REBOOT MANUALLY")
-                start_time = time.time()
-                while True:
-                    time.sleep(10)            
-                    response = aos_request.get().json()
-                    current_vendor_version = [d["installed_component"]["vendor_version"] for d in response["unit_update_components"] if d["component_id"] == uploaded_component_id]
-                    if not current_vendor_version or current_vendor_version[0] != uploaded_component_version:
-                        return False
-                    elif (time.time() - start_time > timeout):
-                        return False
-                    elif current_vendor_version == uploaded_component_version:
-                        return True
+                def is_updated(response) -> bool:
+                    installed = {d["component_id"]: d["installed_component"]["vendor_version"] for d in response["unit_update_components"]}
+                    return all(installed.get(component["component_id"]) == component["version"] for component in uploaded_components)
+
+                verify, _ = default_poller.wait(poll = lambda: aos_request.get_json(),
+                                                predicate = is_updated,
+                                                timeout = timeout)
+                return verify
+
+        class Fleet():
+            """
+                Verify a rollout on many units with one sweep instead of one poller per unit. Every
+                round reads the state of the pending units, marks each of them as converged, failed or
+                still pending, and later rounds only look at the units that are still pending. The
+                counts are logged after each round and the report gives the outcome of every unit.
+            """
+            CONVERGED = "converged"
+            FAILED = "failed"
+            PENDING = "pending"
+            # Still pending when the sweep gave up
+            TIMED_OUT = "timed out"
+            # States reported by AosCloud for an update or an instance that will not converge
+            failed_states = ("failed", "error")
+
+            def __init__(self, unit_system_ids):
+                self.unit_system_ids = list(dict.fromkeys(unit_system_ids))
+                self.report = dict()
+
+            def sweep_fota(self, component_id, version, timeout=500, progress=None) -> dict:
+                """
+                    Wait until every unit has installed a component version. The units are read in
+                    bulk from the pages of the units list, each round stops at the page where the
+                    last pending unit is found. Units listed without their update components are
+                    read one by one from their detail.
+                    Parameters:
+                        component_id: class 'str'
+                        version: expected vendor version of the component (class 'str')
+                        timeout: seconds until the pending units are given up (class 'int')
+                        progress: function called with the counts of each round (class 'function')
+                    Return type: class 'dict', see report()
+                """
+                def detail(unit) -> dict:
+                    # The units list does not report the update components on every AosCloud version
+                    if "unit_update_components" in unit:
+                        return unit
+                    try:
+                        return AosCloud.Request(url = AosCloud.url("oem", f"units/{unit['id']}/"),
+                                                role = "oem").get_json()
+                    except SystemExit as err:
+                        return err
+
+                def fetch(pending: set):
+                    found = set()
+                    # The units list is cached for lookups, each round has to read the current state
+                    AosCloud.Cache.invalidate("units")
+                    for unit in AosCloud.Request(url = AosCloud.url("oem", "units/"), role = "oem").paginate():
+                        if unit["system_uid"] in pending:
+                            found.add(unit["system_uid"])
+                            yield unit["system_uid"], detail(unit)
+                            if found == pending:
+                                return
+                    for unit_system_id in pending - found:
+                        yield unit_system_id, None
+
+                def classify(unit) -> tuple:
+                    if unit.get("unit_update_components") is None:
+                        return self.FAILED, "NO UPDATE COMPONENTS REPORTED BY AOSCLOUD"
+                    component = next((d for d in unit["unit_update_components"] if d["component_id"] == component_id), None)
+                    if component is None:
+                        return self.PENDING, None
+                    installed = component["installed_component"]["vendor_version"]
+                    if installed == version:
+                        return self.CONVERGED, installed
+                    if component.get("status") in self.failed_states:
+                        return self.FAILED, f"{component['status']} (installed {installed})"
+                    return self.PENDING, installed
+
+                log.info(f"SWEEP FOTA {component_id} {version} ON {len(self.unit_system_ids)} UNITS")
+                return self._sweep(fetch, classify, timeout, progress)
+
+            def sweep_sota(self, service_uuid, version, timeout=40, progress=None) -> dict:
+                """
+                    Wait until a service version is active on every unit. AosCloud only reports the
+                    services of one unit per request, so each round sends conditional GETs for the
+                    pending units only, concurrently on the pooled connections.
+                    Parameters:
+                        service_uuid: class 'str'
+                        version: expected aos_version of the service instance (class 'int')
+                        timeout: seconds until the pending units are given up (class 'int')
+                        progress: function called with the counts of each round (class 'function')
+                    Return type: class 'dict', see report()
+                """
+                def services(unit_system_id):
+                    try:
+                        return AosCloud.Request(url = AosCloud.url("oem", f"units/{unit_system_id}/subjects-services/"),
+                                                role = "oem").get_json()
+                    except SystemExit as err:
+                        # A unit unknown to AosCloud (404) or still failing after the retries: only this unit fails
+                        return err
+
+                def fetch(pending: set):
+                    with ThreadPoolExecutor(max_workers = AosCloud.SessionPool.pool_size, thread_name_prefix = "aos-sweep") as executor:
+                        futures = {unit_system_id: submit_in_context(executor, services, unit_system_id)
+                                   for unit_system_id in sorted(pending)}
+                        for unit_system_id, future in futures.items():
+                            yield unit_system_id, future.result()
+
+                def classify(response) -> tuple:
+                    instance = next((d["instances"][0] for d in response["results"] if d["service"]["uuid"] == service_uuid and d["instances"]), None)
+                    if instance is None:
+                        return self.PENDING, None
+                    detail = f"{instance['aos_version']} {instance['run_state']}"
+                    if instance["aos_version"] == version and instance["run_state"] == "active":
+                        return self.CONVERGED, detail
+                    if instance["aos_version"] == version and instance["run_state"] in self.failed_states:
+                        return self.FAILED, detail
+                    return self.PENDING, detail
+
+                log.info(f"SWEEP SOTA {service_uuid} VERSION {version} ON {len(self.unit_system_ids)} UNITS")
+                return self._sweep(fetch, classify, timeout, progress)
+
+            def _sweep(self, fetch, classify, timeout, progress) -> dict:
+                """
+                    Parameters:
+                        fetch: generator of (unit system id, state, None if not found or the SystemExit of a failed request)
+                               for a set of pending units (class 'function')
+                        classify: function returning (outcome, detail) of a unit state (class 'function')
+                """
+                start = time.monotonic()
+                self.report = {unit_system_id: dict(state = self.PENDING, detail = None, seconds = None)
+                               for unit_system_id in self.unit_system_ids}
+                pending = set(self.unit_system_ids)
+                rounds = 0
+
+                def sweep_round() -> set:
+                    nonlocal rounds
+                    rounds += 1
+                    for unit_system_id, state in fetch(set(pending)):
+                        if state is None:
+                            outcome, detail = self.FAILED, "NOT FOUND ON AOSCLOUD"
+                        elif isinstance(state, SystemExit):
+                            outcome, detail = self.FAILED, f"{state}".splitlines()[0]
+                        else:
+                            outcome, detail = classify(state)
+                        entry = self.report[unit_system_id]
+                        entry["detail"] = detail
+                        if outcome != self.PENDING:
+                            entry["state"] = outcome
+                            entry["seconds"] = round(time.monotonic() - start, 3)
+                            pending.discard(unit_system_id)
+                    counts = self.counts()
+                    log.info(f"SWEEP ROUND {rounds}: {counts[self.CONVERGED]} CONVERGED, {counts[self.FAILED]} FAILED, {counts[self.PENDING]} PENDING")
+                    if progress:
+                        progress(counts)
+                    return pending
+
+                if pending:
+                    default_poller.wait(poll = sweep_round,
+                                        predicate = lambda pending: not pending,
+                                        timeout = timeout)
+                if pending:
+                    log.error(f"SWEEP TIMED OUT AFTER {timeout}s: {len(pending)} UNITS STILL PENDING")
+                    for unit_system_id in pending:
+                        self.report[unit_system_id].update(state = self.TIMED_OUT,
+                                                           seconds = round(time.monotonic() - start, 3))
+                return self.report
+
+            def counts(self) -> dict:
+                """
+                    Return type: class 'dict' mapping converged, failed, pending and timed out to their number of units
+                """
+                counts = {self.CONVERGED: 0, self.FAILED: 0, self.PENDING: 0, self.TIMED_OUT: 0}
+                for entry in self.report.values():
+                    counts[entry["state"]] += 1
+                return counts
+
+            def converged(self) -> bool:
+                return bool(self.report) and all(entry["state"] == self.CONVERGED for entry in self.report.values())
 
         class Component():
             def __init__(self):
@@ -532,22 +1251,67 @@ class AosCloud():
                 self.component_upload_id = None
                 self.component_id = None
                 self.component_vendor_version = None
+                self.batch_sha256 = None
+                self.uploaded_components = None
 
-            def upload_batch_file(self, file) -> None:
+            def upload_batch_file(self, file, dedup=True) -> None:
                 """
                     Upload firmware batch file to AosCloud
+                    When a path is given and dedup is set, the upload and the build wait are skipped if
+                    the same file (by SHA-256) was uploaded before and all of its components are still
+                    Ready on AosCloud.
+                    Parameters:
+                        file: path of the batch file, streamed from disk in chunks (class 'str'),
+                              or a requests "files" mapping held in memory (class 'dict')
+                        dedup: whether to look for an identical upload first (class 'bool')
+                    Return type: None
                 """
+                if not isinstance(file, dict) and dedup:
+                    self.batch_sha256 = file_sha256(file)
+                    if self.find_uploaded_batch_file(self.batch_sha256):
+                        log.info(f"BATCH FILE WITH SHA-256 {self.batch_sha256} IS ALREADY ON AOSCLOUD, SKIP UPLOAD")
+                        return
                 log.info("UPLOAD COMPONENT BATCH FILE")
-                aos_request = AosCloud.Request(url = "https://oem.aoscloud.io:10000/api/v1/update-components/upload/",
-                                               role = "oem",
-                                               files = file)
-                
-                response = aos_request.post().json()
+                if isinstance(file, dict):
+                    aos_request = AosCloud.Request(url = AosCloud.url("oem", "update-components/upload/"),
+                                                   role = "oem",
+                                                   files = file)
+                    response = aos_request.post().json()
+                else:
+                    stream = MultipartFileStream(file)
+                    aos_request = AosCloud.Request(url = AosCloud.url("oem", "update-components/upload/"),
+                                                   role = "oem",
+                                                   header = {"accept": "application/json", "Content-Type": stream.content_type},
+                                                   data = stream)
+                    response = aos_request.post().json()
+                    log.info(f"UPLOADED {stream.file_size / 2**20:.1f} MB AT {stream.throughput / 2**20:.2f} MB/s, SHA-256: {stream.sha256}")
+                    if stream.sent == stream.file_size:
+                        self.batch_sha256 = stream.sha256
                 self.batch_id = str(response["id"]) #Since the type of response["id"] is 'int' not 'str'
 
-            def get_detail_of_batch_file(self, id: str) -> list:
+            def find_uploaded_batch_file(self, sha256: str) -> bool:
+                """
+                    Check the local manifest for a batch file with the same SHA-256 whose components
+                    (component_id and vendorVersion) are all Ready on AosCloud. If found, the component
+                    information is loaded as if the batch file had just been built.
+                    Return type: class 'bool'
                 """
-                    Retrieve a list that contains information of uploaded batch file
+                components = AosCloud.ComponentManifest.get(sha256)
+                if not components:
+                    return False
+                for component in components:
+                    if AosCloud.Index.lookup("update-components", (component["component_id"], component["version"]),
+                                             match = lambda d: d["state"] == "Ready") is None:
+                        return False
+                self.uploaded_components = components
+                self.component_id = components[-1]["component_id"]
+                self.component_vendor_version = components[-1]["version"]
+                return True
+
+            def get_detail_of_batch_file(self, id: str, timeout=1800) -> list:
+                """
+                    Wait until the component is built from the batch file (at most timeout seconds)
+                    and retrieve a list that contains information of uploaded batch file
                     [
                         {
                             "component_id": component_name_1,
@@ -559,13 +1323,51 @@ class AosCloud():
                         }
                     ]
                 """
-                aos_request = AosCloud.Request(url = f"https://oem.aoscloud.io:10000/api/v1/update-components/upload/{id}/",
-                                               role = "oem")
-                # Wait until component is built from batch file
-                while True:
-                    response = aos_request.get().json()
-                    if response["state"] == "ready":
-                        break
+                self.batch_id = id
+                self.wait_for_builds([self], timeout)
+                return self.uploaded_components
+
+            @classmethod
+            def upload_batch_files(cls, files, dedup=True, timeout=1800) -> list:
+                """
+                    Upload several batch files concurrently, then wait for all of their builds in one
+                    watch loop
+                    Parameters:
+                        files: paths of the batch files (class 'list')
+                        dedup: whether to skip the files already uploaded, see upload_batch_file() (class 'bool')
+                        timeout: seconds to wait for the builds (class 'int')
+                    Return type: class 'list' of class 'Component', one per file, with uploaded_components set
+                """
+                components = [cls() for _ in files]
+                with ThreadPoolExecutor(max_workers = min(len(files), AosCloud.SessionPool.pool_size) or 1,
+                                        thread_name_prefix = "aos-upload") as executor:
+                    futures = [submit_in_context(executor, component.upload_batch_file, file, dedup)
+                               for component, file in zip(components, files)]
+                    for future in futures:
+                        future.result()
+                # Files found by dedup already carry their components
+                cls.wait_for_builds([component for component in components if not component.uploaded_components], timeout)
+                return components
+
+            @classmethod
+            def wait_for_builds(cls, components: list, timeout=1800) -> None:
+                """
+                    Wait until the batch files of uploaded components are built, in one watch loop,
+                    and gather the information of their components (see get_detail_of_batch_file())
+                """
+                watches = dict()
+                for component in components:
+                    aos_request = AosCloud.Request(url = AosCloud.url("oem", f"update-components/upload/{component.batch_id}/"),
+                                                   role = "oem")
+                    watches[component.batch_id] = (aos_request.get_json, lambda response: response["state"] == "ready")
+                results = default_poller.wait_many(watches, timeout) if watches else dict()
+                for component in components:
+                    ready, response = results[component.batch_id]
+                    if not ready:
+                        raise SystemExit(f"BATCH FILE {component.batch_id} IS NOT BUILT AFTER {timeout}s")
+                    component._record_build(response)
+
+            def _record_build(self, response: dict) -> None:
                 # After component is built, gather its information
                 uploaded_components = list()
                 for component in response["metadata_info"]["components"]:
@@ -573,24 +1375,24 @@ class AosCloud():
                     self.component_vendor_version = component["vendorVersion"]
                     uploaded_components.append(dict(component_id = self.component_id,
                                                     version = self.component_vendor_version))
-                return uploaded_components
+                self.uploaded_components = uploaded_components
+                if self.batch_sha256:
+                    AosCloud.ComponentManifest.record(self.batch_sha256, uploaded_components)
             
             def get_component_upload_id(self) -> int:
-                aos_request = AosCloud.Request(url = "https://oem.aoscloud.io:10000/api/v1/update-components/",
-                                               role = "oem")
-                response = aos_request.get().json()
-                component_upload_id = [d["id"] for d in response["results"] if 
-                                            d["component_id"] == self.component_id and
-                                            d["vendor_version"] == self.component_vendor_version and
-                                            d["state"] == "Ready"][0]
-                return component_upload_id
+                component = AosCloud.Index.lookup("update-components", (self.component_id, self.component_vendor_version),
+                                                  match = lambda d: d["state"] == "Ready")
+                if component is None:
+                    raise SystemExit(f"COMPONENT {self.component_id} {self.component_vendor_version} NOT FOUND ON AOSCLOUD")
+                return component["id"]
 
             def remove_uploaded_component(self):
                 log.info(f"REMOVE COMPONENT {self.component_id} FROM AOSCLOUD")
                 self.component_upload_id = self.get_component_upload_id()
-                aos_request = AosCloud.Request(url = f"https://oem.aoscloud.io:10000/api/v1/update-components/{self.component_upload_id}/",
+                aos_request = AosCloud.Request(url = AosCloud.url("oem", f"update-components/{self.component_upload_id}/"),
                                                role = "oem")
                 aos_request.delete()
+                AosCloud.ComponentManifest.forget(self.component_id, self.component_vendor_version)
             
             def list_component_waiting_validation(self):
                 """
@@ -625,11 +1427,16 @@ class AosCloud():
                         ...
                     ]
                 """
-                aos_request = AosCloud.Request(url = "https://oem.aoscloud.io:10000/api/v1/fleet-validation-batch/",
+                return list(self.iter_component_waiting_validation())
+
+            def iter_component_waiting_validation(self):
+                """
+                    Same as list_component_waiting_validation() but streams the batches page by page
+                    Return type: generator of class 'dict'
+                """
+                aos_request = AosCloud.Request(url = AosCloud.url("oem", "fleet-validation-batch/"),
                                                role = "oem")
-                component_validation_list = list()
-                response = aos_request.get().json()
-                for element in response["results"]:
+                for element in aos_request.paginate():
                     if (element["state"] == "Waiting_validation" or element["state"] == "Invalid") \
                                 and element["batch_type"] == "component":
                         validation_id = element["id"]
@@ -637,23 +1444,34 @@ class AosCloud():
                         if element["component_stack_to"]:
                             for component in element["component_stack_to"]:
                                 components_to_update.append(dict(component_id = component["component_id"],
-                                                                 version = component["version"]))           
-                        component_validation_list.append(dict(validation_id = validation_id,
-                                                              update_components = components_to_update))
-                return component_validation_list
+                                                                 version = component["version"]))
+                        yield dict(validation_id = validation_id,
+                                   update_components = components_to_update)
             
             def approve_component(self) -> None:
-                validation_id = None
-                #Check whether batch file is in the list of component waiting for validation
-                uploaded_component_from_batch_file = self.get_detail_of_batch_file(self.batch_id)
-                validation_id = [d["validation_id"] for d in self.list_component_waiting_validation() if d["update_components"] == uploaded_component_from_batch_file]           
-                if not validation_id:
-                    log.info("COMPONENT IS ALREADY VALIDATED")
-                    return
-                else:
-                    log.info("APPROVE UPDATED COMPONENT")
-                    aos_request = AosCloud.Request(url = f"https://oem.aoscloud.io:10000/api/v1/fleet-validation-batch/{validation_id[0]}/approve/",
-                                                   role = "oem",
-                                                   header = {"Content-Type": "application/json"},
-                                                   data = json.dumps({"is_valid": True}))
-                    aos_request.patch()
\ No newline at end of file
+                type(self).approve_components([self])
+
+            @classmethod
+            def approve_components(cls, components: list) -> None:
+                """
+                    Approve the validation batch of every component from a single snapshot of the
+                    validation queue
+                """
+                for component in components:
+                    if not component.uploaded_components:
+                        component.get_detail_of_batch_file(component.batch_id)
+                waiting = list(components[0].iter_component_waiting_validation()) if components else list()
+                approved = list()
+                for component in components:
+                    #Check whether batch file is in the list of component waiting for validation
+                    validation_id = next((d["validation_id"] for d in waiting if d["update_components"] == component.uploaded_components), None)
+                    if not validation_id:
+                        log.info(f"COMPONENT {component.component_id} {component.component_vendor_version} IS ALREADY VALIDATED")
+                    elif validation_id not in approved:
+                        log.info(f"APPROVE UPDATED COMPONENT {component.component_id} {component.component_vendor_version}")
+                        aos_request = AosCloud.Request(url = AosCloud.url("oem", f"fleet-validation-batch/{validation_id}/approve/"),
+                                                       role = "oem",
+                                                       header = {"Content-Type": "application/json"},
+                                                       data = json.dumps({"is_valid": True}))
+                        aos_request.patch()
+                        approved.append(validation_id)
\ No newline at end of file
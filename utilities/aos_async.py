@@ -0,0 +1,113 @@
+import os
+import asyncio
+import inspect
+from concurrent.futures import ThreadPoolExecutor
+
+from .aos import AosCloud, log
+from .metrics import submit_in_context
+
+class AsyncAosCloud():
+    """
+        asyncio variant of AosCloud with the same semantics as the blocking client.
+        Each call runs the blocking AosCloud code on a bounded thread pool that shares the
+        keep-alive sessions of AosCloud.SessionPool, so one process can keep many requests
+        in flight at once. The number of workers defaults to the session pool size and can be
+        changed with the AOS_ASYNC_WORKERS environment variable.
+    """
+    executor = ThreadPoolExecutor(max_workers = int(os.environ.get("AOS_ASYNC_WORKERS", AosCloud.SessionPool.pool_size)),
+                                  thread_name_prefix = "aos-async")
+
+    @classmethod
+    async def run(cls, func, *args, **kwargs):
+        """
+            Run a blocking callable on the worker pool and wait for its result
+        """
+        return await asyncio.wrap_future(submit_in_context(cls.executor, func, *args, **kwargs))
+
+    @classmethod
+    async def iterate(cls, iterator):
+        """
+            Iterate a blocking iterator, e.g. a paginated collection, on the worker pool. Pages are
+            still downloaded one at a time and only while the caller keeps iterating.
+            Return type: async generator of the elements of iterator
+        """
+        done = object()
+        while True:
+            element = await cls.run(next, iterator, done)
+            if element is done:
+                return
+            yield element
+
+    class Request(AosCloud.Request):
+        async def get(self):
+            return await AsyncAosCloud.run(super().get)
+
+        async def post(self):
+            return await AsyncAosCloud.run(super().post)
+
+        async def patch(self):
+            return await AsyncAosCloud.run(super().patch)
+
+        async def delete(self):
+            return await AsyncAosCloud.run(super().delete)
+
+        async def get_json(self):
+            return await AsyncAosCloud.run(super().get_json)
+
+        def paginate(self, page_size=None, params=None):
+            return AsyncAosCloud.iterate(super().paginate(page_size, params))
+
+    class Entities():
+        class _Entity():
+            """
+                Wrap a blocking entity: attributes are read from and written to the wrapped
+                entity, methods become coroutines with the same parameters and return values and
+                generators, such as the iter_* methods, become async generators.
+            """
+            entity_class = None
+
+            def __init__(self, *args, **kwargs):
+                object.__setattr__(self, "entity", self.entity_class(*args, **kwargs))
+
+            def __getattr__(self, name):
+                attr = getattr(self.entity, name)
+                if not callable(attr):
+                    return attr
+                if inspect.isgeneratorfunction(attr):
+                    # Creating the generator does not run it, every step runs on the worker pool
+                    return lambda *args, **kwargs: AsyncAosCloud.iterate(attr(*args, **kwargs))
+
+                async def method(*args, **kwargs):
+                    return await AsyncAosCloud.run(attr, *args, **kwargs)
+                return method
+
+            def __setattr__(self, name, value):
+                setattr(self.entity, name, value)
+
+        class ServiceInstance(_Entity):
+            entity_class = AosCloud.Entities.ServiceInstance
+
+        class Subjects(_Entity):
+            entity_class = AosCloud.Entities.Subjects
+
+        class Unit(_Entity):
+            entity_class = AosCloud.Entities.Unit
+
+        class Component(_Entity):
+            entity_class = AosCloud.Entities.Component
+
+    @classmethod
+    async def connection_info(cls, unit_system_ids: list) -> dict:
+        """
+            Check connection-info of many units concurrently
+            Parameters:
+                unit_system_ids: list of unit system ids (class 'list')
+            Return type: class 'dict' mapping unit system id to its "is_online" state
+        """
+        requests = [cls.Request(url = AosCloud.url("oem", f"units/{system_id}/connection-info/"),
+                                role = "oem")
+                    for system_id in unit_system_ids]
+        responses = await asyncio.gather(*[request.get() for request in requests])
+        online = {system_id: response.json()["is_online"] for system_id, response in zip(unit_system_ids, responses)}
+        log.info(f"{sum(online.values())}/{len(online)} UNITS ARE ONLINE")
+        return online
@@ -0,0 +1,165 @@
+import csv
+import time
+import logging
+from array import array
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+from .aos import AosCloud
+
+log = logging.getLogger(__name__)
+
+METRICS = ("cpu", "ram", "usedDisk", "inTraffic", "outTraffic")
+
+class RingBuffer():
+    """
+        Fixed-size ring buffer of floats backed by a contiguous array, so it takes 8 bytes per
+        sample whatever the run length and never grows. Once full, the oldest sample is overwritten.
+    """
+    def __init__(self, capacity: int):
+        self.capacity = capacity
+        self._data = array("d", bytes(8 * capacity))
+        self._next = 0
+        self._count = 0
+
+    def __len__(self) -> int:
+        return self._count
+
+    def append(self, value: float) -> None:
+        self._data[self._next] = value
+        self._next = (self._next + 1) % self.capacity
+        self._count = min(self._count + 1, self.capacity)
+
+    def values(self):
+        """
+            Return the samples in chronological order, as a numpy array when numpy is installed
+        """
+        start = (self._next - self._count) % self.capacity
+        if numpy is not None:
+            data = numpy.frombuffer(self._data, dtype=numpy.float64)
+            return numpy.roll(data, -start)[:self._count]
+        ordered = self._data[start:] + self._data[:start]
+        return ordered[:self._count]
+
+
+def window_stats(values) -> dict:
+    """
+        Return min/mean/p95/max of a series of samples, vectorized when numpy is installed
+    """
+    if len(values) == 0:
+        return dict(count=0, min=None, mean=None, p95=None, max=None)
+    if numpy is not None:
+        values = numpy.asarray(values)
+        return dict(count=int(values.size), min=float(values.min()), mean=float(values.mean()),
+                    p95=float(numpy.percentile(values, 95)), max=float(values.max()))
+    ordered = sorted(values)
+    # Linear interpolation between the closest ranks, as numpy.percentile does
+    rank = 0.95 * (len(ordered) - 1)
+    low = int(rank)
+    high = min(low + 1, len(ordered) - 1)
+    p95 = ordered[low] + (ordered[high] - ordered[low]) * (rank - low)
+    return dict(count=len(ordered), min=ordered[0], mean=sum(ordered) / len(ordered), p95=p95, max=ordered[-1])
+
+
+class MonitoringCollector():
+    """
+        Sample the /monitoring/ endpoint of a unit at a fixed interval and keep every point of
+        each metric (cpu, ram, usedDisk, inTraffic, outTraffic) in a ring buffer, so soak runs
+        of hours use constant memory. Statistics are computed over sliding time windows and the
+        samples can be exported to CSV, or to Parquet when pyarrow is installed.
+    """
+    def __init__(self, unit_system_id: str, interval=10, capacity=8640):
+        """
+            Parameters:
+                unit_system_id: class 'str'
+                interval: seconds between two samples (class 'int' or 'float')
+                capacity: number of samples kept per metric, 24 hours at 10s by default (class 'int')
+        """
+        self.unit_system_id = unit_system_id
+        self.interval = interval
+        self.timestamps = RingBuffer(capacity)
+        self.metrics = {metric: RingBuffer(capacity) for metric in METRICS}
+        self.aos_request = AosCloud.Request(url = AosCloud.url("oem", f"units/{unit_system_id}/monitoring/"),
+                                            role = "oem")
+
+    def sample(self) -> bool:
+        """
+            Record the current value of every metric
+            Return type: class 'bool', False when the unit has not reported monitoring data yet
+        """
+        response = self.aos_request.get_json()
+        if not response or not response[0]:
+            return False
+        self.timestamps.append(time.time())
+        for metric, ring in self.metrics.items():
+            ring.append(float(response[0][metric][0]["value"]))
+        return True
+
+    def stats(self, window=None) -> dict:
+        """
+            Return min/mean/p95/max of each metric over the last "window" seconds (all samples if None)
+            Return type: class 'dict' mapping each metric to its statistics
+        """
+        timestamps = self.timestamps.values()
+        first = 0
+        if window is not None:
+            since = time.time() - window
+            first = next((index for index, timestamp in enumerate(timestamps) if timestamp >= since), len(timestamps)) \
+                    if numpy is None else int(numpy.searchsorted(timestamps, since))
+        return {metric: window_stats(ring.values()[first:]) for metric, ring in self.metrics.items()}
+
+    def rows(self):
+        """
+            Yield (timestamp, cpu, ram, usedDisk, inTraffic, outTraffic) for every sample in the buffers
+        """
+        columns = [self.timestamps.values()] + [ring.values() for ring in self.metrics.values()]
+        for row in zip(*columns):
+            yield tuple(float(value) for value in row)
+
+    def export(self, path: str) -> None:
+        """
+            Export the samples to a CSV file, or to a Parquet file if path ends with ".parquet"
+        """
+        header = ("timestamp",) + METRICS
+        if path.endswith(".parquet"):
+            try:
+                import pyarrow
+                import pyarrow.parquet
+            except ImportError:
+                raise RuntimeError("pyarrow is required to export monitoring data to Parquet")
+            columns = [self.timestamps.values()] + [ring.values() for ring in self.metrics.values()]
+            table = pyarrow.table({name: list(column) if numpy is None else column for name, column in zip(header, columns)})
+            pyarrow.parquet.write_table(table, path)
+        else:
+            with open(path, "w", newline="") as file:
+                writer = csv.writer(file)
+                writer.writerow(header)
+                writer.writerows(self.rows())
+        log.info(f"EXPORTED {len(self.timestamps)} MONITORING SAMPLES OF UNIT {self.unit_system_id} TO {path}")
+
+    @staticmethod
+    def run_many(collectors: list, duration) -> None:
+        """
+            Sample many collectors, e.g. one per unit, from a single loop for "duration" seconds.
+            Samples are scheduled on a fixed grid so that the interval does not drift.
+        """
+        deadline = time.monotonic() + duration
+        due = {collector: time.monotonic() for collector in collectors}
+        while True:
+            collector = min(due, key=due.get)
+            if due[collector] > deadline:
+                break
+            delay = due[collector] - time.monotonic()
+            if delay > 0:
+                time.sleep(delay)
+            try:
+                collector.sample()
+            except Exception as err:
+                log.error(f"MONITORING SAMPLE OF UNIT {collector.unit_system_id} FAILED: {err}")
+            due[collector] += collector.interval
+
+    def run(self, duration) -> None:
+        MonitoringCollector.run_many([self], duration)
@@ -0,0 +1,171 @@
+import os
+import json
+import sqlite3
+import datetime
+import statistics
+from pathlib import Path
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS runs (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    started TEXT NOT NULL,
+    finished TEXT NOT NULL,
+    label TEXT
+);
+CREATE TABLE IF NOT EXISTS stages (
+    run_id INTEGER NOT NULL REFERENCES runs(id) ON DELETE CASCADE,
+    unit_id TEXT NOT NULL,
+    unit_name TEXT,
+    unit_version TEXT,
+    stage TEXT NOT NULL,
+    start_time TEXT,
+    end_time TEXT,
+    duration REAL,
+    result TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS endpoints (
+    run_id INTEGER NOT NULL REFERENCES runs(id) ON DELETE CASCADE,
+    method TEXT NOT NULL,
+    endpoint TEXT NOT NULL,
+    calls INTEGER,
+    errors INTEGER,
+    retries INTEGER,
+    p50 REAL,
+    p95 REAL,
+    max REAL,
+    total REAL,
+    sent INTEGER,
+    received INTEGER
+);
+CREATE INDEX IF NOT EXISTS stages_by_unit ON stages (unit_id, stage, run_id);
+"""
+
+class RunHistory():
+    """
+        SQLite store of the test runs of main.py: the duration and result of every stage of every
+        unit, and the per-endpoint request metrics of the run. compare() checks the latest run
+        against a rolling baseline, the median duration of the same unit and stage over the
+        previous passing runs, to catch latency regressions across releases.
+        The database defaults to ~/.aos/run-history.sqlite, or AOS_HISTORY.
+    """
+    default_path = Path(os.environ.get("AOS_HISTORY", Path.home()/".aos"/"run-history.sqlite"))
+
+    def __init__(self, path=None):
+        self.path = Path(path or self.default_path)
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self.connection = sqlite3.connect(self.path)
+        self.connection.row_factory = sqlite3.Row
+        self.connection.execute("PRAGMA foreign_keys = ON")
+        self.connection.executescript(SCHEMA)
+
+    def close(self) -> None:
+        self.connection.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def record_run(self, results: list, endpoints=(), started=None, label=None) -> int:
+        """
+            Store one run
+            Parameters:
+                results: (unit, rows of run_pipeline) of each unit, as printed by main.print_summary (class 'list')
+                endpoints: rows of RequestMetrics.summary() (class 'list')
+                started: start of the run, now by default (class 'datetime.datetime')
+                label: free text identifying the run, e.g. a release or firmware version (class 'str')
+            Return type: class 'int', id of the run
+        """
+        finished = datetime.datetime.now().astimezone()
+        started = started or finished
+        with self.connection:
+            run_id = self.connection.execute("INSERT INTO runs (started, finished, label) VALUES (?, ?, ?)",
+                                             (started.isoformat(timespec="seconds"), finished.isoformat(timespec="seconds"), label)).lastrowid
+            self.connection.executemany(
+                "INSERT INTO stages (run_id, unit_id, unit_name, unit_version, stage, start_time, end_time, duration, result) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                [(run_id, unit["unit_id"], unit.get("unit_name"), unit.get("unit_version"), stage, start, end, _seconds(duration), result)
+                 for unit, rows in results for stage, start, end, duration, result in rows])
+            self.connection.executemany(
+                "INSERT INTO endpoints (run_id, method, endpoint, calls, errors, retries, p50, p95, max, total, sent, received) "
+                "VALUES (:run_id, :method, :endpoint, :calls, :errors, :retries, :p50, :p95, :max, :total, :sent, :received)",
+                [dict(row, run_id=run_id) for row in endpoints])
+        return run_id
+
+    def runs(self, limit=20) -> list:
+        """
+            Return type: class 'list' of class 'dict' (id, started, finished, label, passed, failed), latest first
+        """
+        rows = self.connection.execute(
+            "SELECT runs.*, SUM(stages.result = 'PASS') AS passed, SUM(stages.result != 'PASS') AS failed "
+            "FROM runs LEFT JOIN stages ON stages.run_id = runs.id GROUP BY runs.id ORDER BY runs.id DESC LIMIT ?", (limit,))
+        return [dict(row) for row in rows]
+
+    def latest_run_id(self):
+        row = self.connection.execute("SELECT MAX(id) FROM runs").fetchone()
+        return row[0]
+
+    def compare(self, run_id=None, baseline=5, threshold=0.2, min_delta=1.0) -> list:
+        """
+            Compare every stage of a run with the median duration of the same unit and stage over
+            the "baseline" previous runs in which it passed. A stage regressed when it is slower
+            than the baseline by more than "threshold" (relative) and "min_delta" seconds.
+            Parameters:
+                run_id: run to check, the latest one by default (class 'int')
+                baseline: number of previous passing runs of the rolling baseline (class 'int')
+                threshold: relative slowdown flagged as a regression, e.g. 0.2 for 20% (class 'float')
+                min_delta: slowdown in seconds below which a stage is not flagged (class 'float')
+            Return type: class 'list' of class 'dict' with keys unit_id, stage, result, duration,
+                         baseline (median seconds or None), samples, change (relative or None) and
+                         status ("regressed", "improved", "ok", "failed" or "no baseline")
+        """
+        run_id = run_id or self.latest_run_id()
+        if run_id is None:
+            return list()
+        comparison = list()
+        for stage in self.connection.execute("SELECT * FROM stages WHERE run_id = ? ORDER BY rowid", (run_id,)).fetchall():
+            previous = [row["duration"] for row in self.connection.execute(
+                "SELECT duration FROM stages WHERE unit_id = ? AND stage = ? AND run_id < ? AND result = 'PASS' AND duration IS NOT NULL "
+                "ORDER BY run_id DESC LIMIT ?", (stage["unit_id"], stage["stage"], run_id, baseline))]
+            median = statistics.median(previous) if previous else None
+            change = None
+            if stage["result"] != "PASS" or stage["duration"] is None:
+                status = "failed"
+            elif median is None:
+                status = "no baseline"
+            else:
+                delta = stage["duration"] - median
+                change = delta / median if median else None
+                if delta > min_delta and (change is None or change > threshold):
+                    status = "regressed"
+                elif -delta > min_delta and change is not None and -change > threshold:
+                    status = "improved"
+                else:
+                    status = "ok"
+            comparison.append(dict(unit_id = stage["unit_id"], stage = stage["stage"], result = stage["result"],
+                                   duration = stage["duration"], baseline = median, samples = len(previous),
+                                   change = change, status = status))
+        return comparison
+
+    def endpoints(self, run_id=None) -> list:
+        """
+            Return type: class 'list' of the per-endpoint request metrics of a run, the latest by default
+        """
+        run_id = run_id or self.latest_run_id()
+        rows = self.connection.execute("SELECT * FROM endpoints WHERE run_id = ? ORDER BY total DESC", (run_id,))
+        return [dict(row) for row in rows]
+
+    def to_json(self, path: str, run_id=None, **compare_options) -> None:
+        run_id = run_id or self.latest_run_id()
+        with open(path, "w") as file:
+            json.dump(dict(run_id=run_id, stages=self.compare(run_id, **compare_options), endpoints=self.endpoints(run_id)), file, indent=4)
+
+
+def _seconds(duration):
+    """
+        Duration of a summary row in seconds, or None for a stage that did not run ("-")
+    """
+    try:
+        return float(duration)
+    except (TypeError, ValueError):
+        return None
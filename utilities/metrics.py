@@ -0,0 +1,276 @@
+import re
+import json
+import threading
+import contextvars
+from bisect import bisect_left
+
+# Upper bounds of the histogram buckets, as in Prometheus the last bucket (+Inf) is implicit
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+BYTES_BUCKETS = tuple(4 ** exponent for exponent in range(4, 15)) # 256 B to 256 MB
+RETRY_BUCKETS = (0, 1, 2, 3)
+
+UUID = re.compile(r"[0-9a-fA-F]{8}-[0-9a-fA-F]{4}-[0-9a-fA-F]{4}-[0-9a-fA-F]{4}-[0-9a-fA-F]{12}")
+
+def endpoint_template(path: str) -> str:
+    """
+        Return the endpoint of a request path relative to /api/v1/ with its identifiers replaced by
+        placeholders, e.g. "/api/v1/units/VIN_1/connection-info/" -> "units/{system_uid}/connection-info/"
+    """
+    segments = path.split("/api/v1/", 1)[-1].split("/")
+    for index, segment in enumerate(segments):
+        if segment.isdigit():
+            segments[index] = "{id}"
+        elif UUID.fullmatch(segment):
+            segments[index] = "{uuid}"
+        elif index > 0 and segments[index - 1] == "units" and segment:
+            segments[index] = "{system_uid}"
+    return "/".join(segments)
+
+
+class Histogram():
+    """
+        Histogram with fixed bucket bounds, also keeping the count, sum and maximum of the values
+    """
+    def __init__(self, bounds: tuple):
+        self.bounds = bounds
+        self.counts = [0] * (len(bounds) + 1)
+        self.count = 0
+        self.sum = 0.0
+        self.max = 0.0
+
+    def observe(self, value: float) -> None:
+        self.counts[bisect_left(self.bounds, value)] += 1
+        self.count += 1
+        self.sum += value
+        self.max = max(self.max, value)
+
+    def quantile(self, q: float) -> float:
+        """
+            Estimate a quantile by linear interpolation inside its bucket, as Prometheus histogram_quantile()
+        """
+        if not self.count:
+            return 0.0
+        rank = q * self.count
+        seen = 0
+        for index, count in enumerate(self.counts):
+            if count and seen + count >= rank:
+                low = self.bounds[index - 1] if index > 0 else 0.0
+                high = self.bounds[index] if index < len(self.bounds) else self.max
+                return min(low + (high - low) * (rank - seen) / count, self.max)
+            seen += count
+        return self.max
+
+    def to_dict(self) -> dict:
+        return dict(count=self.count, sum=self.sum, max=self.max,
+                    p50=self.quantile(0.5), p95=self.quantile(0.95), p99=self.quantile(0.99),
+                    buckets={str(bound): count for bound, count in zip(self.bounds + ("+Inf",), self.counts)})
+
+
+class RequestMetrics():
+    """
+        Per-endpoint instrumentation of AosCloud requests. Every call sent by AosCloud.Request is
+        recorded under its method and templated endpoint with its status code, latency (including
+        retries), number of retries and request/response sizes. The histograms can be dumped as
+        JSON or in the Prometheus text exposition format at the end of a run.
+    """
+    def __init__(self):
+        self._endpoints = dict()
+        self._lock = threading.Lock()
+
+    def record(self, method: str, path: str, status, latency: float, retries: int, request_bytes: int, response_bytes: int) -> None:
+        """
+            Parameters:
+                method: HTTP method (class 'str')
+                path: request path, templated with endpoint_template() (class 'str')
+                status: status code of the last attempt, or "error" if no response was received (class 'int' or 'str')
+                latency: seconds from the first attempt until the response (class 'float')
+                retries: number of attempts after the first one (class 'int')
+                request_bytes, response_bytes: body sizes (class 'int')
+        """
+        key = (method, endpoint_template(path))
+        with self._lock:
+            endpoint = self._endpoints.get(key)
+            if endpoint is None:
+                endpoint = self._endpoints[key] = dict(statuses=dict(),
+                                                       latency=Histogram(LATENCY_BUCKETS),
+                                                       retries=Histogram(RETRY_BUCKETS),
+                                                       request_bytes=Histogram(BYTES_BUCKETS),
+                                                       response_bytes=Histogram(BYTES_BUCKETS))
+            endpoint["statuses"][str(status)] = endpoint["statuses"].get(str(status), 0) + 1
+            endpoint["latency"].observe(latency)
+            endpoint["retries"].observe(retries)
+            endpoint["request_bytes"].observe(request_bytes)
+            endpoint["response_bytes"].observe(response_bytes)
+        for trace in CallTrace.active():
+            trace.append(method=method, endpoint=key[1], status=status, latency=latency, retries=retries)
+
+    def latency_quantile(self, method: str, path: str, q: float, min_count=20):
+        """
+            Return the q quantile of the latency of an endpoint, of every endpoint of the method until the
+            endpoint was called min_count times, or None until the method was called min_count times
+        """
+        with self._lock:
+            endpoint = self._endpoints.get((method, endpoint_template(path)))
+            if endpoint is not None and endpoint["latency"].count >= min_count:
+                return endpoint["latency"].quantile(q)
+            merged = Histogram(LATENCY_BUCKETS)
+            for (endpoint_method, _), data in self._endpoints.items():
+                if endpoint_method == method:
+                    latency = data["latency"]
+                    merged.counts = [total + count for total, count in zip(merged.counts, latency.counts)]
+                    merged.count += latency.count
+                    merged.sum += latency.sum
+                    merged.max = max(merged.max, latency.max)
+            return merged.quantile(q) if merged.count >= min_count else None
+
+    def reset(self) -> None:
+        with self._lock:
+            self._endpoints.clear()
+
+    def snapshot(self) -> dict:
+        """
+            Return type: class 'dict' mapping "<METHOD> <endpoint>" to its status counts and histograms
+        """
+        with self._lock:
+            return {f"{method} {endpoint}": dict(method=method, endpoint=endpoint, statuses=dict(data["statuses"]),
+                                                 **{name: data[name].to_dict() for name in ("latency", "retries", "request_bytes", "response_bytes")})
+                    for (method, endpoint), data in sorted(self._endpoints.items())}
+
+    def summary(self) -> list:
+        """
+            One row per endpoint, slowest in total first
+            Return type: class 'list' of class 'dict' with keys method, endpoint, calls, errors, retries,
+                         p50, p95, max, total (seconds), sent and received (bytes)
+        """
+        rows = list()
+        for name, data in self.snapshot().items():
+            latency = data["latency"]
+            errors = sum(count for status, count in data["statuses"].items() if not status.startswith(("2", "3")))
+            rows.append(dict(method=data["method"], endpoint=data["endpoint"], calls=latency["count"], errors=errors,
+                             retries=int(data["retries"]["sum"]), p50=latency["p50"], p95=latency["p95"], max=latency["max"],
+                             total=latency["sum"], sent=int(data["request_bytes"]["sum"]), received=int(data["response_bytes"]["sum"])))
+        return sorted(rows, key=lambda row: row["total"], reverse=True)
+
+    def to_json(self, path: str) -> None:
+        with open(path, "w") as file:
+            json.dump(self.snapshot(), file, indent=4)
+
+    def to_prometheus(self, path=None) -> str:
+        """
+            Return the metrics in the Prometheus text exposition format, and write them to path if set
+        """
+        def labels(data: dict, **extra) -> str:
+            pairs = dict(method=data["method"], endpoint=data["endpoint"], **extra)
+            return ",".join('{}="{}"'.format(key, str(value).replace("\\", "\\\\").replace('"', '\\"')) for key, value in pairs.items())
+
+        snapshot = self.snapshot()
+        lines = ["# HELP aos_requests_total AosCloud requests by status code", "# TYPE aos_requests_total counter"]
+        for data in snapshot.values():
+            for status, count in data["statuses"].items():
+                lines.append(f"aos_requests_total{{{labels(data, status=status)}}} {count}")
+        histograms = [("latency", "aos_request_duration_seconds", "Latency of AosCloud requests including retries"),
+                      ("retries", "aos_request_retries", "Retries of AosCloud requests"),
+                      ("request_bytes", "aos_request_size_bytes", "Body size of AosCloud requests"),
+                      ("response_bytes", "aos_response_size_bytes", "Body size of AosCloud responses")]
+        for name, metric, description in histograms:
+            lines += [f"# HELP {metric} {description}", f"# TYPE {metric} histogram"]
+            for data in snapshot.values():
+                cumulative = 0
+                for bound, count in data[name]["buckets"].items():
+                    cumulative += count
+                    lines.append(f"{metric}_bucket{{{labels(data, le=bound)}}} {cumulative}")
+                lines.append(f"{metric}_sum{{{labels(data)}}} {data[name]['sum']}")
+                lines.append(f"{metric}_count{{{labels(data)}}} {data[name]['count']}")
+        text = "\n".join(lines) + "\n"
+        if path:
+            with open(path, "w") as file:
+                file.write(text)
+        return text
+
+class CallBudgetExceeded(AssertionError):
+    pass
+
+
+class CallTrace():
+    """
+        Ordered log of the HTTP calls sent by AosCloud.Request while the trace is active, e.g. during
+        one test stage. Traces follow the context of the code that started them, so stages running
+        concurrently in their own threads or scheduler contexts are traced separately; nested traces
+        all record the calls. A trace can be checked against a call budget to catch changes that add
+        round-trips.
+    """
+    _active = contextvars.ContextVar("aos_call_traces", default=())
+
+    def __init__(self, name=None):
+        self.name = name
+        self.calls = list()
+        self._lock = threading.Lock()
+        self._tokens = list()
+
+    @classmethod
+    def active(cls) -> tuple:
+        return cls._active.get()
+
+    def __enter__(self):
+        self._tokens.append(CallTrace._active.set(CallTrace._active.get() + (self,)))
+        return self
+
+    def __exit__(self, *exc):
+        CallTrace._active.reset(self._tokens.pop())
+
+    def append(self, **call) -> None:
+        with self._lock:
+            self.calls.append(call)
+
+    def counts(self) -> dict:
+        """
+            Return type: class 'dict' mapping "<METHOD> <endpoint>" to its number of calls
+        """
+        counts = dict()
+        for call in list(self.calls):
+            name = f"{call['method']} {call['endpoint']}"
+            counts[name] = counts.get(name, 0) + 1
+        return counts
+
+    def check_budget(self, budget: dict) -> list:
+        """
+            Compare the calls with a budget mapping "<METHOD> <endpoint>" to its maximum number of
+            calls. An endpoint missing from the budget may not be called at all, and the optional
+            "total" key limits the number of calls of the trace.
+            Return type: class 'list' of (endpoint, calls, maximum) exceeding the budget
+        """
+        counts = self.counts()
+        exceeded = [(name, count, budget.get(name, 0)) for name, count in counts.items() if count > budget.get(name, 0)]
+        if "total" in budget and len(self.calls) > budget["total"]:
+            exceeded.append(("total", len(self.calls), budget["total"]))
+        return exceeded
+
+    def assert_budget(self, budget: dict) -> None:
+        """
+            Raise CallBudgetExceeded, with the ordered call log, if the calls exceed the budget
+        """
+        exceeded = self.check_budget(budget)
+        if exceeded:
+            lines = [f"{name}: {count} calls, budget {maximum}" for name, count, maximum in exceeded]
+            raise CallBudgetExceeded(f"{self.name or 'Trace'} exceeds its call budget\n" + "\n".join(lines) + "\n" + self.format())
+
+    def format(self) -> str:
+        """
+            Return the call log, one numbered line per call
+        """
+        return "\n".join(f"{index:4}. {call['method']:6} {call['endpoint']} {call['status']} {call['latency'] * 1000:.1f}ms"
+                         + (f" ({call['retries']} retries)" if call["retries"] else "")
+                         for index, call in enumerate(list(self.calls), 1))
+
+
+def submit_in_context(executor, fn, *args, **kwargs):
+    """
+        Submit fn to an executor to run in a copy of the caller's context, so that the calls it sends
+        are recorded in the caller's active CallTrace and it sees the caller's context variables,
+        e.g. the unit whose logs are captured. Every thread started by the tests goes through it.
+        Return type: class 'concurrent.futures.Future'
+    """
+    return executor.submit(contextvars.copy_context().run, fn, *args, **kwargs)
+
+
+request_metrics = RequestMetrics()
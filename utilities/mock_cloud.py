@@ -0,0 +1,579 @@
+import os
+import re
+import ssl
+import sys
+import json
+import math
+import time
+import uuid
+import random
+import hashlib
+import argparse
+import tempfile
+import itertools
+import threading
+import subprocess
+from collections import Counter
+from urllib.parse import urlparse, parse_qs, urlencode
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+
+ROLES = ("sp", "oem")
+
+def generate_certificates(security_dir: str) -> None:
+    """
+        Create a throw-away certificate authority, a server certificate for 127.0.0.1/localhost and
+        one client certificate per user role with openssl. The client files follow the AosCloud layout
+        (aos-root-certificate.pem, aos-long-user-sp.pem, aos-long-user-oem.pem) so that AosCloud.Request
+        can use security_dir as is.
+    """
+    os.makedirs(security_dir, exist_ok=True)
+
+    def openssl(*args):
+        subprocess.run(["openssl", *args], cwd=security_dir, check=True, capture_output=True)
+
+    def issue(name: str, subject: str, extensions: str) -> None:
+        openssl("req", "-newkey", "ec", "-pkeyopt", "ec_paramgen_curve:prime256v1", "-nodes",
+                "-keyout", f"{name}.key", "-out", f"{name}.csr", "-subj", subject)
+        with open(os.path.join(security_dir, f"{name}.ext"), "w") as file:
+            file.write(extensions)
+        openssl("x509", "-req", "-in", f"{name}.csr", "-CA", "ca.pem", "-CAkey", "ca.key", "-CAcreateserial",
+                "-out", f"{name}.pem", "-days", "2", "-extfile", f"{name}.ext")
+
+    openssl("req", "-x509", "-newkey", "ec", "-pkeyopt", "ec_paramgen_curve:prime256v1", "-nodes",
+            "-keyout", "ca.key", "-out", "ca.pem", "-days", "2", "-subj", "/CN=Mock AosCloud CA")
+    issue("server", "/CN=localhost", "subjectAltName=DNS:localhost,IP:127.0.0.1\n")
+    for role in ROLES:
+        issue(role, f"/CN=aos-user-{role}", "extendedKeyUsage=clientAuth\n")
+        with open(os.path.join(security_dir, f"aos-long-user-{role}.pem"), "w") as pem:
+            for part in (f"{role}.pem", f"{role}.key"):
+                with open(os.path.join(security_dir, part)) as file:
+                    pem.write(file.read())
+    with open(os.path.join(security_dir, "ca.pem")) as ca, open(os.path.join(security_dir, "aos-root-certificate.pem"), "w") as root:
+        root.write(ca.read())
+
+
+class MockAosCloud():
+    """
+        Local stand-in for the sp.aoscloud.io and oem.aoscloud.io REST APIs used by utilities/aos.py,
+        served over mutual TLS on 127.0.0.1. It keeps services, subjects, units, unit models, update
+        components and validation batches in memory and moves them through the same states as
+        AosCloud, after "transition_delay" seconds:
+        - an uploaded batch file becomes "ready" and creates a Ready component and a validation batch
+        - an approved component batch is installed on every unit
+        - a service instance becomes "active" on the units of its subjects once its batch is approved
+        Every response can be delayed ("latency" plus a random "jitter", and "slow_latency" for a
+        "slow_rate" share of the requests to simulate tail latency), list endpoints are paginated
+        with limit/offset, and errors can be injected at random ("error_rate") or for the next requests
+        (fail_next) or when more than "rate_limit" requests per second are received (429 with
+        Retry-After), and the updates of chosen units can be made to fail (fail_updates). Each request is counted per method and templated endpoint.
+    """
+    # (method, endpoint template relative to /api/v1/, role of the client certificate, handler name)
+    routes = [
+        ("GET", "services/", "sp", "list_services"),
+        ("POST", "services/", "sp", "create_service"),
+        ("DELETE", "services/{id}/", "sp", "delete_service"),
+        ("GET", "services/{uuid}/service-versions/", "sp", "list_service_versions"),
+        ("POST", "services/{uuid}/service-versions/", "sp", "create_service_version"),
+        ("GET", "subjects/", "oem", "list_subjects"),
+        ("POST", "subjects/", "oem", "create_subject"),
+        ("DELETE", "subjects/{id}/", "oem", "delete_subject"),
+        ("GET", "subjects/{id}/services/", "oem", "list_subject_services"),
+        ("POST", "subjects/{id}/services/", "oem", "assign_subject_services"),
+        ("DELETE", "subjects/{id}/services/", "oem", "unassign_subject_services"),
+        ("GET", "subjects/{id}/units/", "oem", "list_subject_units"),
+        ("POST", "subjects/{id}/units/", "oem", "assign_subject_units"),
+        ("DELETE", "subjects/{id}/units/", "oem", "unassign_subject_units"),
+        ("GET", "units/", "oem", "list_units"),
+        ("GET", "units/{system_uid}/connection-info/", "oem", "get_connection_info"),
+        ("GET", "units/{system_uid}/monitoring/", "oem", "get_monitoring"),
+        ("GET", "units/{system_uid}/subjects-services/", "oem", "list_unit_services"),
+        ("GET", "units/{id}/", "oem", "get_unit"),
+        ("GET", "unit-models/", "oem", "list_unit_models"),
+        ("PATCH", "unit-models/{id}/", "oem", "update_unit_model"),
+        ("POST", "update-components/upload/", "oem", "upload_batch_file"),
+        ("GET", "update-components/upload/{id}/", "oem", "get_upload"),
+        ("GET", "update-components/", "oem", "list_components"),
+        ("DELETE", "update-components/{id}/", "oem", "delete_component"),
+        ("GET", "fleet-validation-batch/", "oem", "list_batches"),
+        ("PATCH", "fleet-validation-batch/{id}/approve/", "oem", "approve_batch"),
+    ]
+
+    def __init__(self, units=(), unit_models=(), firmware_components=("rcar-s4-spider-1.0-domd",),
+                 latency=0.0, jitter=0.0, page_size=100, error_rate=0.0, error_status=500,
+                 transition_delay=0.5, etags=True, rate_limit=0, slow_rate=0.0, slow_latency=2.0, security_dir=None, port=0):
+        """
+            Parameters:
+                units: system uids of the simulated units (class 'list')
+                unit_models: names of the simulated unit models (class 'list')
+                firmware_components: component ids built from every uploaded batch file, or only the one named like the file (class 'list')
+                latency, jitter: seconds added to every response (class 'float')
+                page_size: default number of results per page (class 'int')
+                error_rate: probability of answering a request with error_status (class 'float')
+                transition_delay: seconds before an upload, approval or deployment completes (class 'float')
+                etags: whether GET responses carry an ETag and answer If-None-Match with 304 (class 'bool')
+                rate_limit: requests per second above which 429 with Retry-After is answered, 0 for none (class 'float')
+                slow_rate: probability of delaying a response by slow_latency seconds more (class 'float')
+                security_dir: where certificates are written, a temporary directory by default (class 'str')
+                port: listening port, a free port by default (class 'int')
+        """
+        self.latency = latency
+        self.jitter = jitter
+        self.page_size = page_size
+        self.error_rate = error_rate
+        self.error_status = error_status
+        self.transition_delay = transition_delay
+        self.etags = etags
+        self.rate_limit = rate_limit
+        self._tokens = rate_limit
+        self.slow_rate = slow_rate
+        self.slow_latency = slow_latency
+        self._tokens_updated = time.monotonic()
+        self.firmware_components = list(firmware_components)
+        self.port = port
+        self._tmp_dir = None
+        if security_dir is None:
+            self._tmp_dir = tempfile.TemporaryDirectory(prefix="mock-aoscloud-")
+            security_dir = self._tmp_dir.name
+        self.security_dir = security_dir
+        self.requests = Counter()
+        self.request_log = list()
+        self._failures = list()
+        self._lock = threading.RLock()
+        self._ids = itertools.count(1)
+        self._compiled_routes = [(method, template, re.compile(re.sub(r"\{(\w+)\}", r"(?P<\1>[^/]+)", template)), role, handler)
+                                 for method, template, role, handler in self.routes]
+        self.services = dict()
+        self.subjects = dict()
+        self.units = dict()
+        self.unit_models = dict()
+        self.uploads = dict()
+        self.components = dict()
+        self.batches = dict()
+        for system_uid in units:
+            self.add_unit(system_uid)
+        for name in unit_models:
+            unit_model_id = next(self._ids)
+            self.unit_models[unit_model_id] = dict(id=unit_model_id, name=name, unit_config=None)
+        self._server = None
+        self._thread = None
+
+    # Server life cycle
+
+    def start(self) -> "MockAosCloud":
+        if not os.path.exists(os.path.join(self.security_dir, "aos-root-certificate.pem")):
+            generate_certificates(self.security_dir)
+        context = ssl.SSLContext(ssl.PROTOCOL_TLS_SERVER)
+        context.load_cert_chain(os.path.join(self.security_dir, "server.pem"), os.path.join(self.security_dir, "server.key"))
+        context.load_verify_locations(os.path.join(self.security_dir, "ca.pem"))
+        context.verify_mode = ssl.CERT_REQUIRED
+        self._server = ThreadingHTTPServer(("127.0.0.1", self.port), _Handler)
+        self._server.daemon_threads = True
+        self._server.mock = self
+        # The handshake runs in the request thread instead of blocking the accept loop
+        self._server.socket = context.wrap_socket(self._server.socket, server_side=True, do_handshake_on_connect=False)
+        self.port = self._server.server_address[1]
+        self._thread = threading.Thread(target=self._server.serve_forever, name="mock-aoscloud", daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self) -> None:
+        if self._server:
+            self._server.shutdown()
+            self._server.server_close()
+            self._server = None
+        if self._tmp_dir:
+            self._tmp_dir.cleanup()
+            self._tmp_dir = None
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.stop()
+
+    @property
+    def api_url(self) -> str:
+        return f"https://127.0.0.1:{self.port}/api/v1"
+
+    def client_environment(self) -> dict:
+        """
+            Environment variables pointing AosCloud.Request (and the stand-in tools) to this server
+        """
+        return dict(AOS_SP_URL=self.api_url, AOS_OEM_URL=self.api_url, AOS_SECURITY_DIR=self.security_dir)
+
+    def install_tools(self, bin_dir: str) -> None:
+        """
+            Write stand-ins of the aos-prov and aos-signer command line tools to bin_dir. aos-prov
+            succeeds without doing anything; "aos-signer go" publishes a new version of the service
+            whose uid is in meta/config.yaml of the working directory. They read the server address
+            from the variables of client_environment().
+        """
+        os.makedirs(bin_dir, exist_ok=True)
+        tools = {
+            "aos-prov": "#!/bin/sh\nexit 0\n",
+            "aos-signer": f"#!{sys.executable}\n" + _SIGNER_SCRIPT
+        }
+        for name, script in tools.items():
+            path = os.path.join(bin_dir, name)
+            with open(path, "w") as file:
+                file.write(script)
+            os.chmod(path, 0o755)
+
+    # Test controls
+
+    def add_unit(self, system_uid: str, is_online=True) -> dict:
+        with self._lock:
+            unit_id = next(self._ids)
+            unit = dict(id=unit_id, system_uid=system_uid, is_online=is_online, update_failed=False,
+                        components={component_id: "0.0.0" for component_id in self.firmware_components})
+            self.units[system_uid] = unit
+            return unit
+
+    def fail_next(self, count=1, status=500, retry_after=None) -> None:
+        """
+            Answer the next "count" requests with an error status, with a Retry-After header if set
+        """
+        with self._lock:
+            self._failures.extend([(status, retry_after)] * count)
+
+    def fail_updates(self, *system_uids) -> None:
+        """
+            Make the next firmware and service updates of units fail: their components keep the
+            installed version with a "failed" status and their service instances become "failed"
+        """
+        with self._lock:
+            for system_uid in system_uids:
+                self.units[system_uid]["update_failed"] = True
+
+    def reset_stats(self) -> None:
+        with self._lock:
+            self.requests.clear()
+            self.request_log.clear()
+
+    def request_count(self) -> int:
+        with self._lock:
+            return sum(self.requests.values())
+
+    # Request dispatch
+
+    def dispatch(self, method: str, path: str, query: dict, body: bytes, role: str):
+        """
+            Return (status, headers, payload) of a request
+        """
+        slow = self.slow_latency if self.slow_rate and random.random() < self.slow_rate else 0.0
+        time.sleep(self.latency + random.uniform(0, self.jitter) + slow)
+        endpoint = path.split("/api/v1/", 1)[-1]
+        for route_method, template, pattern, route_role, handler in self._compiled_routes:
+            match = pattern.fullmatch(endpoint)
+            if match and route_method == method:
+                break
+        else:
+            self._count(method, endpoint, 404)
+            return 404, {}, {"detail": "Not found."}
+        with self._lock:
+            failure = self._failures.pop(0) if self._failures else None
+            if failure is None and self.rate_limit:
+                now = time.monotonic()
+                self._tokens = min(self.rate_limit, self._tokens + (now - self._tokens_updated) * self.rate_limit)
+                self._tokens_updated = now
+                if self._tokens >= 1:
+                    self._tokens -= 1
+                else:
+                    failure = (429, math.ceil((1 - self._tokens) / self.rate_limit))
+        if failure is None and self.error_rate and random.random() < self.error_rate:
+            failure = (self.error_status, None)
+        if failure:
+            status, retry_after = failure
+            self._count(method, template, status)
+            return status, {"Retry-After": str(retry_after)} if retry_after is not None else {}, {"detail": "Injected error."}
+        if role != route_role:
+            self._count(method, template, 403)
+            return 403, {}, {"detail": f"{template} requires the {route_role} certificate."}
+        with self._lock:
+            self._advance()
+            try:
+                status, payload = getattr(self, handler)(query=query, body=body, **match.groupdict())
+            except KeyError:
+                status, payload = 404, {"detail": "Not found."}
+        self._count(method, template, status)
+        return status, {}, payload
+
+    def _count(self, method: str, template: str, status: int) -> None:
+        with self._lock:
+            self.requests[f"{method} {template}"] += 1
+            self.request_log.append((time.time(), method, template, status))
+
+    def _page(self, elements: list, query: dict, path: str) -> tuple:
+        filters = {key: value for key, value in query.items() if key not in ("limit", "offset")}
+        elements = [element for element in elements
+                    if all(str(element.get(key)) == value for key, value in filters.items())]
+        limit = int(query.get("limit", self.page_size))
+        offset = int(query.get("offset", 0))
+        next_url = None
+        if offset + limit < len(elements):
+            next_url = f"https://127.0.0.1:{self.port}{path}?" + urlencode(dict(filters, limit=limit, offset=offset + limit))
+        return 200, {"count": len(elements), "next": next_url, "results": elements[offset:offset + limit]}
+
+    # State transitions
+
+    def _advance(self) -> None:
+        now = time.time()
+        for upload in self.uploads.values():
+            if upload["state"] == "processing" and now >= upload["ready_at"]:
+                upload["state"] = "ready"
+                stack = list()
+                for component in upload["components"]:
+                    component_id = next(self._ids)
+                    self.components[component_id] = dict(id=component_id, component_id=component["id"],
+                                                         vendor_version=component["vendorVersion"], state="Ready")
+                    stack.append(dict(component_id=component["id"], version=component["vendorVersion"]))
+                batch_id = next(self._ids)
+                self.batches[batch_id] = dict(id=batch_id, batch_type="component", state="Waiting_validation",
+                                              component_stack_to=stack, service=None, approved_at=None)
+        for batch in self.batches.values():
+            if batch["batch_type"] == "component" and batch["state"] == "Approved" and not batch.get("installed") \
+                    and now >= batch["approved_at"] + self.transition_delay:
+                batch["installed"] = True
+                for unit in self.units.values():
+                    if unit["update_failed"]:
+                        continue
+                    for component in batch["component_stack_to"]:
+                        if component["component_id"] in unit["components"]:
+                            unit["components"][component["component_id"]] = component["version"]
+
+    def _service_instance(self, service: dict, unit=None) -> dict:
+        approved = [batch for batch in self.batches.values()
+                    if batch["batch_type"] == "service_layer" and batch["service"]["uuid"] == service["uuid"] and batch["state"] == "Approved"]
+        if service["versions"] and approved and time.time() >= max(batch["approved_at"] for batch in approved) + self.transition_delay:
+            return dict(aos_version=service["versions"][0], run_state="failed" if unit and unit["update_failed"] else "active")
+        return dict(aos_version=service["versions"][1] if len(service["versions"]) > 1 else None, run_state="pending")
+
+    # Handlers: each returns (status, payload)
+
+    def list_services(self, query, body):
+        return self._page([dict(id=sv["id"], uuid=sv["uuid"], title=sv["title"]) for sv in self.services.values()], query, "/api/v1/services/")
+
+    def create_service(self, query, body):
+        data = json.loads(body)
+        service_id = next(self._ids)
+        service = dict(id=service_id, uuid=str(uuid.uuid4()), title=data["title"], description=data.get("description"), versions=list())
+        self.services[service_id] = service
+        return 201, dict(id=service_id, uuid=service["uuid"], title=service["title"])
+
+    def delete_service(self, query, body, id):
+        service = self.services.pop(int(id))
+        for subject in self.subjects.values():
+            subject["services"].discard(service["uuid"])
+        return 204, None
+
+    def _service_by_uuid(self, uuid):
+        return next(sv for sv in self.services.values() if sv["uuid"] == uuid)
+
+    def list_service_versions(self, query, body, uuid):
+        service = self._service_by_uuid(uuid)
+        return self._page([dict(id=version) for version in service["versions"]], query, f"/api/v1/services/{uuid}/service-versions/")
+
+    def create_service_version(self, query, body, uuid):
+        service = self._service_by_uuid(uuid)
+        version_id = next(self._ids)
+        service["versions"].insert(0, version_id)
+        batch_id = next(self._ids)
+        self.batches[batch_id] = dict(id=batch_id, batch_type="service_layer", state="Waiting_validation", component_stack_to=None,
+                                      service=dict(uuid=uuid, title=service["title"]), approved_at=None)
+        return 201, dict(id=version_id)
+
+    def list_subjects(self, query, body):
+        return self._page([dict(id=sbj["id"], label=sbj["label"], priority=sbj["priority"], is_group=sbj["is_group"])
+                           for sbj in self.subjects.values()], query, "/api/v1/subjects/")
+
+    def create_subject(self, query, body):
+        data = json.loads(body)
+        subject_id = next(self._ids)
+        self.subjects[subject_id] = dict(id=subject_id, label=data["label"], priority=data.get("priority", 0),
+                                         is_group=data.get("is_group", True), services=set(), units=set())
+        return 201, dict(id=subject_id, label=data["label"])
+
+    def delete_subject(self, query, body, id):
+        del self.subjects[int(id)]
+        return 204, None
+
+    def list_subject_services(self, query, body, id):
+        return self._page([dict(service=dict(uuid=uuid)) for uuid in sorted(self.subjects[int(id)]["services"])],
+                          query, f"/api/v1/subjects/{id}/services/")
+
+    def assign_subject_services(self, query, body, id):
+        self.subjects[int(id)]["services"].update(json.loads(body)["service_uuids"])
+        return 201, {}
+
+    def unassign_subject_services(self, query, body, id):
+        self.subjects[int(id)]["services"].difference_update(json.loads(body)["service_uuids"])
+        return 204, None
+
+    def list_subject_units(self, query, body, id):
+        return self._page([dict(system_uid=system_uid) for system_uid in sorted(self.subjects[int(id)]["units"])],
+                          query, f"/api/v1/subjects/{id}/units/")
+
+    def assign_subject_units(self, query, body, id):
+        self.subjects[int(id)]["units"].update(json.loads(body)["system_uids"])
+        return 201, {}
+
+    def unassign_subject_units(self, query, body, id):
+        self.subjects[int(id)]["units"].difference_update(json.loads(body)["system_uids"])
+        return 204, None
+
+    def _unit_detail(self, unit: dict) -> dict:
+        return dict(id=unit["id"], system_uid=unit["system_uid"],
+                    unit_update_components=[dict(component_id=component_id, installed_component=dict(vendor_version=version),
+                                                 status="failed" if unit["update_failed"] else "installed")
+                                            for component_id, version in unit["components"].items()])
+
+    def list_units(self, query, body):
+        return self._page([self._unit_detail(unit) for unit in self.units.values()], query, "/api/v1/units/")
+
+    def get_unit(self, query, body, id):
+        unit = next(unit for unit in self.units.values() if str(unit["id"]) == id)
+        return 200, self._unit_detail(unit)
+
+    def get_connection_info(self, query, body, system_uid):
+        return 200, dict(is_online=self.units[system_uid]["is_online"])
+
+    def get_monitoring(self, query, body, system_uid):
+        self.units[system_uid]
+        timestamp = time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime())
+        return 200, [{metric: [dict(timestamp=timestamp, value=round(random.uniform(low, high), 2))]
+                      for metric, (low, high) in dict(cpu=(1, 60), ram=(1e8, 5e8), usedDisk=(1e9, 2e9),
+                                                      inTraffic=(0, 1e5), outTraffic=(0, 1e5)).items()}]
+
+    def list_unit_services(self, query, body, system_uid):
+        unit = self.units[system_uid]
+        uuids = sorted({uuid for subject in self.subjects.values() if system_uid in subject["units"] for uuid in subject["services"]})
+        results = [dict(service=dict(uuid=uuid), instances=[self._service_instance(self._service_by_uuid(uuid), unit)])
+                   for uuid in uuids if any(sv["uuid"] == uuid for sv in self.services.values())]
+        return self._page(results, query, f"/api/v1/units/{system_uid}/subjects-services/")
+
+    def list_unit_models(self, query, body):
+        return self._page([dict(id=model["id"], name=model["name"]) for model in self.unit_models.values()], query, "/api/v1/unit-models/")
+
+    def update_unit_model(self, query, body, id):
+        self.unit_models[int(id)]["unit_config"] = json.loads(body).get("unit_config")
+        return 200, dict(id=int(id))
+
+    def upload_batch_file(self, query, body):
+        # Components built from the file get a version derived from its content, so identical uploads match
+        version = "1.0.0-" + hashlib.sha256(body).hexdigest()[:12]
+        # A file named after one of the components, e.g. "<component id>.bin", only builds that component
+        filename = re.search(rb'filename="([^"]*)"', body[:4096])
+        stem = os.path.splitext(filename.group(1).decode())[0] if filename else None
+        component_ids = [stem] if stem in self.firmware_components else self.firmware_components
+        upload_id = next(self._ids)
+        self.uploads[upload_id] = dict(id=upload_id, state="processing", ready_at=time.time() + self.transition_delay,
+                                       components=[dict(id=component_id, vendorVersion=version) for component_id in component_ids])
+        return 201, dict(id=upload_id)
+
+    def get_upload(self, query, body, id):
+        upload = self.uploads[int(id)]
+        metadata = dict(components=upload["components"]) if upload["state"] == "ready" else None
+        return 200, dict(id=upload["id"], state=upload["state"], metadata_info=metadata)
+
+    def list_components(self, query, body):
+        return self._page(list(self.components.values()), query, "/api/v1/update-components/")
+
+    def delete_component(self, query, body, id):
+        del self.components[int(id)]
+        return 204, None
+
+    def list_batches(self, query, body):
+        return self._page([{key: value for key, value in batch.items() if key not in ("approved_at", "installed")}
+                           for batch in self.batches.values()], query, "/api/v1/fleet-validation-batch/")
+
+    def approve_batch(self, query, body, id):
+        batch = self.batches[int(id)]
+        batch["state"] = "Approved" if json.loads(body).get("is_valid") else "Invalid"
+        batch["approved_at"] = time.time()
+        return 200, dict(id=batch["id"], state=batch["state"])
+
+
+class _Handler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    # Headers and body are written separately, Nagle's algorithm would delay the body by an ACK
+    disable_nagle_algorithm = True
+
+    def log_message(self, format, *args):
+        pass
+
+    def _handle(self):
+        mock = self.server.mock
+        url = urlparse(self.path)
+        query = {key: values[-1] for key, values in parse_qs(url.query).items()}
+        length = int(self.headers.get("Content-Length") or 0)
+        body = self.rfile.read(length) if length else b""
+        common_name = dict(field[0] for field in self.connection.getpeercert()["subject"]).get("commonName", "")
+        role = common_name.rsplit("-", 1)[-1]
+        status, headers, payload = mock.dispatch(self.command, url.path, query, body, role)
+        content = b"" if payload is None else json.dumps(payload).encode()
+        if self.command == "GET" and status == 200 and mock.etags:
+            headers["ETag"] = '"{}"'.format(hashlib.sha256(content).hexdigest()[:32])
+            if self.headers.get("If-None-Match") == headers["ETag"]:
+                status, content = 304, b""
+        self.send_response(status)
+        for name, value in headers.items():
+            self.send_header(name, value)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(content)))
+        try:
+            self.end_headers()
+            self.wfile.write(content)
+        except (ConnectionError, ssl.SSLError):
+            # The client timed out or a hedged duplicate already answered it
+            self.close_connection = True
+
+    do_GET = do_POST = do_PATCH = do_DELETE = _handle
+
+
+# "aos-signer go" stand-in written by MockAosCloud.install_tools
+_SIGNER_SCRIPT = '''import os
+import ssl
+import sys
+import yaml
+import urllib.request
+
+if sys.argv[1:2] != ["go"]:
+    sys.exit(0)
+with open(os.path.join("meta", "config.yaml")) as file:
+    service_uid = yaml.safe_load(file)["publish"]["service_uid"]
+security_dir = os.environ["AOS_SECURITY_DIR"]
+context = ssl.create_default_context(cafile=os.path.join(security_dir, "aos-root-certificate.pem"))
+context.load_cert_chain(os.path.join(security_dir, "aos-long-user-sp.pem"))
+request = urllib.request.Request(f"{os.environ['AOS_SP_URL']}/services/{service_uid}/service-versions/", data=b"{}", method="POST")
+urllib.request.urlopen(request, context=context)
+'''
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Serve a local stand-in of the AosCloud REST API")
+    parser.add_argument("--port", type = int, default = 10000)
+    parser.add_argument("--security-dir", nargs = "?", required = True,
+                        help = "Directory of the generated certificates, use it as AOS_SECURITY_DIR")
+    parser.add_argument("--unit", action = "append", default = [], help = "System uid of a simulated unit")
+    parser.add_argument("--unit-model", action = "append", default = [], help = "Name of a simulated unit model")
+    parser.add_argument("--latency", type = float, default = 0.0)
+    parser.add_argument("--jitter", type = float, default = 0.0)
+    parser.add_argument("--page-size", type = int, default = 100)
+    parser.add_argument("--error-rate", type = float, default = 0.0)
+    parser.add_argument("--transition-delay", type = float, default = 0.5)
+    parser.add_argument("--rate-limit", type = float, default = 0.0,
+                        help = "Requests per second above which 429 Too Many Requests is answered")
+    parser.add_argument("--slow-rate", type = float, default = 0.0,
+                        help = "Probability of a slow response")
+    parser.add_argument("--slow-latency", type = float, default = 2.0,
+                        help = "Seconds added to a slow response")
+    args = parser.parse_args()
+    mock = MockAosCloud(units=args.unit, unit_models=args.unit_model, latency=args.latency, jitter=args.jitter,
+                        page_size=args.page_size, error_rate=args.error_rate, transition_delay=args.transition_delay, rate_limit=args.rate_limit,
+                        slow_rate=args.slow_rate, slow_latency=args.slow_latency, security_dir=args.security_dir, port=args.port).start()
+    for name, value in mock.client_environment().items():
+        print(f"export {name}={value}")
+    try:
+        threading.Event().wait()
+    except KeyboardInterrupt:
+        mock.stop()
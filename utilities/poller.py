@@ -0,0 +1,73 @@
+import os
+import time
+import heapq
+import random
+
+class Poller():
+    """
+        Deadline-aware polling with exponential backoff and jitter, shared by every wait loop.
+        A watch is a poll function returning the current state and a predicate telling whether
+        that state is the awaited one. The delay between two polls of a watch starts at
+        "interval", is multiplied by "factor" after each unsuccessful poll up to "max_interval",
+        and is randomized by +/- "jitter" so that many watches do not hit AosCloud in lockstep.
+        No poll is started after the deadline.
+    """
+    def __init__(self, interval=1.0, max_interval=15.0, factor=1.5, jitter=0.1):
+        self.interval = interval
+        self.max_interval = max_interval
+        self.factor = factor
+        self.jitter = jitter
+
+    def _next_delay(self, delay: float) -> float:
+        return min(delay * self.factor, self.max_interval)
+
+    def _jittered(self, delay: float) -> float:
+        return delay * random.uniform(1 - self.jitter, 1 + self.jitter)
+
+    def wait(self, poll, predicate=bool, timeout=60):
+        """
+            Poll until the predicate accepts the polled state or the deadline is reached
+            Parameters:
+                poll: function without parameters returning the current state (class 'function')
+                predicate: function returning True when the state is the awaited one (class 'function')
+                timeout: seconds from now until the deadline (class 'int' or 'float')
+            Return type: class 'tuple' (done, last polled state)
+        """
+        result = self.wait_many({None: (poll, predicate)}, timeout)
+        return result[None]
+
+    def wait_many(self, watches: dict, timeout=60) -> dict:
+        """
+            Run many watches in a single loop, e.g. one per unit or per batch file. Each watch has
+            its own backoff and is dropped from the loop as soon as its predicate is satisfied.
+            Parameters:
+                watches: name of the watch mapped to a (poll, predicate) tuple (class 'dict')
+                timeout: seconds from now until the shared deadline (class 'int' or 'float')
+            Return type: class 'dict' mapping the name of each watch to (done, last polled state)
+        """
+        deadline = time.monotonic() + timeout
+        results = {name: (False, None) for name in watches}
+        # Scheduled polls as (due time, sequence, name, current delay)
+        schedule = [(time.monotonic(), seq, name, self.interval) for seq, name in enumerate(watches)]
+        heapq.heapify(schedule)
+        seq = len(schedule)
+        while schedule:
+            due, _, name, delay = heapq.heappop(schedule)
+            now = time.monotonic()
+            if due > deadline:
+                break
+            if due > now:
+                time.sleep(due - now)
+            poll, predicate = watches[name]
+            state = poll()
+            done = bool(predicate(state))
+            results[name] = (done, state)
+            if not done:
+                heapq.heappush(schedule, (time.monotonic() + self._jittered(delay), seq, name, self._next_delay(delay)))
+                seq += 1
+        return results
+
+
+# Default poller of AosCloud wait loops, tunable without code changes
+default_poller = Poller(interval = float(os.environ.get("AOS_POLL_INTERVAL", 1.0)),
+                        max_interval = float(os.environ.get("AOS_POLL_MAX_INTERVAL", 15.0)))
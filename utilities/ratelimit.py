@@ -0,0 +1,97 @@
+import time
+import threading
+from email.utils import parsedate_to_datetime
+
+class TokenBucket():
+    """
+        Thread-safe token bucket: requests take one token each and tokens are refilled at "rate"
+        per second up to "burst". When the server throttles (HTTP 429) the rate is halved and every
+        caller waits until the Retry-After delay has passed; each successful request then raises
+        the rate again by a small step, up to the configured rate (additive increase,
+        multiplicative decrease). A rate of 0 disables the bucket but still honors Retry-After.
+    """
+    def __init__(self, rate: float, burst=None, min_rate=0.5, recovery=50):
+        """
+            Parameters:
+                rate: maximum sustained requests per second, 0 for no limit (class 'float')
+                burst: maximum number of requests sent at once, defaults to max(rate, 1) (class 'int')
+                min_rate: lowest rate reached after repeated throttling (class 'float')
+                recovery: number of successful requests to climb back from 0 to the configured rate (class 'int')
+        """
+        self.max_rate = rate
+        self.rate = rate
+        self.burst = burst or max(rate, 1)
+        self.min_rate = min_rate
+        self.recovery = recovery
+        self.tokens = self.burst
+        self.updated = time.monotonic()
+        self.blocked_until = 0.0
+        self.throttled = 0
+        self._lock = threading.Lock()
+
+    def _refill(self, now: float) -> None:
+        self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def acquire(self) -> float:
+        """
+            Wait until a request may be sent
+            Return type: class 'float', the number of seconds waited
+        """
+        waited = 0.0
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                delay = self.blocked_until - now
+                if delay <= 0:
+                    if not self.max_rate:
+                        return waited
+                    self._refill(now)
+                    if self.tokens >= 1:
+                        self.tokens -= 1
+                        return waited
+                    delay = (1 - self.tokens) / self.rate
+            time.sleep(delay)
+            waited += delay
+
+    def throttle(self, retry_after=None) -> None:
+        """
+            Slow down after a 429 response: halve the rate and block every caller for retry_after
+            seconds, or until the next token is due if the server did not say
+        """
+        with self._lock:
+            now = time.monotonic()
+            self.throttled += 1
+            if self.max_rate:
+                self._refill(now)
+                self.rate = max(self.rate / 2, self.min_rate)
+                self.tokens = min(self.tokens, 0)
+            delay = retry_after if retry_after is not None else (1 / self.rate if self.rate else 1.0)
+            self.blocked_until = max(self.blocked_until, now + delay)
+
+    def succeed(self) -> None:
+        with self._lock:
+            if self.max_rate and self.rate < self.max_rate:
+                self._refill(time.monotonic())
+                self.rate = min(self.max_rate, self.rate + self.max_rate / self.recovery)
+
+    def stats(self) -> dict:
+        with self._lock:
+            return dict(rate=self.rate, max_rate=self.max_rate, burst=self.burst, throttled=self.throttled)
+
+
+def parse_retry_after(value):
+    """
+        Return the delay in seconds of a Retry-After header, given in seconds or as an HTTP date,
+        or None if it is missing or invalid
+    """
+    if not value:
+        return None
+    try:
+        return max(float(value), 0.0)
+    except ValueError:
+        pass
+    try:
+        return max(parsedate_to_datetime(value).timestamp() - time.time(), 0.0)
+    except (TypeError, ValueError):
+        return None
@@ -0,0 +1,120 @@
+import os
+import random
+import threading
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED, TimeoutError as FuturesTimeoutError
+from requests.exceptions import ConnectTimeout
+from urllib3.exceptions import NewConnectionError
+
+from .metrics import submit_in_context
+
+# Methods that can be sent twice with the same effect (RFC 9110)
+IDEMPOTENT_METHODS = {"GET", "HEAD", "OPTIONS", "PUT", "DELETE"}
+
+class RetryPolicy():
+    """
+        How a request is retried and how long its attempts may take:
+        - up to "attempts" attempts for connection errors, timeouts and the "retry_statuses"
+          server errors, separated by an exponential backoff with full jitter
+        - a request that is not idempotent is only sent again when the previous attempt could not
+          connect, i.e. never reached AosCloud
+        - each attempt has a connect and a read timeout, so a stalled socket cannot hang a stage
+        - GETs are hedged when "hedge_percentile" is set: if no response arrived after that
+          percentile of the endpoint latency, a duplicate is sent and the first response wins
+        Defaults can be changed with AOS_RETRIES, AOS_CONNECT_TIMEOUT, AOS_READ_TIMEOUT and
+        AOS_HEDGE_PERCENTILE (e.g. 0.95, 0 to disable hedging).
+    """
+    def __init__(self, attempts=None, backoff=0.5, max_backoff=8.0, retry_statuses=(500, 502, 503, 504),
+                 connect_timeout=None, read_timeout=None, idempotent=None, hedge_percentile=None, hedge_min_delay=0.05):
+        """
+            Parameters:
+                attempts: maximum number of attempts (class 'int')
+                backoff, max_backoff: first and maximum delay in seconds between attempts (class 'float')
+                retry_statuses: status codes retried (class 'tuple')
+                connect_timeout, read_timeout: seconds per attempt (class 'float')
+                idempotent: whether the request may be sent again, by default depending on the method (class 'bool')
+                hedge_percentile: latency percentile of the endpoint after which a GET is duplicated (class 'float')
+                hedge_min_delay: lowest delay in seconds before a duplicate is sent (class 'float')
+        """
+        self.attempts = attempts or int(os.environ.get("AOS_RETRIES", 3))
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        self.retry_statuses = retry_statuses
+        self.connect_timeout = connect_timeout or float(os.environ.get("AOS_CONNECT_TIMEOUT", 10))
+        self.read_timeout = read_timeout or float(os.environ.get("AOS_READ_TIMEOUT", 60))
+        self.idempotent = idempotent
+        self.hedge_percentile = hedge_percentile if hedge_percentile is not None else float(os.environ.get("AOS_HEDGE_PERCENTILE", 0))
+        self.hedge_min_delay = hedge_min_delay
+
+    @property
+    def timeout(self) -> tuple:
+        return (self.connect_timeout, self.read_timeout)
+
+    def is_idempotent(self, method: str) -> bool:
+        return self.idempotent if self.idempotent is not None else method in IDEMPOTENT_METHODS
+
+    def may_retry(self, method: str, attempt: int, received=True) -> bool:
+        """
+            Whether another attempt may follow "attempt" failed attempts
+            Parameters:
+                received: False if the last attempt could not connect and so never reached AosCloud (class 'bool')
+        """
+        return attempt < self.attempts and (self.is_idempotent(method) or not received)
+
+    def delay(self, attempt: int) -> float:
+        """
+            Seconds to wait after "attempt" failed attempts: exponential backoff with full jitter
+        """
+        return random.uniform(0, min(self.max_backoff, self.backoff * 2 ** (attempt - 1)))
+
+
+def never_sent(error) -> bool:
+    """
+        Whether a requests exception was raised before the request could reach the server
+    """
+    if isinstance(error, ConnectTimeout):
+        return True
+    reason = getattr(error.args[0], "reason", None) if error.args else None
+    return isinstance(reason, NewConnectionError)
+
+
+class Hedger():
+    """
+        Send a duplicate of a slow request and return whichever response arrives first. The other
+        request is left to finish in the background and its response is dropped.
+    """
+    def __init__(self, max_workers=16):
+        self.executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="aos-hedge")
+        self._lock = threading.Lock()
+        self._stats = dict(hedged=0, won=0)
+
+    def call(self, send, delay: float):
+        """
+            Call send() and, if it did not return after delay seconds, call it a second time
+            Return type: the result of the first call of send() that did not raise
+        """
+        first = submit_in_context(self.executor, send)
+        try:
+            return first.result(timeout=delay)
+        except FuturesTimeoutError:
+            pass
+        second = submit_in_context(self.executor, send)
+        with self._lock:
+            self._stats["hedged"] += 1
+        pending = {first, second}
+        while True:
+            done, pending = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                if future.exception() is None or not pending:
+                    if future is second and future.exception() is None:
+                        with self._lock:
+                            self._stats["won"] += 1
+                    return future.result()
+
+    def stats(self) -> dict:
+        """
+            Return type: class 'dict' with the number of "hedged" requests and of those "won" by the duplicate
+        """
+        with self._lock:
+            return dict(self._stats)
+
+default_hedger = Hedger(max_workers = int(os.environ.get("AOS_POOL_SIZE", 10)))
@@ -0,0 +1,64 @@
+import time
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+
+from .metrics import submit_in_context
+
+class StageScheduler():
+    """
+        Run the stages of a test pipeline declared as a small dependency graph. A stage starts as
+        soon as all the stages it depends on have finished, so independent stages overlap and the
+        pipeline takes as long as its longest chain instead of the sum of all stages. A stage whose
+        dependency raised an exception is skipped. Stages run with a copy of the caller's context
+        variables, e.g. the unit whose logs are being captured.
+    """
+    def __init__(self, max_workers=None):
+        self.max_workers = max_workers
+        self.stages = dict()
+
+    def add(self, name: str, func, depends=()) -> None:
+        """
+            Declare a stage
+            Parameters:
+                name: unique name of the stage (class 'str')
+                func: function without parameters running the stage (class 'function')
+                depends: names of the stages that must finish first (class 'tuple')
+        """
+        for dependency in depends:
+            if dependency not in self.stages:
+                raise ValueError(f"Stage {name} depends on unknown stage {dependency}")
+        self.stages[name] = (func, tuple(depends))
+
+    def run(self) -> dict:
+        """
+            Run every stage and return its outcome
+            Return type: class 'dict' mapping the name of each stage to a dict with keys
+                         "result", "error", "start" and "end" (epoch seconds, None if skipped)
+        """
+        outcomes = dict()
+        pending = dict(self.stages)
+        running = dict()
+        with ThreadPoolExecutor(max_workers=self.max_workers or len(self.stages) or 1,
+                                thread_name_prefix="stage") as executor:
+            while pending or running:
+                for name, (func, depends) in list(pending.items()):
+                    if not all(dependency in outcomes for dependency in depends):
+                        continue
+                    del pending[name]
+                    if any(outcomes[dependency]["error"] for dependency in depends):
+                        outcomes[name] = dict(result=None, error="skipped: dependency failed", start=None, end=None)
+                        continue
+                    running[submit_in_context(executor, self._run_stage, func)] = name
+                if not running:
+                    continue
+                done, _ = wait(running, return_when=FIRST_COMPLETED)
+                for future in done:
+                    outcomes[running.pop(future)] = future.result()
+        return outcomes
+
+    @staticmethod
+    def _run_stage(func) -> dict:
+        start = time.time()
+        try:
+            return dict(result=func(), error=None, start=start, end=time.time())
+        except (Exception, SystemExit) as err:
+            return dict(result=None, error=repr(err), start=start, end=time.time())
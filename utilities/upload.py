@@ -0,0 +1,162 @@
+import os
+import time
+import uuid
+import hashlib
+import logging
+
+log = logging.getLogger(__name__)
+
+class MultipartFileStream():
+    """
+        multipart/form-data request body that streams a single file from disk in fixed-size
+        chunks, so uploading a batch file of hundreds of MB uses constant memory. It is passed
+        as the "data" of a request together with its "content_type" header; its length is known
+        in advance so the request is sent with a Content-Length instead of chunked encoding.
+        While the body is read, the sent bytes, throughput and a running SHA-256 of the file
+        are tracked and reported to an optional progress callback.
+    """
+    def __init__(self, path: str, field="file", filename=None, chunk_size=1024 * 1024, progress=None):
+        """
+            Parameters:
+                path: path of the file to upload (class 'str')
+                field: name of the form field (class 'str')
+                filename: file name sent to the server, defaults to the base name of path (class 'str')
+                chunk_size: number of bytes read from disk at once (class 'int')
+                progress: function called with (sent bytes, total bytes, bytes per second) (class 'function')
+        """
+        self.path = path
+        self.chunk_size = chunk_size
+        self.progress = progress or self.log_progress
+        boundary = uuid.uuid4().hex
+        self.content_type = f"multipart/form-data; boundary={boundary}"
+        self.file_size = os.path.getsize(path)
+        self._head = (f"--{boundary}\r\n"
+                      f"Content-Disposition: form-data; name=\"{field}\"; filename=\"{filename or os.path.basename(path)}\"\r\n"
+                      f"Content-Type: application/octet-stream\r\n\r\n").encode()
+        self._tail = f"\r\n--{boundary}--\r\n".encode()
+        self._file = None
+        self.seek(0)
+
+    def __len__(self) -> int:
+        return len(self._head) + self.file_size + len(self._tail)
+
+    def __iter__(self):
+        while chunk := self.read(self.chunk_size):
+            yield chunk
+
+    def seek(self, offset: int, whence=os.SEEK_SET) -> int:
+        """
+            Only rewinding to the start is supported, which is what a retried request needs
+        """
+        if offset != 0 or whence != os.SEEK_SET:
+            raise OSError("MultipartFileStream can only be rewound to the start")
+        if self._file:
+            self._file.close()
+        self._file = None
+        self._position = 0
+        self._sha256 = hashlib.sha256()
+        self._start_time = None
+        self._reported = 0
+        return 0
+
+    def tell(self) -> int:
+        return self._position
+
+    def read(self, size=-1) -> bytes:
+        if self._start_time is None:
+            self._start_time = time.monotonic()
+        if size is None or size < 0:
+            size = len(self) - self._position
+        chunk = b""
+        while len(chunk) < size and self._position < len(self):
+            chunk += self._read_part(size - len(chunk))
+        self._report()
+        return chunk
+
+    def _read_part(self, size: int) -> bytes:
+        head_end = len(self._head)
+        file_end = head_end + self.file_size
+        if self._position < head_end:
+            data = self._head[self._position:self._position + size]
+        elif self._position < file_end:
+            if self._file is None:
+                self._file = open(self.path, "rb")
+            data = self._file.read(min(size, self.chunk_size, file_end - self._position))
+            if not data:
+                raise OSError(f"{self.path} was truncated during upload")
+            self._sha256.update(data)
+        else:
+            offset = self._position - file_end
+            data = self._tail[offset:offset + size]
+            if self._file:
+                self._file.close()
+                self._file = None
+        self._position += len(data)
+        return data
+
+    @property
+    def sent(self) -> int:
+        """
+            Number of file bytes sent so far
+        """
+        return min(max(self._position - len(self._head), 0), self.file_size)
+
+    @property
+    def throughput(self) -> float:
+        """
+            Average upload throughput in bytes per second
+        """
+        elapsed = time.monotonic() - self._start_time if self._start_time else 0
+        return self.sent / elapsed if elapsed > 0 else 0.0
+
+    @property
+    def sha256(self) -> str:
+        """
+            SHA-256 of the file bytes sent so far, the checksum of the whole file once the upload is done
+        """
+        return self._sha256.hexdigest()
+
+    def _report(self) -> None:
+        # Report at most every 10% of the file and once the upload is complete
+        step = max(self.file_size // 10, 1)
+        if self.sent - self._reported >= step or (self.sent == self.file_size and self._reported < self.file_size):
+            self._reported = self.sent
+            self.progress(self.sent, self.file_size, self.throughput)
+
+    @staticmethod
+    def log_progress(sent: int, total: int, throughput: float) -> None:
+        percent = 100 * sent // total if total else 100
+        log.info(f"UPLOADED {sent / 2**20:.1f}/{total / 2**20:.1f} MB ({percent}%) AT {throughput / 2**20:.2f} MB/s")
+
+
+def file_sha256(path: str, chunk_size=1024 * 1024) -> str:
+    """
+        Return the SHA-256 of a file, read from disk in fixed-size chunks
+    """
+    sha256 = hashlib.sha256()
+    with open(path, "rb") as file:
+        while chunk := file.read(chunk_size):
+            sha256.update(chunk)
+    return sha256.hexdigest()
+
+def tree_sha256(*paths, chunk_size=1024 * 1024) -> str:
+    """
+        Return a SHA-256 of the name and content of every file in the given files and directories,
+        walked in a stable order and skipping __pycache__, so it only changes when a file is added,
+        removed, renamed or modified
+    """
+    sha256 = hashlib.sha256()
+    for root in paths:
+        if os.path.isfile(root):
+            files = [root]
+        else:
+            files = sorted(os.path.join(directory, name) for directory, subdirs, names in os.walk(root)
+                           if "__pycache__" not in directory.split(os.sep) for name in names)
+        for path in files:
+            sha256.update(os.path.relpath(path, os.path.dirname(root)).encode() + b"\0")
+            with open(path, "rb") as file:
+                while chunk := file.read(chunk_size):
+                    sha256.update(chunk)
+            sha256.update(b"\0")
+    return sha256.hexdigest()
+